@@ -0,0 +1,287 @@
+# 余振中 (Yu Chen Chung)
+# analytics_utils.py
+# 相關 / 回歸分析：所有數值欄位的相關矩陣與延遲相關（例如濃度漂移是否領先硬度變化）以分塊矩陣乘法一次算完，
+# 單一欄位組合的線性（OLS）與穩健（Huber）回歸附信賴帶；結果依資料指紋快取
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from chart_specs import fingerprint
+from perf_utils import timed
+
+# 延遲相關依這個欄位排序（同一槽依時間先後），欄位不存在時沿用原始列順序
+DATE_COL = "電鍍開始時間"
+
+# 延遲批數上限：r[k] 為第 t 批與第 t+k 批的相關
+DEFAULT_MAX_LAG = 5
+
+# 成對有效筆數少於此值的相關係數視為 NaN
+MIN_PAIRS = 10
+
+# 分塊累加：每塊的暫存矩陣大小固定，與總列數無關
+BLOCK_ROWS = 262_144
+
+# Huber 權重的調整常數（常態資料下效率約 95%）
+HUBER_C = 1.345
+
+# 信賴帶在 x 範圍內取的點數
+BAND_POINTS = 50
+
+# 1. 數值欄位：布林與文字欄位（狀態、電鍍次數）不列入
+def numeric_columns(df: pd.DataFrame) -> list[str]:
+    return [c for c in df.columns
+            if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])]
+
+
+def _values(s: pd.Series) -> np.ndarray:
+    # float32 / float64 直接取用（不複製），其餘（整數、nullable）轉成 float64、缺值為 NaN
+    if s.dtype.kind == "f" and isinstance(s.dtype, np.dtype):
+        return s.to_numpy()
+    return s.to_numpy(dtype="float64", na_value=np.nan)
+
+
+# 2. 相關矩陣結果：r[k, i, j] = corr(第 t 批的 i, 第 t+k 批的 j)；k = 0 即一般的成對相關矩陣
+@dataclass(frozen=True)
+class CorrelationResult:
+    columns: tuple[str, ...]
+    r: np.ndarray       # (max_lag + 1, p, p)
+    n: np.ndarray       # 同形狀，成對有效筆數
+
+    @property
+    def max_lag(self) -> int:
+        return len(self.r) - 1
+
+    def matrix(self, lag: int = 0) -> pd.DataFrame:
+        return pd.DataFrame(self.r[lag], index=self.columns, columns=self.columns)
+
+    def cells(self, lag: int = 0) -> pd.DataFrame:
+        """熱圖用的長表：x（第 t 批）、y（第 t+lag 批）、r、n。"""
+        p = len(self.columns)
+        cols = np.asarray(self.columns, dtype=object)
+        return pd.DataFrame({
+            "x": np.repeat(cols, p),
+            "y": np.tile(cols, p),
+            "r": self.r[lag].ravel(),
+            "n": self.n[lag].ravel().astype(np.int64),
+        })
+
+    def lag_profile(self, x_col: str, y_col: str) -> pd.DataFrame:
+        """x 與 y 在各延遲下的相關：lag > 0 為 x 領先 y，lag < 0 為 y 領先 x。"""
+        i, j = self.columns.index(x_col), self.columns.index(y_col)
+        lags = np.arange(-self.max_lag, self.max_lag + 1)
+        k = np.abs(lags)
+        lead = lags >= 0
+        return pd.DataFrame({
+            "lag": lags,
+            "r": np.where(lead, self.r[k, i, j], self.r[k, j, i]),
+            "n": np.where(lead, self.n[k, i, j], self.n[k, j, i]).astype(np.int64),
+        })
+
+    def leading_pairs(self, top: int = 10) -> pd.DataFrame:
+        """各欄位組合中 |r| 最大的延遲（lag >= 1），依 |r| 由大到小；可看出哪個項目的變化領先另一個。"""
+        if self.max_lag < 1:
+            return pd.DataFrame(columns=["領先", "落後", "延遲批數", "r", "同批 r", "n"])
+        lagged = np.abs(np.nan_to_num(self.r[1:], nan=0.0))
+        best = lagged.argmax(axis=0)
+        i, j = np.nonzero(~np.eye(len(self.columns), dtype=bool))
+        k = best[i, j] + 1
+        out = pd.DataFrame({
+            "領先": np.asarray(self.columns, dtype=object)[i],
+            "落後": np.asarray(self.columns, dtype=object)[j],
+            "延遲批數": k,
+            "r": self.r[k, i, j],
+            "同批 r": self.r[0, i, j],
+            "n": self.n[k, i, j].astype(np.int64),
+        }).dropna(subset=["r"])
+        return out.reindex(out["r"].abs().sort_values(ascending=False).index).head(top).reset_index(drop=True)
+
+
+# 3. 快取：以（資料指紋, 欄位, 參數）為鍵，所有 session 共用
+_memo: OrderedDict[tuple, object] = OrderedDict()
+_memo_lock = threading.Lock()
+_MEMO_MAX = 32
+
+
+def _memoized(key: tuple, build):
+    with _memo_lock:
+        hit = _memo.get(key)
+        if hit is not None:
+            _memo.move_to_end(key)
+            return hit
+    value = build()
+    with _memo_lock:
+        _memo[key] = value
+        while len(_memo) > _MEMO_MAX:
+            _memo.popitem(last=False)
+    return value
+
+
+# 4. 分塊動差累加：每塊組成 F = [z, z², m]（z 為置中後缺值補 0 的值，m 為有值遮罩），
+#    F[:t]ᵀ · F[k:k+t] 一次給出延遲 k 的所有成對動差：Σm_i m_j、Σz_i m_j、Σz_i² m_j、Σz_i z_j …
+#    缺值以遮罩處理（pairwise deletion），不必逐對 dropna
+def _moments(arrays: list[np.ndarray], center: np.ndarray, order: np.ndarray | None, max_lag: int) -> np.ndarray:
+    n, p = len(arrays[0]), len(arrays)
+    total = np.zeros((max_lag + 1, 3 * p, 3 * p))
+    for start in range(0, n, BLOCK_ROWS):
+        end = min(start + BLOCK_ROWS, n)
+        stop = min(end + max_lag, n)          # 多取 max_lag 列，讓延遲跨塊銜接
+        rows = slice(start, stop) if order is None else order[start:stop]
+        # 欄優先（Fortran order）：逐欄就地填入，不產生中間矩陣
+        features = np.empty((stop - start, 3 * p), order="F")
+        z, z2, mask = features[:, :p], features[:, p:2 * p], features[:, 2 * p:]
+        for j, a in enumerate(arrays):
+            col = z[:, j]
+            col[:] = a[rows]
+            col -= center[j]
+            missing = np.isnan(col)
+            mask[:, j] = ~missing
+            col[missing] = 0.0
+        np.multiply(z, z, out=z2)
+        for k in range(max_lag + 1):
+            t = min(end, n - k) - start
+            if t <= 0:
+                break
+            total[k] += features[:t].T @ features[k:k + t]
+    return total
+
+
+def _correlations(g: np.ndarray, p: int) -> tuple[np.ndarray, np.ndarray]:
+    # g 的分塊（a = 第 t 批、b = 第 t+k 批）：左側 [z, z², m]ᵀ × 右側 [z, z², m]
+    sab, sa, saa = g[:, :p, :p], g[:, :p, 2 * p:], g[:, p:2 * p, 2 * p:]
+    sb, sbb, n = g[:, 2 * p:, :p], g[:, 2 * p:, p:2 * p], g[:, 2 * p:, 2 * p:]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = sab - sa * sb / n
+        va = saa - sa * sa / n
+        vb = sbb - sb * sb / n
+        r = cov / np.sqrt(va * vb)
+    r = np.where((n >= MIN_PAIRS) & (va > 0) & (vb > 0), np.clip(r, -1.0, 1.0), np.nan)
+    return r, n
+
+
+@timed()
+def correlation_matrix(df: pd.DataFrame, columns: list[str] | None = None, max_lag: int = DEFAULT_MAX_LAG,
+                       order_col: str | None = DATE_COL, key: str | None = None) -> CorrelationResult:
+    """
+    所有數值欄位的成對相關矩陣與 1..max_lag 批的延遲相關。
+    key 為代表 df 內容的資料鍵（例如資料集鍵 + 篩選條件），未提供時以欄位內容的指紋代替。
+    """
+    columns = tuple(columns or numeric_columns(df))
+    order_col = order_col if order_col in df else None
+    fp = key or fingerprint(df, [*columns, *([order_col] if order_col else [])])
+
+    def build() -> CorrelationResult:
+        p = len(columns)
+        if not p or df.empty:
+            empty = np.full((max_lag + 1, p, p), np.nan)
+            return CorrelationResult(columns, empty, np.zeros_like(empty))
+        order = None
+        if order_col is not None and not df[order_col].is_monotonic_increasing:
+            order = np.argsort(df[order_col].to_numpy(), kind="stable")     # NaT 排在最後
+        arrays = [_values(df[c]) for c in columns]
+        # 先減去欄平均再累加平方和，避免大數相減的精度損失
+        sums = np.array([np.nansum(a, dtype="float64") for a in arrays])
+        counts = np.array([np.count_nonzero(~np.isnan(a)) for a in arrays])
+        center = np.divide(sums, counts, out=np.zeros(p), where=counts > 0)
+        r, n = _correlations(_moments(arrays, center, order, max_lag), p)
+        r.setflags(write=False)
+        n.setflags(write=False)
+        return CorrelationResult(columns, r, n)
+
+    return _memoized(("corr", fp, len(df), columns, max_lag, order_col), build)
+
+
+# 5. 單一組合的回歸：OLS 與 Huber（IRLS），附平均預測值的信賴帶
+@dataclass(frozen=True)
+class PairFit:
+    method: str             # "OLS" / "Huber"
+    slope: float
+    intercept: float
+    r2: float               # Huber 為加權 R²
+    n: int
+    outliers: int           # Huber 權重 < 1 的筆數（OLS 為 0）
+    band: pd.DataFrame      # x, fit, lo, hi
+
+
+def _t_quantile(p: float, dof: float) -> float:
+    # t 分配分位數：dof 1、2 有封閉解，其餘以 Cornish-Fisher 展開（dof >= 3 時誤差 < 1e-3）
+    if dof <= 1:
+        return float(np.tan(np.pi * (p - 0.5)))
+    if dof <= 2:
+        return float((2 * p - 1) / np.sqrt(2 * p * (1 - p)))
+    z = NormalDist().inv_cdf(p)
+    g1 = (z ** 3 + z) / 4
+    g2 = (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96
+    g3 = (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384
+    g4 = (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / 92160
+    return z + g1 / dof + g2 / dof ** 2 + g3 / dof ** 3 + g4 / dof ** 4
+
+
+def _weighted_line(x: np.ndarray, y: np.ndarray, w: np.ndarray) -> tuple[float, float, float, float, float]:
+    sw = w.sum()
+    mx, my = (w * x).sum() / sw, (w * y).sum() / sw
+    dx = x - mx
+    sxx = (w * dx * dx).sum()
+    slope = (w * dx * (y - my)).sum() / sxx
+    return slope, my - slope * mx, sw, mx, sxx
+
+
+def fit_line(x: np.ndarray, y: np.ndarray, method: str = "OLS", level: float = 0.95,
+             points: int = BAND_POINTS, max_iter: int = 50, tol: float = 1e-8) -> PairFit | None:
+    """x、y 需已去除 NaN；x 沒有變異或筆數不足 3 時回傳 None。"""
+    n = len(x)
+    if n < 3 or np.ptp(x) == 0:
+        return None
+    w = np.ones(n)
+    slope, intercept, sw, mx, sxx = _weighted_line(x, y, w)
+    if method == "Huber":
+        # IRLS：殘差以 MAD 估計尺度，|r| > c·s 的點權重降為 c·s / |r|
+        for _ in range(max_iter):
+            resid = y - intercept - slope * x
+            scale = np.median(np.abs(resid - np.median(resid))) / 0.6745
+            if scale == 0:
+                break
+            u = np.abs(resid) / (HUBER_C * scale)
+            w = np.where(u <= 1, 1.0, 1.0 / np.maximum(u, 1e-12))
+            prev = (slope, intercept)
+            slope, intercept, sw, mx, sxx = _weighted_line(x, y, w)
+            if abs(slope - prev[0]) <= tol * (abs(prev[0]) + tol) and abs(intercept - prev[1]) <= tol * (abs(prev[1]) + tol):
+                break
+
+    resid = y - intercept - slope * x
+    ss_res = float((w * resid * resid).sum())
+    my = (w * y).sum() / sw
+    ss_tot = float((w * (y - my) ** 2).sum())
+    # 平均預測值的標準誤：s·sqrt(1/Σw + (x0 - x̄)² / Sxx)（Huber 以加權殘差近似）
+    s = np.sqrt(ss_res / max(sw - 2, 1))
+    grid = np.linspace(x.min(), x.max(), points)
+    fit = slope * grid + intercept
+    half = _t_quantile(0.5 + level / 2, max(n - 2, 1)) * s * np.sqrt(1 / sw + (grid - mx) ** 2 / sxx)
+    return PairFit(
+        method=method,
+        slope=float(slope),
+        intercept=float(intercept),
+        r2=1 - ss_res / ss_tot if ss_tot > 0 else float("nan"),
+        n=int(n),
+        outliers=int((w < 1).sum()),
+        band=pd.DataFrame({"x": grid, "fit": fit, "lo": fit - half, "hi": fit + half}),
+    )
+
+
+@timed()
+def pair_regression(df: pd.DataFrame, x_col: str, y_col: str, key: str | None = None,
+                    level: float = 0.95) -> dict[str, PairFit]:
+    """x_col → y_col 的 OLS 與 Huber 回歸（各自附信賴帶）；資料不足時回傳空 dict。"""
+    fp = key or fingerprint(df, [x_col, y_col])
+
+    def build() -> dict[str, PairFit]:
+        x, y = _values(df[x_col]).astype("float64"), _values(df[y_col]).astype("float64")
+        valid = ~(np.isnan(x) | np.isnan(y))
+        x, y = x[valid], y[valid]
+        fits = {method: fit_line(x, y, method, level) for method in ("OLS", "Huber")}
+        return {m: f for m, f in fits.items() if f is not None}
+
+    return _memoized(("pair", fp, len(df), x_col, y_col, level), build)
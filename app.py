@@ -2,6 +2,7 @@
 #
 import streamlit as st
 import os
+import time
 # from dotenv import load_dotenv
 
 # 1. 先把 env 載進來
@@ -20,16 +21,39 @@ st.set_page_config(
 st.title("🧪 化學分析 Excel 讀取與呈現")
 
 # 3. 導入自己寫的工具模組
-from data_utils import load_sheets, clean_numeric_columns, compute_status, parse_year_month
-from style_utils import apply_marking, filter_oos_and_style
+from data_utils import DASHBOARD_COLUMNS, load_sheets_compact_cached, load_sheets_projected_cached
+from table_utils import render_paged_table
 from chart_utils import (
     render_line_chart,
     render_pie_chart,
     render_scatter_with_trend,
     render_monthly_count_bar,
     render_monthly_material_bar,
+    render_control_chart,
+    render_correlation_heatmap,
+    render_pair_analysis,
 )
-from genai_utils import ask_gemini
+from analytics_utils import correlation_matrix, pair_regression
+from spc_utils import compute_spc
+from genai_utils import ANALYSIS_WINDOWS, build_compact_prompt, get_runner
+from time_utils import TimeBuckets, build_time_buckets
+from parse_utils import parse_stats_frame
+from threshold_utils import ThresholdConfig, apply_config, load_threshold_config, save_threshold_config
+from filter_utils import QUICK_PERIODS, FilterSpec, filter_view, get_filter_index, parse_run
+from ingest_utils import refresh_sheet
+from fleet_utils import discover_tank_sheets, fleet_summary_subprocess
+from cache_utils import file_hash
+import pandas as pd
+from store_utils import build_processed, dataset_key, get_store
+import perf_utils
+from watch_utils import latest_workbook
+from history_utils import HISTORY_DIR, open_history
+
+# 3.1 效能面板：開啟後記錄本次 rerun 各步驟的耗時、輸入輸出列數與記憶體增減；關閉時幾乎沒有額外成本
+perf_on = st.sidebar.checkbox("⏱ 效能面板", value=False)
+perf_memory = perf_on and st.sidebar.checkbox("追蹤記憶體（較慢）", value=False)
+perf_utils.enable(perf_on, track_memory=perf_memory)
+perf_utils.reset()
 
 
 # 4. 側邊欄：讓使用者上傳檔案，選 EP15 / EP16
@@ -41,41 +65,190 @@ from genai_utils import ask_gemini
 # 根目錄中的檔案名稱
 EXCEL_FILE_PATH = "電鍍履歷表.xlsx"  # ← 請修改為實際檔名，例如 "electro_data.xlsx"
 
+# 有投遞資料夾常駐程式（watch_utils.py）時，改用其中最新處理完成的工作簿；
+# 它已預先寫好共用資料集快照，這裡只讀快照，不解析 Excel
+watched = latest_workbook(os.getenv("DATASET_STORE_ARROW_DIR"))
+if watched is not None:
+    EXCEL_FILE_PATH = watched["path"]
+    st.sidebar.caption(f"📥 {os.path.basename(EXCEL_FILE_PATH)}（{time.strftime('%m-%d %H:%M:%S', time.localtime(watched['processed_at']))} 處理完成）")
+
+# 已用 history_utils.py 匯入過歷史資料庫時，可直接從 Parquet 分區讀取（只讀選到的鍍槽 / 欄位），不需要 Excel 檔
+history = open_history(HISTORY_DIR)
+use_history = history is not None and st.sidebar.checkbox("🗄 歷史資料庫（Parquet）", value=not os.path.exists(EXCEL_FILE_PATH))
+
 # 檢查檔案是否存在
-if not os.path.exists(EXCEL_FILE_PATH):
+if not use_history and not os.path.exists(EXCEL_FILE_PATH):
     st.error(f"找不到檔案：{EXCEL_FILE_PATH}，請確認檔案已放在專案根目錄下。")
     st.stop()
 
-sheets = load_sheets(EXCEL_FILE_PATH)
-sheet_name = st.sidebar.selectbox("📑 選擇分頁", list(sheets.keys()))
-df = sheets[sheet_name].copy()
+# 同一份檔案只解析一次：之後的 rerun 直接從快取（記憶體 / 磁碟快照）取得
+# 精簡模式以串流方式只讀儀表板用到的欄位，寬表、多年資料時記憶體與讀取時間都大幅下降
+# 鍍槽工作表（EP15、EP16…）自動偵測，不再寫死
+if use_history:
+    tank_sheets = tuple(history.tanks())
+elif watched is not None:
+    tank_sheets = tuple(watched["sheets"])
+else:
+    tank_sheets = tuple(discover_tank_sheets(EXCEL_FILE_PATH))
+projected = st.sidebar.checkbox("🚀 精簡欄位（串流讀取）", value=False)
+sheet_name = st.sidebar.selectbox("📑 選擇分頁", list(tank_sheets))
+
 
-# 5. 定義濃度標準範圍
-thresholds = {
-    "硫酸實際值(g/l)"     : (62,  68),
-    "硫酸銅實際值(g/l)"   : (200, 210),
-    "氯離子實際值(ppm/l)" : (64,  80),
-}
+def _load_selected_sheet():
+    if projected:
+        return load_sheets_projected_cached(EXCEL_FILE_PATH, (sheet_name,))[sheet_name]
+    # 壓縮型別（float32 / category / datetime64）後才進快取，所有 session 共用同一份精簡資料
+    return load_sheets_compact_cached(EXCEL_FILE_PATH, (sheet_name,))[sheet_name]
+
+# 5. 濃度標準範圍：設定檔（THRESHOLD_CONFIG，預設 thresholds.json）中的預設值用來清洗與建立共用資料集，
+#    各鍍槽依生效日期的修訂與側邊欄的即時調整，之後只重新判定上下限有變的欄位
+saved_config = load_threshold_config()
+thresholds = dict(saved_config.default)
+
+with st.sidebar.expander("📏 規格上下限", expanded=False):
+    st.caption(f"設定檔版次 r{saved_config.revision}（{saved_config.version}）")
+    current_limits = saved_config.current(sheet_name)
+    spec_keys, tweaked = [], {}
+    for col, (low, high) in current_limits.items():
+        c1, c2 = st.columns(2)
+        lo_key, hi_key = f"spec_lo_{sheet_name}_{col}", f"spec_hi_{sheet_name}_{col}"
+        tweaked[col] = (c1.number_input(f"{col} 下限", value=float(low), key=lo_key),
+                        c2.number_input("上限", value=float(high), key=hi_key))
+        spec_keys += [lo_key, hi_key]
+    effective = st.date_input("生效日期（空白：修改目前生效的版本）", value=None, key=f"spec_effective_{sheet_name}")
+
+    config = saved_config
+    changed = {c: v for c, v in tweaked.items() if v != current_limits[c]}
+    invalid = [c for c, (lo, hi) in changed.items() if lo > hi]
+    if invalid:
+        st.warning(f"下限大於上限：{', '.join(invalid)}")
+    elif changed:
+        if effective is not None:
+            config = config.revise(sheet_name, changed, pd.Timestamp(effective))
+        else:
+            # 沒給生效日期時，各欄位改的是它目前生效的那一筆修訂
+            for col, limits in changed.items():
+                config = config.revise(sheet_name, {col: limits}, saved_config.schedule(sheet_name, col)[-1][0])
+        st.caption(f"調整中（版本 {config.version}），只影響目前的畫面")
+        c1, c2 = st.columns(2)
+        if c1.button("💾 儲存為新版次", key="spec_save"):
+            save_threshold_config(config)
+            st.rerun()
+        if c2.button("↩ 還原", key="spec_reset"):
+            for k in spec_keys:
+                st.session_state.pop(k, None)
+            st.rerun()
+limits = config.current(sheet_name)
+
+# 5.1 全部鍍槽總覽：在獨立子行程中以行程池平行處理所有鍍槽（伺服器行程內不開行程池），各槽依設定檔中該槽的上下限時程判定；
+#     結果依（檔案內容雜湊, 設定版本）快取
+@st.cache_data(show_spinner="正在平行處理所有鍍槽…")
+def _fleet_overview(paths: tuple[str, ...], digests: tuple[str, ...], config_version: str,
+                    _config: ThresholdConfig) -> pd.DataFrame:
+    return fleet_summary_subprocess(list(paths), _config)
+
+if not use_history and st.sidebar.checkbox("🏭 全部鍍槽總覽", value=False):
+    st.subheader("🏭 全部鍍槽總覽")
+    fleet_paths = (EXCEL_FILE_PATH,)
+    overview = _fleet_overview(fleet_paths, tuple(file_hash(p) for p in fleet_paths), config.version, config)
+    st.dataframe(overview, use_container_width=True)
 
 # 6. 資料前處理
-# 6.1 先轉數值 & 去除 NaN
-df = clean_numeric_columns(df, list(thresholds.keys()))
-# 6.2 計算狀態 OK/NG
-df = compute_status(df, thresholds)
+# 歷史資料庫本身就是依月份增量匯入，不另外提供增量模式
+incremental = not use_history and st.sidebar.checkbox("⚡ 增量更新（只處理新增的列）", value=False)
+if incremental:
+    # 6.0 增量模式：只解析、清洗、判定上次之後新增的列，月彙總也只加上差量
+    ingest_state = refresh_sheet(EXCEL_FILE_PATH, sheet_name, thresholds)
+    st.sidebar.caption(f"本次新增 {ingest_state.new_rows} 列，累計 {ingest_state.raw_rows} 列")
+    df = ingest_state.data
+    threshold_result = ingest_state.threshold_result
+    buckets = TimeBuckets.from_aggregates({"month": ingest_state.monthly})
+elif use_history:
+    # 6.0.1 歷史資料庫：只讀該鍍槽的分區（精簡模式再只讀儀表板欄位）；月彙總由 DuckDB 直接對 Parquet 做 group-by
+    def _build_from_history():
+        raw = history.scan(sheet_name, columns=list(DASHBOARD_COLUMNS) if projected else None)
+        data, result, _ = build_processed(raw, thresholds, date_col="電鍍開始時間", material_col="磷銅球(kg)")
+        monthly = history.monthly(sheet_name, sum_cols=("磷銅球(kg)",), require=tuple(thresholds))
+        return data, result, TimeBuckets.from_aggregates({"month": monthly})
+
+    dataset_id = dataset_key(history.version(sheet_name), sheet_name, thresholds,
+                             "history-projected" if projected else "history-compact")
+    dataset = get_store().get_or_build(dataset_id, _build_from_history)
+    df, threshold_result, buckets = dataset.data, dataset.result, dataset.buckets
+else:
+    # 6.1 共用資料集：以（檔案雜湊, 分頁, 讀法, 門檻）為鍵，整個行程只處理一次，所有 session 共用唯讀結果
+    def _build_dataset():
+        return build_processed(_load_selected_sheet(), thresholds, date_col="電鍍開始時間", material_col="磷銅球(kg)")
+
+    dataset_id = dataset_key(
+        watched["hash"] if watched is not None else file_hash(EXCEL_FILE_PATH), sheet_name, thresholds, "projected" if projected else "compact"
+    )
+    dataset = get_store().get_or_build(dataset_id, _build_dataset)
+    df, threshold_result, buckets = dataset.data, dataset.result, dataset.buckets
+
+# 6.1.1 依設定重新判定：以（資料集鍵, 設定版本）快取，上下限調整時只重算有變的欄位
+#       鍵一律代表內容（檔案雜湊 / 歷史分區版本 / 增量狀態版本），之後的篩選索引、表格與相關分析快取都由它衍生，
+#       工作表就地修改後不會拿到舊結果
+base_key = f"ingest:{EXCEL_FILE_PATH}:{sheet_name}:{ingest_state.version}" if incremental else dataset_id
+df, threshold_result = apply_config(base_key, df, threshold_result, config, sheet_name)
 
-# 7. 標記 & 顯示全部資料
-full_styler = apply_marking(df, thresholds)
+# 6.2 篩選：索引每份資料集只建一次（排序時間、OK/NG 位置表、排序後的電鍍次數），
+#     條件變更時只做二分搜尋與切片，之後所有表格與圖表都從篩選後的 view 產生
+index_key = f"{base_key}:{config.version}"
+filter_index = get_filter_index(index_key, df, threshold_result)
+with st.sidebar.expander("🔎 篩選", expanded=False):
+    period = st.selectbox("期間", [*QUICK_PERIODS, "自訂"], key="flt_period")
+    start = end = None
+    if period == "自訂" and filter_index.date_max is not None:
+        picked = st.date_input("日期範圍", (filter_index.date_min.date(), filter_index.date_max.date()), key="flt_dates")
+        if isinstance(picked, tuple) and len(picked) == 2:
+            start = pd.Timestamp(picked[0])
+            end = pd.Timestamp(picked[1]) + pd.Timedelta(days=1) - pd.Timedelta(1, "ns")
+    elif QUICK_PERIODS.get(period) and filter_index.date_max is not None:
+        start = filter_index.date_max - pd.Timedelta(days=QUICK_PERIODS[period])
+    status = st.radio("狀態", ["全部", "OK", "NG"], horizontal=True, key="flt_status")
+    run_from = st.text_input("電鍍次數 起（例如 3-1）", key="flt_run_min").strip()
+    run_to = st.text_input("電鍍次數 迄（例如 12-50）", key="flt_run_max").strip()
+    run_min, run_max = parse_run(run_from) if run_from else None, parse_run(run_to) if run_to else None
+    if (run_from and run_min is None) or (run_to and run_max is None):
+        st.warning("電鍍次數格式應為「主-次」，例如 3-1")
+
+filter_spec = FilterSpec(start, end, None if status == "全部" else status, run_min, run_max)
+if filter_spec.active:
+    df, threshold_result = filter_view(df, threshold_result, filter_index, filter_spec)
+    if use_history and filter_spec.status is None and filter_spec.run_min is None and filter_spec.run_max is None:
+        # 只有時間條件：月彙總改由 SQL 只掃描範圍內的月份分區
+        buckets = TimeBuckets.from_aggregates({"month": history.monthly(
+            sheet_name, sum_cols=("磷銅球(kg)",), require=tuple(thresholds), start=start, end=end)})
+    else:
+        buckets = build_time_buckets(df, date_col="電鍍開始時間")
+    st.sidebar.caption(f"篩選後 {len(df)} / {filter_index.n} 筆")
+    if df.empty:
+        st.warning("沒有符合篩選條件的資料")
+        st.stop()
+
+# 7. 標記 & 顯示全部資料：伺服器端排序 / 搜尋 / 分頁，瀏覽器只收到目前這一頁（標色由超標矩陣切出）
+#    table_key 代表目前這份 df 的內容（資料集 + 規格版本 + 篩選條件），排序與搜尋結果依它快取
+table_key = f"{index_key}:{filter_spec}"
 st.subheader("📋 全部資料（已去除 NaN 且超標欄位標紅）")
-st.dataframe(full_styler, use_container_width=True)
+render_paged_table(df, threshold_result, key="full", data_key=table_key)
+
+# 7.1 數值解析統計：手填的「65.2 g/l」「64~66」等救回多少、還有哪些內容無法解析（讀檔與清洗時記錄）
+parse_stats = parse_stats_frame(df)
+if not parse_stats.empty:
+    with st.expander(f"🧹 數值解析統計（無法解析 {int(parse_stats['無法解析'].sum())} 格）", expanded=False):
+        st.dataframe(parse_stats, use_container_width=True, hide_index=True)
 
 # 8. 顯示僅超標列
-oos_styler = filter_oos_and_style(df, thresholds)
 st.subheader("🚨 僅顯示超標列（超標欄位標紅）")
-st.dataframe(oos_styler, use_container_width=True)
+render_paged_table(df, threshold_result, key="oos", data_key=table_key, oos_only=True)
 
 # 9. 多條折線圖（電鍍次數 vs 三项濃度）
 st.subheader("📈 多條折線圖（電鍍次數 vs 三項濃度）")
-render_line_chart(df, x_col="電鍍次數", y_cols=["硫酸實際值(g/l)", "硫酸銅實際值(g/l)", "氯離子實際值(ppm/l)"])
+render_line_chart(
+    df, x_col="電鍍次數", y_cols=["硫酸實際值(g/l)", "硫酸銅實際值(g/l)", "氯離子實際值(ppm/l)"],
+    keep=threshold_result.oos_rows,
+)
 
 # 10. OK / NG 圓餅圖
 st.subheader("📊 OK/NG 比例（顯示百分比）")
@@ -85,13 +258,49 @@ render_pie_chart(df, status_col="狀態")
 st.subheader("🔍 SP10平均 vs 硬度HB 散點圖 (可縮放/平移)")
 render_scatter_with_trend(df, x_col="SP10平均", y_col="硬度HB")
 
+# 11.1 相關 / 回歸分析：所有數值欄位的相關矩陣與延遲相關在伺服器端一次算完（依 table_key 快取），
+#      點選熱圖格子下鑽到該組合的 OLS / Huber 回歸（附 95% 信賴帶）與延遲相關
+st.subheader("🧮 相關性分析（點選熱圖格子查看回歸與延遲相關）")
+corr = correlation_matrix(df, key=table_key)
+corr_cols = list(corr.columns)
+if len(corr_cols) >= 2:
+    corr_lag = st.slider("延遲批數（x 為第 t 批、y 為第 t+k 批）", 0, corr.max_lag, 0, key="corr_lag")
+    picked = render_correlation_heatmap(corr, lag=corr_lag, key="corr_heatmap")
+    # 點選的格子只在改變時套用，之後仍可用下拉選單自行切換
+    if picked and picked != st.session_state.get("corr_picked"):
+        st.session_state["corr_picked"] = picked
+        st.session_state["corr_x"], st.session_state["corr_y"] = picked
+    for name, default in (("corr_x", "SP10平均"), ("corr_y", "硬度HB")):
+        if st.session_state.get(name) not in corr_cols:
+            st.session_state[name] = default if default in corr_cols else corr_cols[name == "corr_y"]
+    c1, c2 = st.columns(2)
+    x_col = c1.selectbox("x 欄位", corr_cols, key="corr_x")
+    y_col = c2.selectbox("y 欄位", corr_cols, key="corr_y")
+    fits = pair_regression(df, x_col, y_col, key=table_key)
+    render_pair_analysis(df, x_col, y_col, fits, corr, key=table_key)
+    for method, fit in fits.items():
+        note = f"，降權 {fit.outliers} 筆" if method == "Huber" else ""
+        st.caption(f"{method}：y = {fit.slope:.4g}x {fit.intercept:+.4g}，R² = {fit.r2:.3f}，n = {fit.n}{note}")
+    with st.expander("⏩ 領先關係（各組合 |r| 最大的延遲批數）", expanded=False):
+        st.dataframe(corr.leading_pairs(), use_container_width=True, hide_index=True)
+else:
+    st.info("數值欄位不足，無法計算相關性")
+
 # 12. 每月電鍍批次總數柱狀圖
 st.subheader("📈 每月電鍍批次總數")
-render_monthly_count_bar(df, date_col="電鍍開始時間")
+render_monthly_count_bar(df, date_col="電鍍開始時間", buckets=buckets)
 
 # 13. 每月磷銅球用量總和
 st.subheader("📈 每月磷銅球使用量")
-render_monthly_material_bar(df, date_col="電鍍開始時間", material_col="磷銅球(kg)")
+render_monthly_material_bar(df, date_col="電鍍開始時間", material_col="磷銅球(kg)", buckets=buckets)
+
+# 13.1 SPC 管制圖：濃度漂移在超出規格前先發出警告（μ、σ 由前 100 筆基準資料估計，見 spc_utils.init_state）
+st.subheader("📉 SPC 管制圖（EWMA / CUSUM / Western Electric 規則）")
+spc_frames, _ = compute_spc(df, list(limits.keys()), specs=limits)
+spc_col = st.selectbox("管制項目", list(limits.keys()), key="spc_col")
+spc = spc_frames[spc_col]
+st.caption(f"最近 20 筆中有 {int(spc['alarm'].tail(20).sum())} 筆觸發警報")
+render_control_chart(spc, spc_col, x=df["電鍍開始時間"] if "電鍍開始時間" in df else None)
 
 # 14. gemini api
 # st.subheader("📈 gemini api")
@@ -125,25 +334,60 @@ render_monthly_material_bar(df, date_col="電鍍開始時間", material_col="磷
 st.subheader("📈 Gemini 自動分析電鍍資料")
 
 
-# 顯示資料預覽
-st.dataframe(df)
+# 顯示資料預覽（同樣分頁，不把整份資料送到瀏覽器）
+render_paged_table(df, threshold_result, key="gemini", data_key=table_key, default_page_size=50)
 
-# 取最新 7 筆資料並轉換成文字格式（CSV 風格較易閱讀）
-latest_7 = df.tail(7)
-latest_7_text = latest_7.to_csv(index=False)
+# 以統計摘要與超標清單組成精簡 prompt（不送原始 CSV），可選擇分析範圍
+analysis_window = st.selectbox("分析範圍", list(ANALYSIS_WINDOWS), key="gemini_window")
 
-# 自動建立 prompt 並發送
-if st.button("🔍 自動分析最新7筆資料"):
-    with st.spinner("正在呼叫 Gemini 分析中…"):
-        prompt = f"""你是一位資深電鍍分析師。請根據以下電鍍資料（包含日期、濃度、電鍍次數），
-提出這7筆資料的趨勢判斷與改善建議：
-{latest_7_text}
-"""
-        
-        result = ask_gemini(prompt_text=prompt)
+# 自動建立 prompt 並送到背景執行；相同 prompt 會直接拿到快取或共用執行中的請求
+if st.button("🔍 自動分析最新資料"):
+    request = build_compact_prompt(sheet_name, analysis_window, df, threshold_result, limits)
+    st.session_state["gemini_future"] = get_runner().submit(request.prompt)
 
-        if result.startswith("Error:"):
-            st.error(result)
-        else:
-            st.markdown("**🧠 Gemini 分析回覆：**")
-            st.write(result)
\ No newline at end of file
+
+# 回覆區塊以 fragment 定時檢查，等待期間頁面其他部分仍可操作；
+# 只有請求還在執行時才定時重跑，沒送出過或已完成的 session 不會每秒輪詢
+def _show_gemini_result(polling: bool):
+    future = st.session_state.get("gemini_future")
+    if future is None:
+        return
+    if not future.done():
+        st.info("⏳ Gemini 分析中，完成後會自動顯示…")
+        return
+    if polling:
+        # 完成後整頁重跑一次，fragment 改以不輪詢的方式重新註冊
+        st.rerun()
+
+    result = future.result()
+    if result.startswith("Error:"):
+        st.error(result)
+    else:
+        st.markdown("**🧠 Gemini 分析回覆：**")
+        st.write(result)
+
+
+_gemini_pending = "gemini_future" in st.session_state and not st.session_state["gemini_future"].done()
+st.fragment(_show_gemini_result, run_every=1.0 if _gemini_pending else None)(_gemini_pending)
+
+
+# 15. 效能面板：列出本次 rerun 各步驟耗時，可下載 JSON lines 離線分析
+if perf_on:
+    perf_records = perf_utils.records()
+    run_id = f"{int(time.time() * 1000)}-{sheet_name}"
+    with st.sidebar.expander("⏱ 本次執行各步驟耗時", expanded=True):
+        if perf_records:
+            perf_df = pd.DataFrame(perf_records).drop(columns=["ts"])
+            st.dataframe(perf_df, use_container_width=True)
+            st.caption(f"共 {len(perf_df)} 個步驟，合計 {perf_df['wall_ms'].sum():.0f} ms（巢狀步驟會重複計入）")
+            if "mem_delta_mb" in perf_df:
+                st.caption("mem_delta_mb 為整個行程在該步驟期間的淨配置，其他使用者同時操作時會一併算入，僅供參考")
+        st.download_button(
+            "下載 JSON lines",
+            perf_utils.to_jsonl(run_id, {"sheet": sheet_name}),
+            file_name=f"perf_{run_id}.jsonl",
+            mime="application/jsonl",
+        )
+    # 設定 PERF_LOG_PATH 時自動附加到檔案，方便長期收集
+    if os.getenv("PERF_LOG_PATH"):
+        perf_utils.append_jsonl(os.environ["PERF_LOG_PATH"], run_id, {"sheet": sheet_name})
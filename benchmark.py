@@ -0,0 +1,116 @@
+# 余振中 (Yu Chen Chung)
+# benchmark.py
+# 效能基準：用合成電鍍履歷量測各處理步驟的耗時與記憶體尖峰
+#
+# 用法：python benchmark.py [--sizes 1000 100000 1000000] [--repeat 3] [--json bench.jsonl]
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from data_utils import DEFAULT_THRESHOLDS, clean_numeric_columns, compute_status, evaluate_thresholds, load_sheets
+from style_utils import apply_marking, filter_oos_and_style
+from parse_utils import parse_numeric
+from synth_utils import generate_plating_log, write_workbook
+from time_utils import build_time_buckets
+
+THRESHOLDS = DEFAULT_THRESHOLDS
+
+# 超過這個列數就不寫/讀 Excel（openpyxl 寫百萬列要數分鐘），也不產生整張 Styler HTML
+MAX_XLSX_ROWS = 100_000
+MAX_STYLER_ROWS = 20_000
+
+
+# 0. 對照組：改用 parse_utils 之前的清洗（逐欄 pd.to_numeric coerce，「65.2 g/l」等一律變成 NaN 被清掉）
+def clean_numeric_columns_legacy(df: pd.DataFrame, cols: list[str]) -> pd.DataFrame:
+    converted = {c: pd.to_numeric(df[c], errors="coerce") for c in cols}
+    keep = np.flatnonzero(np.logical_and.reduce([s.notna().to_numpy() for s in converted.values()]))
+    out = df.take(keep)
+    for c, s in converted.items():
+        if s is not df[c]:
+            out[c] = s.to_numpy()[keep]
+    return out
+
+
+# 1. 量測：先跑 repeat 次取最短時間，再另外跑一次用 tracemalloc 量記憶體尖峰（避免追蹤影響計時）
+def measure(fn, repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"best_ms": min(times) * 1000, "mean_ms": sum(times) / len(times) * 1000, "peak_mb": peak / 1e6}
+
+
+# 2. 各步驟的量測案例；每個案例都從同一份原始資料的複本開始，避免互相影響
+def cases(raw: pd.DataFrame, xlsx_path: str | None):
+    cols = list(THRESHOLDS)
+    cleaned = clean_numeric_columns(raw.copy(), cols)
+    result = evaluate_thresholds(cleaned, THRESHOLDS)
+    with_status = compute_status(cleaned.copy(), THRESHOLDS, result)
+
+    if xlsx_path:
+        yield "load_sheets", lambda: load_sheets(xlsx_path)
+    yield "clean_numeric_columns", lambda: clean_numeric_columns(raw.copy(), cols)
+    yield "clean_numeric_legacy", lambda: clean_numeric_columns_legacy(raw.copy(), cols)
+    yield "parse_numeric", lambda: [parse_numeric(raw[c]) for c in cols]
+    yield "evaluate_thresholds", lambda: evaluate_thresholds(cleaned, THRESHOLDS)
+    yield "compute_status", lambda: compute_status(cleaned.copy(), THRESHOLDS)
+    if len(with_status) <= MAX_STYLER_ROWS:
+        yield "apply_marking", lambda: apply_marking(with_status, THRESHOLDS, result).to_html()
+        yield "filter_oos_and_style", lambda: filter_oos_and_style(with_status, THRESHOLDS, result).to_html()
+    else:
+        yield "apply_marking", lambda: apply_marking(with_status, THRESHOLDS, result)
+        yield "filter_oos_and_style", lambda: filter_oos_and_style(with_status, THRESHOLDS, result)
+    yield "monthly_aggregations", lambda: build_time_buckets(with_status, "電鍍開始時間").aggregate(
+        "month", sum_cols=["磷銅球(kg)"]
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="電鍍資料處理效能基準")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="把結果以 JSON lines 附加到此檔案，方便比對回歸")
+    args = parser.parse_args()
+
+    records = []
+    print(f"{'rows':>9}  {'case':<24}{'best(ms)':>10}{'mean(ms)':>10}{'peak(MB)':>10}")
+    for n in args.sizes:
+        raw = generate_plating_log(n)
+        with tempfile.TemporaryDirectory() as tmp:
+            xlsx = write_workbook(os.path.join(tmp, "synthetic.xlsx"), n) if n <= MAX_XLSX_ROWS else None
+            # 資料品質：新舊清洗各保留多少列（合成資料含 STRING_NOISE 的現場雜訊）
+            kept = len(clean_numeric_columns(raw, list(THRESHOLDS)))
+            legacy = len(clean_numeric_columns_legacy(raw, list(THRESHOLDS)))
+            print(f"{n:>9}  清洗後保留 {kept} 列（舊版 {legacy} 列，多救回 {kept - legacy} 列）")
+            for name, fn in cases(raw, xlsx):
+                stats = measure(fn, args.repeat)
+                print(f"{n:>9}  {name:<24}{stats['best_ms']:>10.1f}{stats['mean_ms']:>10.1f}{stats['peak_mb']:>10.1f}")
+                records.append({"rows": n, "case": name, **stats})
+
+    if args.json:
+        meta = {"python": platform.python_version(), "pandas": pd.__version__, "time": time.time()}
+        with open(args.json, "a", encoding="utf-8") as f:
+            for rec in records:
+                f.write(json.dumps({**meta, **rec}, ensure_ascii=False) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
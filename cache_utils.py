@@ -0,0 +1,207 @@
+# 余振中 (Yu Chen Chung)
+# cache_utils.py
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# 1. 計算檔案內容雜湊（分塊讀取，避免大檔一次載入記憶體）
+#    以（路徑, 修改時間, 大小）記住上次結果，檔案沒動過就不用每次 rerun 重讀整個檔案
+_hash_memo: dict[tuple[str, int, int], str] = {}
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    digest = _hash_memo.get(memo_key)
+    if digest is not None:
+        return digest
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    _hash_memo[memo_key] = digest
+    return digest
+
+
+# 2. 快取資料夾：放在本程式私有的目錄（預設 ~/.cache/custom-data-visualizer，可用 APP_CACHE_DIR 指定），
+#    不寫在工作簿旁邊——投遞資料夾通常很多人都能寫入，在那裡放可被載入的快取等於讓任何人改寫儀表板讀到的內容
+APP_CACHE_DIR = os.getenv("APP_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "custom-data-visualizer"))
+
+
+def cache_dir(*parts: str) -> str:
+    path = os.path.join(APP_CACHE_DIR, *parts)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+# 每個工作簿一個子目錄：檔名 + 完整路徑雜湊（不同資料夾的同名檔案不會共用快取）
+def workbook_cache_dir(path: str, *parts: str) -> str:
+    abspath = os.path.abspath(path)
+    tag = hashlib.sha1(abspath.encode("utf-8")).hexdigest()[:8]
+    return cache_dir("workbooks", f"{os.path.basename(abspath)}.{tag}", *parts)
+
+
+# 2.1 Arrow 相容：數字與文字混雜的 object 欄（例如 版輪編號）Arrow 無法表示，非空值統一轉成字串；
+#     在放進快取之前轉換，記憶體中的資料與快照讀回的內容完全一致
+def arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    converted = {}
+    for col in df.columns:
+        s = df[col]
+        if s.dtype == object and pd.api.types.infer_dtype(s, skipna=True) in ("mixed", "mixed-integer"):
+            converted[col] = s.astype(str).where(s.notna(), None)
+    return df.assign(**converted) if converted else df
+
+
+# 2.2 快照只用 Parquet（讀檔不會執行任何程式碼）；沒有 pyarrow 或寫入失敗時只留在記憶體
+def _write_snapshot(df: pd.DataFrame, base: str) -> str | None:
+    path = f"{base}.parquet"
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        df.to_parquet(tmp)
+        os.replace(tmp, path)
+        return path
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return None
+
+
+def _read_snapshot(base: str) -> pd.DataFrame | None:
+    path = f"{base}.parquet"
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_parquet(path)
+    except Exception:
+        # 快照損毀就當作沒有，交給呼叫端重新解析
+        return None
+
+
+# 3. 工作表快取：記憶體 LRU + 私有快取目錄中的 Parquet 快照
+class WorkbookCache:
+    """
+    以（檔案內容雜湊, 工作表名稱）為鍵快取解析後的 DataFrame。
+
+    - 記憶體中最多保留 max_entries 份，超過時淘汰最久未使用者
+    - 同時寫一份 Parquet 快照到私有快取目錄（見 workbook_cache_dir），重啟或其他 worker 可直接載入
+    - 檔案內容改變或讀法版本更新時，該工作簿不再相符的快照全部清除
+    """
+
+    def __init__(self, max_entries: int = 8, snapshot_dir: str | None = None, persist: bool = True):
+        self.max_entries = max_entries
+        self.snapshot_dir = snapshot_dir
+        self.persist = persist
+        self._entries: OrderedDict[tuple[str, str], pd.DataFrame] = OrderedDict()
+        self._lock = threading.Lock()
+        self._purged: set[tuple[str, str, str]] = set()   # 本行程已清理過的（路徑, 雜湊, 讀法），不必每次 rerun 都列目錄
+
+    def _dir_for(self, path: str) -> str:
+        if self.snapshot_dir:
+            return self.snapshot_dir
+        return workbook_cache_dir(path)
+
+    def _base_for(self, path: str, digest: str, slot: str) -> str:
+        stem = os.path.basename(path)
+        return os.path.join(self._dir_for(path), f"{stem}__{slot}__{digest[:16]}")
+
+    @staticmethod
+    def _slot(sheet: str, variant: str) -> str:
+        # 同一工作表的不同讀法（例如只取部分欄位）各自快取
+        return f"{sheet}@{variant}" if variant else sheet
+
+    # 讀法名稱「.」之前是讀法本身、之後是版本（例如 compact.p1）：同一讀法的舊版本快照一併清除
+    @staticmethod
+    def _family(slot: str) -> str:
+        sheet, _, variant = slot.rpartition("@")
+        return f"{sheet}@{variant.split('.')[0]}" if sheet else slot
+
+    def _purge_stale(self, path: str, digest: str, slot: str) -> None:
+        marker = (os.path.abspath(path), digest, slot)
+        if marker in self._purged:
+            return
+        self._purged.add(marker)
+        folder = self._dir_for(path)
+        if not os.path.isdir(folder):
+            return
+        prefix = f"{os.path.basename(path)}__"
+        keep = f"{prefix}{slot}__{digest[:16]}.parquet"
+        for name in os.listdir(folder):
+            if not name.startswith(prefix) or name == keep or name.endswith(".tmp"):
+                continue
+            other_slot, _, other_digest = name[len(prefix):].rpartition("__")
+            # 檔案內容已不同（雜湊不符）、舊版快照格式（pkl / feather），或同一讀法的舊版本
+            stale = (
+                not name.endswith(".parquet")
+                or other_digest != f"{digest[:16]}.parquet"
+                or self._family(other_slot) == self._family(slot)
+            )
+            if stale:
+                try:
+                    os.remove(os.path.join(folder, name))
+                except OSError:
+                    pass
+
+    def _remember(self, key: tuple[str, str], df: pd.DataFrame) -> None:
+        with self._lock:
+            self._entries[key] = df
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_sheets(self, path: str, sheet_names: list[str], loader,
+                   variant: str = "") -> dict[str, pd.DataFrame]:
+        """
+        取得多個工作表；只有記憶體與快照都沒有的工作表才呼叫 loader(path, missing_sheets)。
+        """
+        digest = file_hash(path)
+        result: dict[str, pd.DataFrame] = {}
+        missing: list[str] = []
+
+        for sheet in sheet_names:
+            slot = self._slot(sheet, variant)
+            key = (digest, slot)
+            with self._lock:
+                df = self._entries.get(key)
+                if df is not None:
+                    self._entries.move_to_end(key)
+            if df is None and self.persist:
+                df = _read_snapshot(self._base_for(path, digest, slot))
+                if df is not None:
+                    self._remember(key, df)
+                    self._purge_stale(path, digest, slot)
+            if df is None:
+                missing.append(sheet)
+            else:
+                result[sheet] = df
+
+        if missing:
+            parsed = loader(path, missing)
+            for sheet in missing:
+                df = arrow_safe(parsed[sheet])
+                slot = self._slot(sheet, variant)
+                self._remember((digest, slot), df)
+                if self.persist:
+                    os.makedirs(self._dir_for(path), mode=0o700, exist_ok=True)
+                    _write_snapshot(df, self._base_for(path, digest, slot))
+                    self._purge_stale(path, digest, slot)
+                result[sheet] = df
+
+        # 依呼叫端要求的順序回傳（與 pd.read_excel 的行為一致）
+        return {sheet: result[sheet] for sheet in sheet_names}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# 4. 模組層級的共用快取（同一個 Streamlit 行程內所有 rerun 共用）
+_default_cache = WorkbookCache()
+
+
+def get_workbook_cache() -> WorkbookCache:
+    return _default_cache
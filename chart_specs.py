@@ -0,0 +1,476 @@
+# 余振中 (Yu Chen Chung)
+# chart_specs.py
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from downsample_utils import DEFAULT_POINT_BUDGET, downsample_frame
+from perf_utils import timed
+
+VEGA_LITE_SCHEMA = "https://vega.github.io/schema/vega-lite/v5.json"
+
+# 散點數超過這個值就改送 2D 分箱後的結果（每格一點，大小代表筆數）
+SCATTER_MAX_POINTS = 5000
+SCATTER_BINS = 60
+
+# 1. 資料指紋：只對畫圖用到的欄位做向量化雜湊，資料沒變就直接重用已建好的 spec
+def fingerprint(df: pd.DataFrame, cols: list[str], *extra) -> str:
+    h = hashlib.sha1(pd.util.hash_pandas_object(df[cols], index=False).to_numpy().tobytes())
+    h.update(json.dumps(extra, ensure_ascii=False, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+_memo: OrderedDict[str, dict] = OrderedDict()
+_memo_lock = threading.Lock()
+_MEMO_MAX = 64
+
+
+def _memoized(key: str, build) -> dict:
+    with _memo_lock:
+        hit = _memo.get(key)
+        if hit is not None:
+            _memo.move_to_end(key)
+            return hit
+    spec = build()
+    with _memo_lock:
+        _memo[key] = spec
+        while len(_memo) > _MEMO_MAX:
+            _memo.popitem(last=False)
+    return spec
+
+
+def to_json(spec: dict) -> str:
+    return json.dumps(spec, ensure_ascii=False, allow_nan=False)
+
+
+# 轉成 Vega-Lite 可直接使用的 records（NaN → None、時間 → 字串）
+def _records(df: pd.DataFrame) -> list[dict]:
+    out = df.copy()
+    for col in out.columns:
+        if pd.api.types.is_datetime64_any_dtype(out[col]):
+            out[col] = out[col].dt.strftime("%Y-%m-%dT%H:%M:%S")
+    return json.loads(out.to_json(orient="records", force_ascii=False))
+
+
+# 2. OK / NG 圓餅圖：只送各狀態的筆數與比例
+@timed()
+def pie_spec(df: pd.DataFrame, status_col: str) -> dict:
+    def build():
+        counts = (
+            df[status_col]
+            .value_counts()
+            .loc[lambda c: c > 0]   # category 欄位會列出數量為 0 的類別
+            .rename_axis(status_col)
+            .reset_index(name="數量")
+        )
+        counts["percent"] = counts["數量"] / counts["數量"].sum()
+        theta = {"field": "數量", "type": "quantitative", "stack": True}
+        return {
+            "$schema": VEGA_LITE_SCHEMA,
+            "data": {"values": _records(counts)},
+            "layer": [
+                {
+                    "mark": {"type": "arc", "innerRadius": 50, "outerRadius": 100},
+                    "encoding": {
+                        "theta": theta,
+                        "color": {"field": status_col, "type": "nominal", "legend": {"title": status_col}},
+                        "tooltip": [
+                            {"field": status_col, "type": "nominal"},
+                            {"field": "數量", "type": "quantitative"},
+                            {"field": "percent", "type": "quantitative", "format": ".1%"},
+                        ],
+                    },
+                },
+                {
+                    "mark": {"type": "text", "radius": 75, "size": 14, "color": "white"},
+                    "encoding": {
+                        "theta": theta,
+                        "text": {"field": "percent", "type": "quantitative", "format": ".1%"},
+                    },
+                },
+            ],
+        }
+
+    return _memoized(f"pie:{fingerprint(df, [status_col])}", build)
+
+
+# 3. 線性回歸在伺服器端用 np.polyfit 算好，瀏覽器只畫兩個端點
+def linear_fit(x: np.ndarray, y: np.ndarray) -> dict:
+    slope, intercept = np.polyfit(x, y, 1)
+    pred = slope * x + intercept
+    ss_res = float(np.sum((y - pred) ** 2))
+    ss_tot = float(np.sum((y - y.mean()) ** 2))
+    return {
+        "slope": float(slope),
+        "intercept": float(intercept),
+        "r2": 1 - ss_res / ss_tot if ss_tot > 0 else float("nan"),
+        "n": int(len(x)),
+    }
+
+
+# 4. 散點 + 趨勢線：點數太多時改送 2D 分箱結果，回歸一律在伺服器端完成
+def _scatter_layer(x: np.ndarray, y: np.ndarray, x_col: str, y_col: str,
+                   max_points: int, bins: int) -> tuple[dict, bool]:
+    x_enc = {"field": x_col, "type": "quantitative", "title": x_col, "scale": {"nice": True, "zero": False}}
+    y_enc = {"field": y_col, "type": "quantitative", "title": y_col, "scale": {"nice": True, "zero": False}}
+    if len(x) > max_points:
+        counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+        ix, iy = np.nonzero(counts)
+        points = pd.DataFrame({
+            x_col: (x_edges[ix] + x_edges[ix + 1]) / 2,
+            y_col: (y_edges[iy] + y_edges[iy + 1]) / 2,
+            "筆數": counts[ix, iy].astype(int),
+        })
+        return {
+            "mark": {"type": "circle", "opacity": 0.7},
+            "encoding": {
+                "x": x_enc, "y": y_enc,
+                "size": {"field": "筆數", "type": "quantitative"},
+                "tooltip": [
+                    {"field": x_col, "type": "quantitative", "format": ".2f"},
+                    {"field": y_col, "type": "quantitative", "format": ".2f"},
+                    {"field": "筆數", "type": "quantitative"},
+                ],
+            },
+            "data": {"values": _records(points)},
+            "params": [{"name": "grid", "select": "interval", "bind": "scales"}],
+        }, True
+    return {
+        "mark": {"type": "point", "size": 60, "opacity": 0.7},
+        "encoding": {
+            "x": x_enc, "y": y_enc,
+            "tooltip": [
+                {"field": x_col, "type": "quantitative", "format": ".2f"},
+                {"field": y_col, "type": "quantitative", "format": ".2f"},
+            ],
+        },
+        "data": {"values": _records(pd.DataFrame({x_col: x, y_col: y}))},
+        "params": [{"name": "grid", "select": "interval", "bind": "scales"}],
+    }, False
+
+
+def _xy(df: pd.DataFrame, x_col: str, y_col: str) -> tuple[np.ndarray, np.ndarray]:
+    xy = df[[x_col, y_col]].apply(pd.to_numeric, errors="coerce").dropna()
+    return xy[x_col].to_numpy(dtype="float64"), xy[y_col].to_numpy(dtype="float64")
+
+
+@timed()
+def scatter_trend_spec(df: pd.DataFrame, x_col: str, y_col: str,
+                       max_points: int = SCATTER_MAX_POINTS, bins: int = SCATTER_BINS) -> dict:
+    def build():
+        x, y = _xy(df, x_col, y_col)
+        layer, binned = _scatter_layer(x, y, x_col, y_col, max_points, bins)
+        layers = [layer]
+        title = f"{x_col} vs {y_col}"
+        if binned:
+            title += f"（{len(x)} 筆，已分箱）"
+
+        if len(x) >= 2 and np.ptp(x) > 0:
+            fit = linear_fit(x, y)
+            ends = np.array([x.min(), x.max()])
+            line = pd.DataFrame({x_col: ends, y_col: fit["slope"] * ends + fit["intercept"]})
+            layers.append({
+                "mark": {"type": "line", "color": "red", "size": 3},
+                "encoding": {"x": {"field": x_col, "type": "quantitative"}, "y": {"field": y_col, "type": "quantitative"}},
+                "data": {"values": _records(line)},
+            })
+            title += f"  y = {fit['slope']:.3f}x + {fit['intercept']:.2f}，R² = {fit['r2']:.3f}"
+
+        return {
+            "$schema": VEGA_LITE_SCHEMA,
+            "title": title,
+            "width": 700,
+            "height": 400,
+            "layer": layers,
+        }
+
+    key = f"scatter:{fingerprint(df, [x_col, y_col], max_points, bins)}"
+    return _memoized(key, build)
+
+
+# 5. 月份柱狀圖：輸入已是時間分桶後的彙總表
+def _bar_spec(monthly: pd.DataFrame, y_field: str, y_title: str, title: str, tooltip: list[dict]) -> dict:
+    return {
+        "$schema": VEGA_LITE_SCHEMA,
+        "title": title,
+        "width": 600,
+        "height": 400,
+        "data": {"values": _records(monthly)},
+        "mark": "bar",
+        "encoding": {
+            "x": {"field": "month_str", "type": "ordinal", "axis": {"labelAngle": 0, "title": "月份"}},
+            "y": {"field": y_field, "type": "quantitative", "title": y_title},
+            "tooltip": tooltip,
+        },
+    }
+
+
+@timed()
+def monthly_count_spec(monthly: pd.DataFrame) -> dict:
+    frame = monthly[["period_str", "count"]].rename(columns={"period_str": "month_str"})
+
+    def build():
+        return _bar_spec(frame, "count", "電鍍支數", "每月電鍍批次總數", [
+            {"field": "month_str", "type": "ordinal", "title": "月份"},
+            {"field": "count", "type": "quantitative", "title": "電鍍支數"},
+        ])
+
+    return _memoized(f"monthly_count:{fingerprint(frame, list(frame.columns))}", build)
+
+
+@timed()
+def monthly_material_spec(monthly: pd.DataFrame, material_col: str) -> dict:
+    frame = pd.DataFrame({
+        "month_str": monthly["period_str"],
+        "total_int": monthly[f"{material_col}_sum"].round(0).astype(int),
+    })
+
+    def build():
+        return _bar_spec(frame, "total_int", f"{material_col} 總和 (kg)", f"每月{material_col} 總和", [
+            {"field": "month_str", "type": "ordinal"},
+            {"field": "total_int", "type": "quantitative"},
+        ])
+
+    return _memoized(f"monthly_material:{material_col}:{fingerprint(frame, list(frame.columns))}", build)
+
+
+# 6. 折線圖（批次報表用，儀表板仍用 st.line_chart + 範圍滑桿）：超過點數上限時降採樣，保留 keep 指定的列
+@timed()
+def line_spec(df: pd.DataFrame, x_col: str, y_cols: list[str],
+              max_points: int = DEFAULT_POINT_BUDGET, keep=None) -> dict:
+    def build():
+        values = df[y_cols].apply(pd.to_numeric, errors="coerce")
+        not_empty = values.notna().any(axis=1).to_numpy()
+        frame = pd.concat([df[[x_col]], values], axis=1).loc[not_empty]
+        kept = None if keep is None else np.asarray(keep, dtype=bool)[not_empty]
+        frame = downsample_frame(frame, y_cols, max_points, keep=kept)
+        long = frame.melt(id_vars=[x_col], value_vars=y_cols, var_name="項目", value_name="值")
+        x_type = "temporal" if pd.api.types.is_datetime64_any_dtype(frame[x_col]) else "ordinal"
+        return {
+            "$schema": VEGA_LITE_SCHEMA,
+            "width": 700,
+            "height": 400,
+            "data": {"values": _records(long)},
+            "mark": "line",
+            "encoding": {
+                "x": {"field": x_col, "type": x_type, "sort": None, "axis": {"labelOverlap": True}},
+                "y": {"field": "值", "type": "quantitative", "scale": {"zero": False}},
+                "color": {"field": "項目", "type": "nominal", "legend": {"title": ""}},
+            },
+        }
+
+    extra = (max_points, None if keep is None else hashlib.sha1(np.asarray(keep, dtype=bool).tobytes()).hexdigest())
+    return _memoized(f"line:{fingerprint(df, [x_col, *y_cols], *extra)}", build)
+
+
+# 7. SPC 管制圖：量測值 + EWMA + 中心線 / ±3σ / EWMA 管制界限，警報點標紅；下方為 CUSUM
+@timed()
+def control_spec(spc: pd.DataFrame, title: str, x: pd.Series | None = None,
+                 max_points: int = DEFAULT_POINT_BUDGET) -> dict:
+    frame = spc.assign(x=np.arange(len(spc)) if x is None else x.to_numpy())
+
+    def build():
+        reduced = downsample_frame(frame, ["value", "ewma"], max_points, keep=frame["alarm"].to_numpy())
+        x_enc = {
+            "field": "x",
+            "type": "temporal" if x is not None else "quantitative",
+            "title": x.name if x is not None else "點序",
+        }
+        series = {"field": "series", "type": "nominal", "legend": {"title": ""}}
+        # 中心線與 ±3σ 是常數，用 rule 畫，只送三個值
+        lines = reduced.melt(
+            id_vars=["x"], value_vars=["value", "ewma", "ewma_ucl", "ewma_lcl"],
+            var_name="series", value_name="y",
+        )
+        limits = [{"series": name, "y": float(spc[name].iloc[0])} for name in ("center", "ucl", "lcl")] if len(spc) else []
+        cusum = reduced.melt(id_vars=["x"], value_vars=["cusum_pos", "cusum_neg"], var_name="series", value_name="C")
+        alarm_cols = ["x", "value", "rule1", "rule2", "rule3", "rule4", "ewma_alarm", "cusum_alarm"]
+        return {
+            "$schema": VEGA_LITE_SCHEMA,
+            "vconcat": [
+                {
+                    "height": 300,
+                    "width": 700,
+                    "layer": [
+                        {
+                            "data": {"values": _records(lines)},
+                            "mark": "line",
+                            "encoding": {
+                                "x": x_enc,
+                                "y": {"field": "y", "type": "quantitative", "title": title, "scale": {"zero": False}},
+                                "color": series,
+                                "strokeDash": {
+                                    "condition": {"test": "indexof(['value', 'ewma'], datum.series) >= 0", "value": [1, 0]},
+                                    "value": [4, 4],
+                                },
+                            },
+                        },
+                        {
+                            "data": {"values": limits},
+                            "mark": {"type": "rule", "strokeDash": [4, 4]},
+                            "encoding": {"y": {"field": "y", "type": "quantitative"}, "color": series},
+                        },
+                        {
+                            "data": {"values": _records(reduced.loc[reduced["alarm"], alarm_cols])},
+                            "mark": {"type": "point", "color": "red", "size": 50, "filled": True},
+                            "encoding": {
+                                "x": x_enc,
+                                "y": {"field": "value", "type": "quantitative"},
+                                "tooltip": [
+                                    {"field": c, "type": "quantitative", "format": ".2f"} if c == "value" else {"field": c}
+                                    for c in alarm_cols
+                                ],
+                            },
+                        },
+                    ],
+                },
+                {
+                    "height": 150,
+                    "width": 700,
+                    "data": {"values": _records(cusum)},
+                    "mark": "line",
+                    "encoding": {
+                        "x": x_enc,
+                        "y": {"field": "C", "type": "quantitative", "title": "CUSUM (σ)"},
+                        "color": series,
+                    },
+                },
+            ],
+            "resolve": {"scale": {"color": "independent"}},
+        }
+
+    cols = ["x", "value", "ewma", "ucl", "lcl", "ewma_ucl", "ewma_lcl", "cusum_pos", "cusum_neg", "alarm"]
+    return _memoized(f"control:{fingerprint(frame, cols, title, max_points)}", build)
+
+
+# 8. 相關係數熱圖：cells 為長表（x, y, r, n），點選格子（參數 cell）可回傳該組合給呼叫端
+@timed()
+def correlation_heatmap_spec(cells: pd.DataFrame, lag: int = 0) -> dict:
+    def build():
+        x_title = "第 t 批" if lag else ""
+        y_title = f"第 t+{lag} 批" if lag else ""
+        order = list(dict.fromkeys(cells["x"]))
+        axis = {"labelAngle": -45, "labelLimit": 160}
+        return {
+            "$schema": VEGA_LITE_SCHEMA,
+            "title": "相關係數矩陣" if not lag else f"延遲 {lag} 批相關係數（x 領先 y）",
+            "width": 520,
+            "height": 520,
+            "data": {"values": _records(cells)},
+            "encoding": {
+                "x": {"field": "x", "type": "nominal", "sort": order, "title": x_title, "axis": axis},
+                "y": {"field": "y", "type": "nominal", "sort": order, "title": y_title},
+            },
+            "layer": [
+                {
+                    "mark": {"type": "rect", "cursor": "pointer"},
+                    "params": [{"name": "cell", "select": {"type": "point", "fields": ["x", "y"]}}],
+                    "encoding": {
+                        "color": {
+                            "field": "r", "type": "quantitative", "title": "r",
+                            "scale": {"domain": [-1, 1], "scheme": "redblue", "reverse": True},
+                        },
+                        "opacity": {"condition": {"param": "cell", "empty": True, "value": 1}, "value": 0.5},
+                        "tooltip": [
+                            {"field": "x", "type": "nominal"},
+                            {"field": "y", "type": "nominal"},
+                            {"field": "r", "type": "quantitative", "format": ".3f"},
+                            {"field": "n", "type": "quantitative", "title": "成對筆數"},
+                        ],
+                    },
+                },
+                {
+                    "mark": {"type": "text", "fontSize": 11},
+                    "encoding": {
+                        "text": {"field": "r", "type": "quantitative", "format": ".2f"},
+                        "color": {"condition": {"test": "abs(datum.r) > 0.6", "value": "white"}, "value": "black"},
+                    },
+                },
+            ],
+        }
+
+    return _memoized(f"heatmap:{fingerprint(cells, list(cells.columns), lag)}", build)
+
+
+# 9. 單一組合下鑽：散點（或分箱）+ 各回歸方法的趨勢線與信賴帶（fits 為 analytics_utils.pair_regression 的結果）
+@timed()
+def pair_fit_spec(df: pd.DataFrame, x_col: str, y_col: str, fits: dict, key: str | None = None,
+                  max_points: int = SCATTER_MAX_POINTS, bins: int = SCATTER_BINS) -> dict:
+    def build():
+        x, y = _xy(df, x_col, y_col)
+        layer, binned = _scatter_layer(x, y, x_col, y_col, max_points, bins)
+        layer["mark"]["color"] = "#888888"
+        layers = [layer]
+        if fits:
+            bands = pd.concat([f.band.assign(method=m) for m, f in fits.items()], ignore_index=True)
+            color = {"field": "method", "type": "nominal", "title": "回歸",
+                     "scale": {"domain": ["OLS", "Huber"], "range": ["#d62728", "#1f77b4"]}}
+            layers += [
+                {
+                    "data": {"values": _records(bands)},
+                    "mark": {"type": "area", "opacity": 0.25},
+                    "encoding": {
+                        "x": {"field": "x", "type": "quantitative"},
+                        "y": {"field": "lo", "type": "quantitative"},
+                        "y2": {"field": "hi"},
+                        "color": color,
+                    },
+                },
+                {
+                    "data": {"values": _records(bands)},
+                    "mark": {"type": "line", "size": 2},
+                    "encoding": {
+                        "x": {"field": "x", "type": "quantitative"},
+                        "y": {"field": "fit", "type": "quantitative"},
+                        "color": color,
+                        "tooltip": [
+                            {"field": "method", "type": "nominal"},
+                            {"field": "x", "type": "quantitative", "format": ".2f"},
+                            {"field": "fit", "type": "quantitative", "format": ".2f"},
+                            {"field": "lo", "type": "quantitative", "format": ".2f"},
+                            {"field": "hi", "type": "quantitative", "format": ".2f"},
+                        ],
+                    },
+                },
+            ]
+        title = f"{x_col} → {y_col}（{len(x)} 筆{'，已分箱' if binned else ''}）"
+        return {
+            "$schema": VEGA_LITE_SCHEMA,
+            "title": title,
+            "width": 700,
+            "height": 400,
+            "layer": layers,
+        }
+
+    fp = key or fingerprint(df, [x_col, y_col])
+    return _memoized(f"pair_fit:{fp}:{len(df)}:{x_col}:{y_col}:{sorted(fits)}:{max_points}:{bins}", build)
+
+
+# 10. 延遲相關：lag > 0 表示 x 領先 y 幾批，lag < 0 表示 y 領先 x
+@timed()
+def lag_profile_spec(profile: pd.DataFrame, x_col: str, y_col: str) -> dict:
+    def build():
+        return {
+            "$schema": VEGA_LITE_SCHEMA,
+            "title": f"延遲相關（lag > 0：{x_col} 領先 {y_col}）",
+            "width": 700,
+            "height": 250,
+            "data": {"values": _records(profile)},
+            "mark": "bar",
+            "encoding": {
+                "x": {"field": "lag", "type": "ordinal", "title": "延遲批數", "axis": {"labelAngle": 0}},
+                "y": {"field": "r", "type": "quantitative", "title": "r", "scale": {"domain": [-1, 1]}},
+                "color": {"condition": {"test": "datum.r < 0", "value": "#1f77b4"}, "value": "#d62728"},
+                "tooltip": [
+                    {"field": "lag", "type": "ordinal", "title": "延遲批數"},
+                    {"field": "r", "type": "quantitative", "format": ".3f"},
+                    {"field": "n", "type": "quantitative", "title": "成對筆數"},
+                ],
+            },
+        }
+
+    return _memoized(f"lag_profile:{x_col}:{y_col}:{fingerprint(profile, list(profile.columns))}", build)
@@ -1,121 +1,90 @@
 # 余振中 (Yu Chen Chung)
 # chart_utils.py
+import numpy as np
 import pandas as pd
-import altair as alt
 import streamlit as st
 
-# 一定要從 data_utils 匯入 parse_year_month
-from data_utils import parse_year_month
+import chart_specs
+from analytics_utils import CorrelationResult, PairFit
+from downsample_utils import DEFAULT_POINT_BUDGET, downsample_frame
+from perf_utils import timed
+# 月份彙總統一由 time_utils 的時間分桶提供（日期只解析一次）
+from time_utils import TimeBuckets, build_time_buckets
 
 # 1. 折線圖（指定 y 欄位）
-def render_line_chart(df: pd.DataFrame, x_col: str, y_cols: list[str]):
-    df[y_cols] = df[y_cols].apply(pd.to_numeric, errors="coerce")
-    df_clean = df.dropna(subset=y_cols, how="all")
+#    資料點超過 max_points 時在伺服器端降採樣（保留峰值與 keep 指定的超標列），
+#    並提供範圍滑桿：縮小範圍後會以該範圍重新取點，範圍夠小時即為完整解析度
+@timed()
+def render_line_chart(df: pd.DataFrame, x_col: str, y_cols: list[str],
+                      max_points: int = DEFAULT_POINT_BUDGET, keep=None,
+                      method: str = "minmax", key: str = "line"):
+    # 只取畫圖需要的欄位組成新表，不修改呼叫端的 df
+    values = df[y_cols].apply(pd.to_numeric, errors="coerce")
+    not_empty = values.notna().any(axis=1).to_numpy()
+    df_clean = pd.concat([df[[x_col]], values], axis=1).loc[not_empty]
+    if keep is not None:
+        keep = np.asarray(keep, dtype=bool)[not_empty]
+
+    n = len(df_clean)
+    if n > max_points:
+        start, end = st.slider("顯示範圍（第幾筆）", 0, n, (0, n), key=f"{key}_range")
+        df_clean = df_clean.iloc[start:end]
+        if keep is not None:
+            keep = keep[start:end]
+        df_clean = downsample_frame(df_clean, y_cols, max_points, keep=keep, method=method)
+        st.caption(f"顯示 {len(df_clean)} / {end - start} 點")
     return st.line_chart(data=df_clean, x=x_col, y=y_cols)
 
 # 2. 圓餅圖（顯示 OK vs NG 百分比）
+#    第 2~5 張圖的 Vega-Lite spec 由 chart_specs 在伺服器端算好（只含彙總後的資料），
+#    並依資料指紋快取，資料沒變的 rerun 不會重算
+@timed()
 def render_pie_chart(df: pd.DataFrame, status_col: str):
-    counts = (
-        df[status_col]
-        .value_counts()
-        .rename_axis(status_col)
-        .reset_index(name="數量")
-    )
-    total = counts["數量"].sum()
-    counts["percent"] = counts["數量"] / total
-
-    pie = (
-        alt.Chart(counts)
-        .mark_arc(innerRadius=50, outerRadius=100)
-        .encode(
-            theta=alt.Theta("數量:Q"),
-            color=alt.Color(f"{status_col}:N", legend=alt.Legend(title=status_col)),
-            tooltip=[
-                status_col,
-                "數量",
-                alt.Tooltip("percent:Q", format=".1%")
-            ]
-        )
-    )
-    labels = (
-        alt.Chart(counts)
-        .mark_text(radius=75, size=14, color="white")
-        .encode(
-            theta=alt.Theta("數量:Q"),
-            text=alt.Text("percent:Q", format=".1%")
-        )
-    )
-    st.altair_chart(pie + labels, use_container_width=False)
+    st.vega_lite_chart(chart_specs.pie_spec(df, status_col), use_container_width=False)
 
-# 3. 散點圖 + 線性趨勢線（指定 x, y）
+# 3. 散點圖 + 線性趨勢線（指定 x, y）：回歸以 np.polyfit 計算，點數過多時改畫分箱結果
+@timed()
 def render_scatter_with_trend(df: pd.DataFrame, x_col: str, y_col: str):
-    df_clean = df.dropna(subset=[x_col, y_col], how="any")
-    scatter = (
-        alt.Chart(df_clean)
-        .mark_point(size=60, opacity=0.7)
-        .encode(
-            x=alt.X(f"{x_col}:Q", title=x_col, scale=alt.Scale(nice=True)),
-            y=alt.Y(f"{y_col}:Q", title=y_col, scale=alt.Scale(nice=True)),
-            tooltip=[
-                alt.Tooltip(f"{x_col}:Q", format=".2f"),
-                alt.Tooltip(f"{y_col}:Q", format=".2f")
-            ]
-        )
-    )
-    trend = (
-        alt.Chart(df_clean)
-        .transform_regression(x_col, y_col, method="linear")
-        .mark_line(color="red", size=3)
-        .encode(x=f"{x_col}:Q", y=f"{y_col}:Q")
-    )
-    chart = (scatter + trend).properties(width=700, height=400).interactive()
-    st.altair_chart(chart, use_container_width=True)
+    st.vega_lite_chart(chart_specs.scatter_trend_spec(df, x_col, y_col), use_container_width=True)
 
 # 4. 每月批次總數柱狀圖
-def render_monthly_count_bar(df: pd.DataFrame, date_col: str):
-    df[date_col] = pd.to_datetime(df[date_col], errors="coerce")
-    df = df.dropna(subset=[date_col])
-    df["year_month"] = df[date_col].dt.to_period("M").dt.to_timestamp()
-
-    monthly = df.groupby("year_month").size().reset_index(name="count")
-    monthly["month_str"] = monthly["year_month"].dt.strftime("%Y-%m")
-
-    bar = (
-        alt.Chart(monthly)
-        .mark_bar()
-        .encode(
-            x=alt.X("month_str:O", axis=alt.Axis(labelAngle=0, title="月份")),
-            y=alt.Y("count:Q", title="電鍍支數"),
-            tooltip=[
-                alt.Tooltip("month_str:O", title="月份"),
-                alt.Tooltip("count:Q", title="電鍍支數")
-            ]
-        )
-        .properties(width=600, height=400, title="每月電鍍批次總數")
-    )
-    st.altair_chart(bar, use_container_width=False)
+@timed()
+def render_monthly_count_bar(df: pd.DataFrame, date_col: str, buckets: TimeBuckets | None = None):
+    if buckets is None:
+        buckets = build_time_buckets(df, date_col)
+    spec = chart_specs.monthly_count_spec(buckets.aggregate("month"))
+    st.vega_lite_chart(spec, use_container_width=False)
 
 # 5. 每月原物料（磷銅球）用量
-def render_monthly_material_bar(df: pd.DataFrame, date_col: str, material_col: str):
-    df = parse_year_month(df, date_col)  # 如果你在 data_utils 已有這個函式，就調用它
-    df[material_col] = pd.to_numeric(df[material_col], errors="coerce")
+@timed()
+def render_monthly_material_bar(df: pd.DataFrame, date_col: str, material_col: str,
+                                buckets: TimeBuckets | None = None):
+    if buckets is None:
+        buckets = build_time_buckets(df, date_col)
+    spec = chart_specs.monthly_material_spec(buckets.aggregate("month", sum_cols=[material_col]), material_col)
+    st.vega_lite_chart(spec, use_container_width=True)
+
+# 6. SPC 管制圖：量測值 + EWMA + 中心線 / ±3σ / EWMA 管制界限，警報點標紅；下方為 CUSUM
+@timed()
+def render_control_chart(spc: pd.DataFrame, title: str, x: pd.Series | None = None,
+                         max_points: int = DEFAULT_POINT_BUDGET):
+    st.vega_lite_chart(chart_specs.control_spec(spc, title, x, max_points), use_container_width=True)
 
-    monthly = (
-        df.groupby("year_month")[material_col]
-          .sum()
-          .reset_index(name="total_kg")
-    )
-    monthly["total_int"] = monthly["total_kg"].round(0).astype(int)
-    monthly["month_str"] = monthly["year_month"].dt.strftime("%Y-%m")
+# 7. 相關係數熱圖：點選格子回傳 (x, y) 組合給下鑽用；沒有點選時回傳 None
+@timed()
+def render_correlation_heatmap(result: CorrelationResult, lag: int = 0, key: str = "corr_heatmap") -> tuple[str, str] | None:
+    event = st.vega_lite_chart(chart_specs.correlation_heatmap_spec(result.cells(lag), lag),
+                               use_container_width=False, on_select="rerun", key=key)
+    picked = (event.selection or {}).get("cell") or []
+    if not picked:
+        return None
+    return picked[0]["x"], picked[0]["y"]
 
-    bar = (
-        alt.Chart(monthly)
-        .mark_bar()
-        .encode(
-            x=alt.X("month_str:O", axis=alt.Axis(labelAngle=0, title="月份")),
-            y=alt.Y("total_int:Q", title=f"{material_col} 總和 (kg)"),
-            tooltip=["month_str", "total_int"]
-        )
-        .properties(width=600, height=400, title=f"每月{material_col} 總和")
-    )
-    st.altair_chart(bar, use_container_width=True)
+# 8. 下鑽：散點 + OLS / Huber 趨勢線與信賴帶，下方為延遲相關
+@timed()
+def render_pair_analysis(df: pd.DataFrame, x_col: str, y_col: str, fits: dict[str, PairFit], result: CorrelationResult,
+                         key: str | None = None):
+    st.vega_lite_chart(chart_specs.pair_fit_spec(df, x_col, y_col, fits, key=key), use_container_width=True)
+    if result.max_lag > 0 and x_col in result.columns and y_col in result.columns:
+        st.vega_lite_chart(chart_specs.lag_profile_spec(result.lag_profile(x_col, y_col), x_col, y_col),
+                           use_container_width=True)
@@ -1,27 +1,216 @@
 # 余振中 (Yu Chen Chung)
 # data_utils.py
+from dataclasses import dataclass
+
+import numpy as np
 import pandas as pd
 
+from cache_utils import get_workbook_cache
+from parse_utils import PARSER_VERSION, parse_numeric, record_parse_stats
+from perf_utils import timed
+
 # 1. 讀取 Excel（EP15、EP16）
-def load_sheets(file) -> dict[str, pd.DataFrame]:
-    return pd.read_excel(file, sheet_name=["EP15", "EP16"])
+@timed()
+def load_sheets(file, sheet_names: tuple[str, ...] = ("EP15", "EP16")) -> dict[str, pd.DataFrame]:
+    return pd.read_excel(file, sheet_name=list(sheet_names))
+
+# 1.1 帶快取的讀取：同一份檔案內容只解析一次，之後從記憶體或磁碟快照取用
+@timed()
+def load_sheets_cached(path: str, sheet_names: tuple[str, ...] = ("EP15", "EP16")) -> dict[str, pd.DataFrame]:
+    return get_workbook_cache().get_sheets(path, list(sheet_names), load_sheets)
+
+# 1.2 儀表板實際用到的欄位與目標型別（串流讀取時只取這些欄位）
+DASHBOARD_COLUMNS = {
+    "電鍍開始時間"         : "datetime64[ns]",
+    "電鍍次數"             : "object",
+    "硫酸實際值(g/l)"      : "float32",
+    "硫酸銅實際值(g/l)"    : "float32",
+    "氯離子實際值(ppm/l)"  : "float32",
+    "SP10平均"             : "float32",
+    "硬度HB"               : "float32",
+    "磷銅球(kg)"           : "float32",
+}
+
+
+# 1.3 串流讀取：openpyxl read_only 逐列讀取，只取需要的欄位並直接轉成對應型別
+@timed()
+def load_sheet_projected(path: str, sheet: str,
+                         columns: dict[str, str] = DASHBOARD_COLUMNS) -> pd.DataFrame:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb[sheet].iter_rows(values_only=True)
+        header = next(rows, ())
+        positions = {name: i for i, name in enumerate(header) if name in columns}
+        wanted = [c for c in columns if c in positions]
+        picks = [positions[c] for c in wanted]
+
+        buffers: list[list] = [[] for _ in wanted]
+        last_filled = 0
+        for n, row in enumerate(rows, start=1):
+            values = [row[i] if i < len(row) else None for i in picks]
+            for buf, v in zip(buffers, values):
+                buf.append(v)
+            if any(v is not None for v in values):
+                last_filled = n
+    finally:
+        wb.close()
+
+    # 尾端沒有任何需要欄位的空白列直接捨棄
+    data, stats = {}, {}
+    for name, buf in zip(wanted, buffers):
+        buf = buf[:last_filled]
+        dtype = columns[name]
+        if dtype.startswith("datetime"):
+            data[name] = pd.to_datetime(pd.Series(buf, dtype="object"), errors="coerce").to_numpy(dtype=dtype)
+        elif dtype.startswith("float"):
+            # 手填的「65.2 g/l」「６５」「64~66」也要解析出數值（見 parse_utils）
+            values, stats[name] = parse_numeric(pd.Series(buf, dtype="object"))
+            data[name] = values.astype(dtype)
+        else:
+            data[name] = np.array(buf, dtype=dtype)
+    return record_parse_stats(pd.DataFrame(data), stats)
+
+
+# 1.4 帶快取的精簡讀取（與完整讀取分開快取）
+@timed()
+def load_sheets_projected_cached(path: str, sheet_names: tuple[str, ...] = ("EP15", "EP16")) -> dict[str, pd.DataFrame]:
+    def _loader(p, names):
+        return {name: load_sheet_projected(p, name) for name in names}
+    return get_workbook_cache().get_sheets(path, list(sheet_names), _loader, variant=f"projected.p{PARSER_VERSION}")
+
+# 1.5 欄位型別規格：量測值用 float32、低基數文字用 category、時間用 datetime64
+FLOAT32_COLUMNS = [
+    "硫酸實際值(g/l)", "硫酸銅實際值(g/l)", "氯離子實際值(ppm/l)",
+    "硫酸添加後分析值(g/l)", "硫酸銅添加後分析值(g/l)", "氯離子添加後分析值(ppm/l)",
+    "電流(A)", "鍍液電鍍溫度(℃)", "鍍液完成溫度(℃)", "磷銅球(kg)", "純水(l)",
+    "鍍前模厚", "鍍後模厚", "電鍍模厚", "鍍前重量", "鍍厚重量", "電鍍重量",
+    "SP10平均", "硬度HB",
+]
+CATEGORY_COLUMNS = ["狀態", "廠商", "模具規格", "記錄者", "合格"]
+DATETIME_COLUMNS = ["電鍍開始時間", "實際完成日期", "出廠日期"]
+
+# 其他純文字欄位若不重複值比例低於此值，也轉成 category
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+
+# 1.6 依規格壓縮型別：回傳新的 DataFrame，不修改輸入（輸入可能是多個 session 共用的快取）
+@timed()
+def normalize_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    converted, stats = {}, {}
+    for col in df.columns:
+        s = df[col]
+        if col in FLOAT32_COLUMNS:
+            if s.dtype != "float32":
+                values, stats[col] = parse_numeric(s)
+                converted[col] = values.astype("float32")
+        elif col in DATETIME_COLUMNS:
+            if not pd.api.types.is_datetime64_any_dtype(s):
+                converted[col] = pd.to_datetime(s, errors="coerce")
+        elif s.dtype == "object" and len(s):
+            # 只轉全部都是字串的欄位；像 版輪編號 這種數字與文字混雜的欄位保持原樣
+            non_null = s.dropna()
+            if col in CATEGORY_COLUMNS or (
+                len(non_null)
+                and non_null.map(type).eq(str).all()
+                and non_null.nunique() / len(non_null) < CATEGORY_MAX_UNIQUE_RATIO
+            ):
+                converted[col] = s.astype("category")
+    return record_parse_stats(df.assign(**converted), stats) if converted else df
 
-# 2. 清洗：轉數值 & 去除 NaN
+
+# 1.7 帶快取的精簡型別讀取：壓縮後的結果直接進快取與快照，每次 rerun 不必重做
+def load_sheets_compact_cached(path: str, sheet_names: tuple[str, ...] = ("EP15", "EP16")) -> dict[str, pd.DataFrame]:
+    def _loader(p, names):
+        return {name: normalize_dtypes(df) for name, df in load_sheets(p, tuple(names)).items()}
+    return get_workbook_cache().get_sheets(path, list(sheet_names), _loader, variant=f"compact.p{PARSER_VERSION}")
+
+# 2. 清洗：轉數值 & 去除 NaN（不修改輸入；只複製保留下來的列一次）
+#    文字欄位以 parse_numeric 解析，各欄解析統計記在結果的 attrs["parse_stats"]
+@timed()
 def clean_numeric_columns(df: pd.DataFrame, cols: list[str]) -> pd.DataFrame:
+    values, stats = {}, {}
     for c in cols:
-        df[c] = pd.to_numeric(df[c], errors="coerce")
-    return df.dropna(subset=cols, how="any")
-
-# 3. 計算 OK/NG
-def compute_status(df: pd.DataFrame, thresholds: dict[str, tuple[float,float]]) -> pd.DataFrame:
-    def _row_status(row):
-        return "OK" if all(low <= row[col] <= high for col,(low,high) in thresholds.items()) else "NG"
-    df["狀態"] = df.apply(_row_status, axis=1)
+        if pd.api.types.is_numeric_dtype(df[c]):
+            values[c] = df[c].to_numpy()
+        else:
+            values[c], stats[c] = parse_numeric(df[c])
+    keep = np.flatnonzero(np.logical_and.reduce([~pd.isna(v) for v in values.values()]))
+    out = df.take(keep)
+    for c in stats:
+        out[c] = values[c][keep]
+    return record_parse_stats(out, stats)
+
+# 2.1 預設濃度標準範圍（儀表板與批次報表共用）
+DEFAULT_THRESHOLDS = {
+    "硫酸實際值(g/l)"     : (62,  68),
+    "硫酸銅實際值(g/l)"   : (200, 210),
+    "氯離子實際值(ppm/l)" : (64,  80),
+}
+
+# 3. 門檻評估引擎：一次向量化算出 (列數 × 門檻欄位) 的超標矩陣，其餘結果都由它推導
+@dataclass
+class ThresholdResult:
+    columns: list[str]        # 有設定門檻的欄位（矩陣的欄順序）
+    violations: np.ndarray    # bool 矩陣，True 表示該格超標（NaN 也視為超標）
+    index: pd.Index           # 對應 df 的列索引
+
+    # 每列超標欄位數
+    @property
+    def row_violations(self) -> np.ndarray:
+        return self.violations.sum(axis=1)
+
+    # 該列是否至少一格超標
+    @property
+    def oos_rows(self) -> np.ndarray:
+        return self.violations.any(axis=1)
+
+    # OK / NG 狀態陣列
+    @property
+    def status(self) -> np.ndarray:
+        return np.where(self.oos_rows, "NG", "OK")
+
+    # 逐格超標旗標（DataFrame 形式，方便樣式化）
+    def cell_flags(self) -> pd.DataFrame:
+        return pd.DataFrame(self.violations, index=self.index, columns=self.columns)
+
+    # 依列位置（slice / 整數陣列 / 布林陣列）取出子集，與 df.iloc[rows] 對齊
+    def take(self, rows) -> "ThresholdResult":
+        return ThresholdResult(self.columns, self.violations[rows], self.index[rows])
+
+    # 只保留超標列的結果（與 df.loc[oos] 對齊）
+    def subset_oos(self) -> "ThresholdResult":
+        return self.take(self.oos_rows)
+
+
+@timed()
+def evaluate_thresholds(df: pd.DataFrame, thresholds: dict[str, tuple[float,float]]) -> ThresholdResult:
+    cols = list(thresholds.keys())
+    values = df[cols].to_numpy(dtype="float64", na_value=np.nan)
+    lows = np.array([low for low, _ in thresholds.values()], dtype="float64")
+    highs = np.array([high for _, high in thresholds.values()], dtype="float64")
+    # NaN 與任何數比較都是 False，因此 NaN 會落在超標（與原本 low <= v <= high 的判斷一致）
+    within = (values >= lows) & (values <= highs)
+    return ThresholdResult(cols, ~within, df.index)
+
+
+# 3.1 計算 OK/NG（可傳入已算好的 ThresholdResult 避免重算）
+@timed()
+def compute_status(df: pd.DataFrame, thresholds: dict[str, tuple[float,float]],
+                   result: ThresholdResult | None = None) -> pd.DataFrame:
+    if result is None:
+        result = evaluate_thresholds(df, thresholds)
+    df["狀態"] = pd.Categorical(result.status, categories=["OK", "NG"])
     return df
 
 # 4. 解析「電鍍開始時間」成 year_month
+@timed()
 def parse_year_month(df: pd.DataFrame, date_col: str) -> pd.DataFrame:
-    df[date_col] = pd.to_datetime(df[date_col], errors="coerce")
-    df = df.dropna(subset=[date_col])
-    df["year_month"] = df[date_col].dt.to_period("M").dt.to_timestamp()
-    return df
+    times = pd.to_datetime(df[date_col], errors="coerce")
+    keep = np.flatnonzero(times.notna().to_numpy())
+    times = times.iloc[keep]
+    return df.take(keep).assign(**{
+        date_col: times,
+        "year_month": times.dt.to_period("M").dt.to_timestamp(),
+    })
@@ -0,0 +1,91 @@
+# 余振中 (Yu Chen Chung)
+# downsample_utils.py
+import numpy as np
+import pandas as pd
+
+# 折線圖預設點數上限
+DEFAULT_POINT_BUDGET = 2000
+
+# 1. min/max 分桶：每桶保留每條序列的最小與最大值所在列，峰值不會被抹平（完全向量化）
+def minmax_indices(values: np.ndarray, budget: int) -> np.ndarray:
+    values = np.asarray(values, dtype="float64")
+    if values.ndim == 1:
+        values = values[:, None]
+    n, k = values.shape
+    if n <= budget:
+        return np.arange(n)
+
+    # 每桶每條序列貢獻 2 點
+    n_buckets = max(1, budget // (2 * k))
+    size = -(-n // n_buckets)
+    pad = n_buckets * size - n
+
+    lo = np.where(np.isnan(values), np.inf, values)
+    hi = np.where(np.isnan(values), -np.inf, values)
+    lo = np.pad(lo, ((0, pad), (0, 0)), constant_values=np.inf).reshape(n_buckets, size, k)
+    hi = np.pad(hi, ((0, pad), (0, 0)), constant_values=-np.inf).reshape(n_buckets, size, k)
+
+    offsets = (np.arange(n_buckets) * size)[:, None]
+    picks = np.concatenate([
+        (lo.argmin(axis=1) + offsets).ravel(),
+        (hi.argmax(axis=1) + offsets).ravel(),
+    ])
+    return np.unique(np.clip(picks, 0, n - 1))
+
+# 2. LTTB（Largest-Triangle-Three-Buckets）：單一序列，保留視覺形狀
+def lttb_indices(y: np.ndarray, budget: int) -> np.ndarray:
+    y = np.asarray(y, dtype="float64")
+    n = len(y)
+    if n <= budget or budget < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype="float64")
+    y = np.where(np.isnan(y), np.nanmean(y) if np.isfinite(y).any() else 0.0, y)
+    # 頭尾固定保留，中間切成 budget-2 桶
+    edges = np.linspace(1, n - 1, budget - 1).astype(int)
+    picks = np.empty(budget, dtype=int)
+    picks[0], picks[-1] = 0, n - 1
+
+    prev = 0
+    for i in range(budget - 2):
+        start, end = edges[i], edges[i + 1]
+        # 下一桶的平均點（最後一桶以終點代替）
+        if i + 2 < len(edges):
+            nxt = slice(edges[i + 1], edges[i + 2])
+            avg_x, avg_y = x[nxt].mean(), y[nxt].mean()
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        # 與前一個選點、下一桶平均點構成的三角形面積最大者
+        area = np.abs(
+            (x[prev] - avg_x) * (y[start:end] - y[prev])
+            - (x[prev] - x[start:end]) * (avg_y - y[prev])
+        )
+        prev = start + int(area.argmax())
+        picks[i + 1] = prev
+    return picks
+
+# 3. 對 DataFrame 降採樣：保留頭尾、指定必留列（例如超標列），其餘依預算挑點
+def downsample_frame(df: pd.DataFrame, y_cols: list[str], budget: int = DEFAULT_POINT_BUDGET,
+                     keep: np.ndarray | None = None, method: str = "minmax") -> pd.DataFrame:
+    n = len(df)
+    if n <= budget:
+        return df
+
+    values = df[y_cols].to_numpy(dtype="float64", na_value=np.nan)
+    if method == "lttb":
+        # 每條序列各自挑點再合併，點數預算平均分配
+        per_series = max(3, budget // len(y_cols))
+        picks = np.concatenate([lttb_indices(values[:, i], per_series) for i in range(len(y_cols))])
+    else:
+        picks = minmax_indices(values, budget)
+
+    picks = np.concatenate([picks, [0, n - 1]])
+    if keep is not None:
+        keep = np.asarray(keep, dtype=bool)
+        kept = np.flatnonzero(keep)
+        if len(kept) > budget // 2:
+            # 超標列太多時只留每段超標區間的起訖列，區間內的峰值已由上面的挑點保留
+            edges = np.flatnonzero(np.diff(np.r_[False, keep, False].astype(np.int8)))
+            kept = np.clip(edges - (np.arange(len(edges)) % 2), 0, n - 1)
+        picks = np.concatenate([picks, kept])
+    return df.iloc[np.unique(picks)]
@@ -0,0 +1,227 @@
+# 余振中 (Yu Chen Chung)
+# filter_utils.py
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from data_utils import ThresholdResult
+from perf_utils import timed
+
+# 電鍍次數「主-次」編成單一整數鍵：major * RUN_KEY_BASE + minor
+RUN_KEY_BASE = 1_000_000
+_RUN_MISSING = np.iinfo(np.int64).max
+# 各段有效位數上限（不計前導 0）：次數必須小於 RUN_KEY_BASE，主次數 12 位時整個鍵仍在 int64 範圍內
+RUN_MINOR_DIGITS = len(str(RUN_KEY_BASE)) - 1
+RUN_MAJOR_DIGITS = 12
+
+# 快速期間選項：以該槽最後一筆的時間往前推（與 genai_utils 的分析範圍一致）
+QUICK_PERIODS = {"全部": None, "最近 7 天": 7, "最近 30 天": 30, "最近 90 天": 90}
+
+# 1. 篩選條件（None 表示不限制）
+@dataclass(frozen=True)
+class FilterSpec:
+    start: pd.Timestamp | None = None          # 電鍍開始時間 >= start
+    end: pd.Timestamp | None = None            # 電鍍開始時間 <= end
+    status: str | None = None                  # "OK" / "NG"
+    run_min: tuple[int, int] | None = None     # 電鍍次數 >= (主, 次)
+    run_max: tuple[int, int] | None = None     # 電鍍次數 <= (主, 次)
+
+    @property
+    def active(self) -> bool:
+        return any(v is not None for v in (self.start, self.end, self.status, self.run_min, self.run_max))
+
+
+# 「12-3」→ (12, 3)；只有主次數時次數視為 0；規則與建索引時相同
+def parse_run(text) -> tuple[int, int] | None:
+    key = int(run_keys(pd.Series([text], dtype=object))[0])
+    return None if key == _RUN_MISSING else divmod(key, RUN_KEY_BASE)
+
+
+# 把字串陣列看成 (列數, 寬度) 的 Unicode 碼位矩陣，一次處理一個字元位置（Horner 法累加數字），
+# 迴圈只跑字串寬度次，每次都是整欄向量運算，不用 regex 逐列處理。
+# 含非 ASCII 字元的列先做 NFKC 正規化（全形「１２－３」、全形空白）；空白只能出現在頭尾或「-」兩側，
+# 數字中間夾空白（「1 2-3」）或任一段超過位數上限都視為無法解析，不會溢位或被誤讀成別的次數
+def run_keys(runs: pd.Series) -> np.ndarray:
+    text = runs.astype(str).to_numpy(dtype="U")
+    n, width = len(text), text.dtype.itemsize // 4
+    cp = text.view(np.uint32).reshape(n, width) if n and width else np.zeros((n, 0), dtype=np.uint32)
+    wide = np.flatnonzero((cp > 127).any(axis=1)) if cp.shape[1] else np.array([], dtype=np.intp)
+    if len(wide):
+        text = text.astype(object)
+        text[wide] = [unicodedata.normalize("NFKC", t) for t in text[wide]]
+        text = text.astype("U")
+        n, width = len(text), text.dtype.itemsize // 4
+        cp = text.view(np.uint32).reshape(n, width)
+    major = np.zeros(n, dtype=np.int64)
+    minor = np.zeros(n, dtype=np.int64)
+    major_digits = np.zeros(n, dtype=np.int64)
+    minor_digits = np.zeros(n, dtype=np.int64)
+    seen_dash = np.zeros(n, dtype=bool)
+    has_major = np.zeros(n, dtype=bool)
+    in_number = np.zeros(n, dtype=bool)     # 目前這一段已經出現過數字
+    gap = np.zeros(n, dtype=bool)           # 這一段的數字後面出現過空白
+    valid = np.ones(n, dtype=bool)
+    for j in range(cp.shape[1]):
+        c = cp[:, j]
+        d = c.astype(np.int64) - 48
+        is_digit = (d >= 0) & (d <= 9)
+        is_dash = c == 45
+        is_space = (c == 32) | (c == 9)
+        # 只能有數字、空白與一個「-」；同一段數字中間不能有空白
+        valid &= (is_digit | is_dash | is_space | (c == 0)) & ~(is_dash & seen_dash) & ~(is_digit & gap)
+        in_major = is_digit & ~seen_dash & valid
+        in_minor = is_digit & seen_dash & valid
+        major_digits += in_major & ((major > 0) | (d > 0))
+        minor_digits += in_minor & ((minor > 0) | (d > 0))
+        valid &= (major_digits <= RUN_MAJOR_DIGITS) & (minor_digits <= RUN_MINOR_DIGITS)
+        major = np.where(in_major & valid, major * 10 + d, major)
+        minor = np.where(in_minor & valid, minor * 10 + d, minor)
+        has_major |= in_major
+        gap = np.where(is_dash, False, gap | (is_space & in_number))
+        in_number = np.where(is_dash, False, in_number | is_digit)
+        seen_dash |= is_dash
+    return np.where(valid & has_major, major * RUN_KEY_BASE + minor, _RUN_MISSING)
+
+
+# 2. 預先建立的索引：排序後的時間、OK/NG 位置表與位元圖、排序後的電鍍次數鍵
+@dataclass
+class FilterIndex:
+    n: int
+    dates_sorted: np.ndarray        # 排序後的 datetime64（不含 NaT）
+    date_order: np.ndarray | None   # 時間排序 → 列位置；資料本來就依時間排序時為 None（可直接切片）
+    status_bits: dict[str, np.ndarray]      # np.packbits 後的位元圖，判斷任意位置集合的狀態
+    status_positions: dict[str, np.ndarray] # 各狀態的列位置（遞增），與切片範圍交集只需二分搜尋
+    run_sorted: np.ndarray          # 排序後的電鍍次數鍵（不含無法解析者）
+    run_order: np.ndarray           # 電鍍次數排序 → 列位置
+
+    @property
+    def date_min(self) -> pd.Timestamp | None:
+        return pd.Timestamp(self.dates_sorted[0]) if len(self.dates_sorted) else None
+
+    @property
+    def date_max(self) -> pd.Timestamp | None:
+        return pd.Timestamp(self.dates_sorted[-1]) if len(self.dates_sorted) else None
+
+
+@timed()
+def build_filter_index(df: pd.DataFrame, result: ThresholdResult,
+                       date_col: str = "電鍍開始時間", run_col: str = "電鍍次數") -> FilterIndex:
+    n = len(df)
+    if date_col in df:
+        dates = pd.to_datetime(df[date_col], errors="coerce").to_numpy(dtype="datetime64[ns]")
+    else:
+        dates = np.full(n, np.datetime64("NaT"), dtype="datetime64[ns]")
+    valid = ~np.isnat(dates)
+    if valid.all() and (n < 2 or (dates[1:] >= dates[:-1]).all()):
+        dates_sorted, date_order = dates, None
+    else:
+        order = np.flatnonzero(valid)
+        order = order[np.argsort(dates[order], kind="stable")]
+        dates_sorted, date_order = dates[order], order
+
+    ng = result.oos_rows
+    status_bits = {"NG": np.packbits(ng), "OK": np.packbits(~ng)}
+    status_positions = {"NG": np.flatnonzero(ng), "OK": np.flatnonzero(~ng)}
+
+    keys = run_keys(df[run_col]) if run_col in df else np.full(n, _RUN_MISSING, dtype=np.int64)
+    run_order = np.argsort(keys, kind="stable")
+    run_sorted = keys[run_order]
+    n_valid_runs = int(np.searchsorted(run_sorted, _RUN_MISSING))
+    return FilterIndex(n, dates_sorted, date_order, status_bits, status_positions,
+                       run_sorted[:n_valid_runs], run_order[:n_valid_runs])
+
+
+# 3. 查詢：每個條件都是二分搜尋；結果盡量維持為 slice（之後 iloc 只建立 view，不逐列比對）
+def _date_selection(index: FilterIndex, spec: FilterSpec):
+    lo = 0 if spec.start is None else int(np.searchsorted(index.dates_sorted, pd.Timestamp(spec.start).to_datetime64(), "left"))
+    hi = len(index.dates_sorted) if spec.end is None else int(np.searchsorted(index.dates_sorted, pd.Timestamp(spec.end).to_datetime64(), "right"))
+    hi = max(lo, hi)
+    if index.date_order is None:
+        return slice(lo, hi)
+    return np.sort(index.date_order[lo:hi])
+
+
+def _run_selection(index: FilterIndex, spec: FilterSpec) -> np.ndarray:
+    lo_key = 0 if spec.run_min is None else spec.run_min[0] * RUN_KEY_BASE + spec.run_min[1]
+    hi_key = _RUN_MISSING - 1 if spec.run_max is None else spec.run_max[0] * RUN_KEY_BASE + spec.run_max[1]
+    lo = int(np.searchsorted(index.run_sorted, lo_key, "left"))
+    hi = int(np.searchsorted(index.run_sorted, hi_key, "right"))
+    return np.sort(index.run_order[lo:max(lo, hi)])
+
+
+def _has_status(index: FilterIndex, status: str, positions: np.ndarray) -> np.ndarray:
+    bits = index.status_bits[status]
+    return ((bits[positions >> 3] >> (7 - (positions & 7))) & 1).astype(bool)
+
+
+def _intersect(sel, positions: np.ndarray) -> np.ndarray:
+    if isinstance(sel, slice):
+        lo, hi = np.searchsorted(positions, [sel.start, sel.stop])
+        return positions[lo:hi]
+    return np.intersect1d(sel, positions, assume_unique=True)
+
+
+@timed()
+def select(index: FilterIndex, spec: FilterSpec):
+    """
+    依 FilterSpec 回傳列位置：能以連續範圍表示時回傳 slice，否則回傳遞增的整數陣列。
+    """
+    sel = slice(0, index.n)
+    if spec.start is not None or spec.end is not None:
+        sel = _date_selection(index, spec)
+    if spec.run_min is not None or spec.run_max is not None:
+        sel = _intersect(sel, _run_selection(index, spec))
+    if spec.status is not None:
+        if isinstance(sel, slice):
+            # 狀態位置表是遞增的：與連續範圍交集只需兩次二分搜尋
+            sel = _intersect(sel, index.status_positions[spec.status])
+        else:
+            sel = sel[_has_status(index, spec.status, sel)]
+    return sel
+
+
+# 4. 產生篩選後的 view：資料與超標矩陣以同一組列位置切出，後續表格、圖表直接使用
+@timed()
+def filter_view(df: pd.DataFrame, result: ThresholdResult, index: FilterIndex,
+                spec: FilterSpec) -> tuple[pd.DataFrame, ThresholdResult]:
+    if not spec.active:
+        return df, result
+    sel = select(index, spec)
+    return df.iloc[sel], result.take(sel)
+
+
+# 5. 索引快取：以資料集內容為鍵，同一份資料集只建一次索引，所有 session 共用
+#    key 必須代表內容（檔案雜湊、增量狀態版本等）；沒有現成的鍵時傳 None，改用索引用到的欄位與超標矩陣的雜湊
+_index_cache: OrderedDict[str, FilterIndex] = OrderedDict()
+_index_lock = threading.Lock()
+_INDEX_CACHE_MAX = 16
+
+
+def index_fingerprint(df: pd.DataFrame, result: ThresholdResult,
+                      date_col: str = "電鍍開始時間", run_col: str = "電鍍次數") -> str:
+    cols = [c for c in (date_col, run_col) if c in df]
+    h = hashlib.sha1(pd.util.hash_pandas_object(df[cols], index=False).to_numpy().tobytes())
+    h.update(np.ascontiguousarray(result.violations).tobytes())
+    return h.hexdigest()
+
+
+def get_filter_index(key: str | None, df: pd.DataFrame, result: ThresholdResult, **kwargs) -> FilterIndex:
+    if key is None:
+        key = index_fingerprint(df, result, **kwargs)
+    key = f"{key}:{len(df)}"
+    with _index_lock:
+        hit = _index_cache.get(key)
+        if hit is not None:
+            _index_cache.move_to_end(key)
+            return hit
+    index = build_filter_index(df, result, **kwargs)
+    with _index_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > _INDEX_CACHE_MAX:
+            _index_cache.popitem(last=False)
+    return index
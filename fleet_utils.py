@@ -0,0 +1,144 @@
+# 余振中 (Yu Chen Chung)
+# fleet_utils.py
+# 多工作簿、多鍍槽平行處理；也可單獨執行，輸出跨槽總覽
+#
+# 用法：python fleet_utils.py 工作簿.xlsx [更多工作簿...] [--workers 4] [--out summary.parquet]
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from data_utils import (
+    clean_numeric_columns,
+    compute_status,
+    evaluate_thresholds,
+    load_sheet_projected,
+    load_sheets,
+)
+from threshold_utils import THRESHOLD_CONFIG_PATH, ThresholdConfig, evaluate_config, load_threshold_config
+
+# 鍍槽工作表名稱規則（EP15、EP16、EP17…）
+TANK_SHEET_PATTERN = r"^EP\d+$"
+
+# 行程池預設上限：每個子行程都要重新匯入 pandas / openpyxl（約 1 秒、上百 MB），
+# 而儀表板是多人共用的伺服器，一次總覽不該佔滿所有核心（可用環境變數 FLEET_MAX_WORKERS 調整）
+FLEET_MAX_WORKERS = int(os.getenv("FLEET_MAX_WORKERS", 4))
+
+
+# 0. 行程池一律用 spawn：監看程式等有其他執行緒的行程，fork 會連同別的執行緒當下持有的鎖一起複製，
+#    子行程可能永遠等不到那把鎖而卡死；spawn 啟動的是乾淨的直譯器。
+#    spawn 的子行程會重新匯入 __main__，而 Streamlit 把執行中的 app.py 登記成 __main__，
+#    所以儀表板不直接開行程池，改用 fleet_summary_subprocess
+def process_pool(max_workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+# 1. 自動找出工作簿中的鍍槽工作表（read_only 只讀工作簿目錄，不解析內容）
+def discover_tank_sheets(path: str, pattern: str = TANK_SHEET_PATTERN) -> list[str]:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True)
+    try:
+        names = wb.sheetnames
+    finally:
+        wb.close()
+    regex = re.compile(pattern)
+    return [name for name in names if regex.match(name)]
+
+# 2. 單一鍍槽的完整處理（讀取 → 清洗 → 判定），給行程池呼叫，所以必須是模組層級函式
+#    有傳 config 時依該槽的上下限時程判定（與儀表板相同），thresholds 只決定清洗的欄位
+def process_tank(path: str, sheet: str, thresholds: dict[str, tuple[float,float]],
+                 projected: bool = True, config: ThresholdConfig | None = None) -> pd.DataFrame:
+    if projected:
+        raw = load_sheet_projected(path, sheet)
+    else:
+        raw = load_sheets(path, (sheet,))[sheet]
+    df = clean_numeric_columns(raw, list(thresholds.keys()))
+    result = evaluate_thresholds(df, thresholds) if config is None else evaluate_config(df, config, sheet)
+    df = compute_status(df, thresholds, result)
+    return df.assign(槽號=sheet, 檔案=os.path.basename(path))
+
+# 3. 多工作簿、多鍍槽平行處理：XLSX 解碼吃 CPU，用行程池讓各槽同時解析
+def process_fleet(paths: list[str], thresholds: dict[str, tuple[float,float]],
+                  max_workers: int | None = None, projected: bool = True,
+                  pattern: str = TANK_SHEET_PATTERN, config: ThresholdConfig | None = None) -> pd.DataFrame:
+    jobs = [(path, sheet) for path in paths for sheet in discover_tank_sheets(path, pattern)]
+    if not jobs:
+        return pd.DataFrame()
+
+    if len(jobs) == 1 or max_workers == 1:
+        frames = [process_tank(path, sheet, thresholds, projected, config) for path, sheet in jobs]
+    else:
+        workers = min(len(jobs), max_workers or min(os.cpu_count() or 1, FLEET_MAX_WORKERS))
+        with process_pool(workers) as pool:
+            futures = [pool.submit(process_tank, path, sheet, thresholds, projected, config) for path, sheet in jobs]
+            frames = [f.result() for f in futures]
+
+    return pd.concat(frames, ignore_index=True)
+
+# 4. 跨槽總覽：各槽筆數、NG 數與比例、最後一次電鍍時間、各濃度平均
+def fleet_summary(combined: pd.DataFrame, thresholds: dict[str, tuple[float,float]],
+                  date_col: str = "電鍍開始時間") -> pd.DataFrame:
+    if combined.empty:
+        return pd.DataFrame()
+    grouped = combined.assign(_ng=combined["狀態"].eq("NG")).groupby(["檔案", "槽號"], sort=True)
+    summary = grouped.agg(
+        筆數=("狀態", "size"),
+        NG筆數=("_ng", "sum"),
+        最後電鍍時間=(date_col, "max"),
+        **{f"{col} 平均": (col, "mean") for col in thresholds},
+    )
+    summary.insert(2, "NG比例", summary["NG筆數"] / summary["筆數"])
+    return summary.reset_index()
+
+# 5. 儀表板用：在獨立的 `python fleet_utils.py` 子行程執行整批處理（它的 __main__ 可安全地被 spawn 重新匯入），
+#    設定（可能是畫面上調整中的版本）與總覽都經由暫存檔傳遞
+def fleet_summary_subprocess(paths: list[str], config: ThresholdConfig, max_workers: int | None = None,
+                             projected: bool = True, pattern: str = TANK_SHEET_PATTERN) -> pd.DataFrame:
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "thresholds.json")
+        with open(config_path, "w", encoding="utf-8") as f:
+            json.dump(config.to_dict(), f, ensure_ascii=False)
+        out = os.path.join(tmp, "summary.parquet")
+        cmd = [sys.executable, os.path.abspath(__file__), *map(os.path.abspath, paths),
+               "--config", config_path, "--pattern", pattern, "--out", out]
+        if max_workers:
+            cmd += ["--workers", str(max_workers)]
+        if not projected:
+            cmd.append("--full")
+        proc = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if proc.returncode != 0:
+            raise RuntimeError(f"鍍槽總覽處理失敗：\n{proc.stderr[-2000:]}")
+        return pd.read_parquet(out)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="多工作簿、多鍍槽平行處理，輸出跨槽總覽")
+    parser.add_argument("workbooks", nargs="+", help="一或多個 Excel 工作簿")
+    parser.add_argument("--config", default=THRESHOLD_CONFIG_PATH, help="規格上下限設定檔")
+    parser.add_argument("--pattern", default=TANK_SHEET_PATTERN, help="鍍槽工作表名稱規則（正規表示式）")
+    parser.add_argument("--workers", type=int, default=None, help=f"行程數（預設為核心數，最多 {FLEET_MAX_WORKERS}）")
+    parser.add_argument("--full", action="store_true", help="讀取全部欄位（預設只讀判定用到的欄位）")
+    parser.add_argument("--out", help="總覽輸出檔（.parquet 或 .csv）；未指定時直接印出")
+    args = parser.parse_args()
+
+    config = load_threshold_config(args.config)
+    combined = process_fleet(args.workbooks, config.default, args.workers, not args.full, args.pattern, config)
+    summary = fleet_summary(combined, config.default)
+    if args.out is None:
+        print(summary.to_string())
+    elif args.out.endswith(".parquet"):
+        summary.to_parquet(args.out)
+    else:
+        summary.to_csv(args.out, index=False, encoding="utf-8-sig")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,55 @@
 # 余振中 (Yu Chen Chung)
 # genai_utils.py
+import asyncio
 import time
 import os
-from google import genai  # 新 SDK 的正確匯入
+import hashlib
+import json
+import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 
-# 改為從環境變數中讀取 API Key
-API_KEY = os.getenv("GOOGLE_API_KEY")
+import numpy as np
+import pandas as pd
 
-# 防止未設金鑰時系統無聲錯誤
-if not API_KEY:
-    raise ValueError("請設定環境變數 GOOGLE_API_KEY 以使用 Gemini API。")
+from perf_utils import timed
 
-# 在模組載入時，先建立一個 genai.Client 實例
-_client = genai.Client()
+# google-genai 匯入很慢，而且未設金鑰時不該讓整個儀表板起不來：
+# 改成第一次真的要呼叫 Gemini 時才匯入並建立 client
+_client = None
+_client_lock = threading.Lock()
 
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            # 改為從環境變數中讀取 API Key
+            if not os.getenv("GOOGLE_API_KEY"):
+                # 防止未設金鑰時系統無聲錯誤
+                raise ValueError("請設定環境變數 GOOGLE_API_KEY 以使用 Gemini API。")
+            from google import genai  # 新 SDK 的正確匯入
+            # GEMINI_BASE_URL 可指向本地的假 Gemini 伺服器做測試
+            base_url = os.getenv("GEMINI_BASE_URL")
+            _client = genai.Client(http_options={"base_url": base_url} if base_url else None)
+        return _client
+
+# 判斷是否為 503（模型過載）錯誤：google-genai 的 APIError 帶有 code，其餘以訊息判斷
+def is_overloaded(error: Exception) -> bool:
+    err_msg = str(error)
+    return getattr(error, "code", None) == 503 or "503 UNAVAILABLE" in err_msg or "The model is overloaded" in err_msg
+
+
+@timed()
 def ask_gemini(
     prompt_text: str,
     model: str = "gemini-2.0-flash",
     max_retries: int = 4,
     initial_backoff: float = 1.0,
-    backoff_factor: float = 2.0
+    backoff_factor: float = 2.0,
+    client=None
 ) -> str:
     """
     呼叫 Gemini API 取得回答，內建 503 過載自動重試機制。
@@ -30,15 +60,21 @@ def ask_gemini(
     - max_retries: 最大重試次數（遇到 503 時）
     - initial_backoff: 初始等待秒數
     - backoff_factor: 每次重試等待時間乘的係數（指數退避）
+    - client: 具備 models.generate_content 的客戶端，預設第一次使用時才建立 Gemini client（測試可換成本地替身）
 
     回傳：Gemini 回答的文字。如果超過重試次數仍失敗，回傳錯誤訊息字串。
     """
     backoff = initial_backoff
+    if client is None:
+        try:
+            client = get_client()
+        except (ValueError, ImportError) as e:
+            return f"Error: 無法建立 Gemini client：{e}"
 
     for attempt in range(1, max_retries + 1):
         try:
             # 呼叫模型：只傳 model 與 contents（避免 generation_config 參數錯誤）
-            response = _client.models.generate_content(
+            response = client.models.generate_content(
                 model=model,
                 contents=prompt_text
             )
@@ -47,8 +83,7 @@ def ask_gemini(
 
         except Exception as e:
             err_msg = str(e)
-            # 判斷是否為 503（模型過載）錯誤
-            if "503 UNAVAILABLE" in err_msg or "The model is overloaded" in err_msg:
+            if is_overloaded(e):
                 if attempt < max_retries:
                     # 如果未達上限，就等待後重試
                     time.sleep(backoff)
@@ -63,3 +98,310 @@ def ask_gemini(
 
     # 理論上不會跑到這裡，保險起見回傳一個通用錯誤
     return "Error: 無法取得回覆，請稍後再試。"
+
+
+def prompt_key(prompt_text: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\x00{prompt_text}".encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    以 prompt 雜湊為鍵的回覆快取：記憶體 LRU + TTL，可選擇同步寫到磁碟目錄。
+
+    只快取成功的回覆（不以 "Error:" 開頭）。
+    """
+
+    def __init__(self, max_entries: int = 128, ttl: float = 3600.0, disk_dir: str | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None:
+                if now - hit[0] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    return hit[1]
+                del self._entries[key]
+
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            try:
+                with open(self._disk_path(key), encoding="utf-8") as f:
+                    saved = json.load(f)
+            except (OSError, ValueError):
+                return None
+            if now - saved["t"] <= self.ttl:
+                self._put_memory(key, saved["t"], saved["text"])
+                return saved["text"]
+        return None
+
+    def _put_memory(self, key: str, stamp: float, text: str) -> None:
+        with self._lock:
+            self._entries[key] = (stamp, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key: str, text: str) -> None:
+        if text.startswith("Error:"):
+            return
+        stamp = time.time()
+        self._put_memory(key, stamp, text)
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            tmp = f"{self._disk_path(key)}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"t": stamp, "text": text}, f, ensure_ascii=False)
+            os.replace(tmp, self._disk_path(key))
+
+
+class GeminiRunner:
+    """
+    在背景執行緒池呼叫 Gemini，頁面不必等待回覆。
+
+    - 相同 prompt 若已有結果（快取未過期）直接回傳已完成的 Future
+    - 相同 prompt 正在執行中時，共用同一個 Future，不重複送出
+    - client 可換成任何具備 models.generate_content 的物件（例如測試用的本地替身）
+    """
+
+    def __init__(self, client=None, max_workers: int = 2, cache: ResponseCache | None = None):
+        self.client = client
+        self.cache = cache or ResponseCache()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+        self._inflight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @timed("genai_utils.GeminiRunner.submit")
+    def submit(self, prompt_text: str, model: str = "gemini-2.0-flash", **kwargs) -> Future:
+        key = prompt_key(prompt_text, model)
+        cached = self.cache.get(key)
+        if cached is not None:
+            done: Future = Future()
+            done.set_result(cached)
+            return done
+
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            future = self._pool.submit(ask_gemini, prompt_text, model=model, client=self.client, **kwargs)
+            self._inflight[key] = future
+
+        def _finish(f: Future, key=key):
+            with self._lock:
+                self._inflight.pop(key, None)
+            if f.exception() is None:
+                self.cache.put(key, f.result())
+
+        future.add_done_callback(_finish)
+        return future
+
+
+# 模組層級的共用 runner（同一個 Streamlit 行程內所有 session 共用快取與執行中請求）
+_runner: GeminiRunner | None = None
+_runner_lock = threading.Lock()
+
+
+def get_runner() -> GeminiRunner:
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = GeminiRunner(cache=ResponseCache(disk_dir=os.getenv("GEMINI_CACHE_DIR")))
+        return _runner
+
+
+# 批次分析：多個鍍槽 × 多個時間範圍，一次並行送出
+# 分析範圍：(種類, 數量)；rows 為最後 N 筆，days 為該槽最後一筆往前 N 天（報表看的是資料本身的最新狀態）
+ANALYSIS_WINDOWS = {
+    "最近 7 筆": ("rows", 7),
+    "最近 7 天": ("days", 7),
+    "最近 30 天": ("days", 30),
+}
+
+ANALYST_INSTRUCTION = "你是一位資深電鍍分析師。請根據以下藥液濃度摘要判斷趨勢並提出改善建議，回答請控制在 200 字以內。"
+
+
+@dataclass
+class AnalysisRequest:
+    tank: str
+    window: str
+    prompt: str
+    n_rows: int = 0
+
+
+@dataclass
+class AnalysisResult:
+    tank: str
+    window: str
+    text: str
+    ok: bool
+    attempts: int = 0
+    latency_s: float = 0.0
+    cached: bool = False
+    prompt_chars: int = 0
+    error: str | None = None
+
+
+# 1. 依分析範圍取出列位置（df 需依時間排序，與 ThresholdResult 的列順序一致）
+def window_positions(df: pd.DataFrame, window: str, date_col: str = "電鍍開始時間") -> np.ndarray:
+    kind, size = ANALYSIS_WINDOWS[window]
+    n = len(df)
+    if kind == "rows" or date_col not in df:
+        return np.arange(max(n - size, 0), n)
+    dates = pd.to_datetime(df[date_col], errors="coerce")
+    if dates.isna().all():
+        return np.arange(max(n - size, 0), n)
+    since = dates.max() - pd.Timedelta(days=size)
+    return np.flatnonzero((dates >= since).to_numpy())
+
+
+# 2. 精簡 prompt：送統計摘要與超標清單，不送原始 CSV，token 數與資料筆數幾乎無關
+def build_compact_prompt(tank: str, window: str, df: pd.DataFrame, result,
+                         thresholds: dict[str, tuple[float,float]],
+                         date_col: str = "電鍍開始時間", max_violations: int = 20) -> AnalysisRequest:
+    pos = window_positions(df, window, date_col)
+    part = df.iloc[pos]
+    flags = result.take(pos).violations
+    n = len(part)
+    ng = int(flags.any(axis=1).sum())
+
+    span = ""
+    if date_col in part and n:
+        dates = pd.to_datetime(part[date_col], errors="coerce")
+        span = f"{dates.min():%Y-%m-%d %H:%M} ~ {dates.max():%Y-%m-%d %H:%M}，"
+    lines = [ANALYST_INSTRUCTION, f"鍍槽 {tank}，{window}（{span}共 {n} 批，NG {ng} 批）。", ""]
+
+    lines.append("濃度摘要（規格｜平均｜最小｜最大｜標準差｜最新｜每批變化）：")
+    for col, (low, high) in thresholds.items():
+        values = pd.to_numeric(part[col], errors="coerce").to_numpy(dtype="float64")
+        valid = values[~np.isnan(values)]
+        if len(valid) == 0:
+            lines.append(f"- {col}：{low}~{high}｜無資料")
+            continue
+        slope = np.polyfit(np.arange(len(valid)), valid, 1)[0] if len(valid) >= 2 else 0.0
+        lines.append(
+            f"- {col}：{low}~{high}｜{valid.mean():.2f}｜{valid.min():.2f}｜{valid.max():.2f}｜"
+            f"{valid.std(ddof=1) if len(valid) > 1 else 0.0:.2f}｜{valid[-1]:.2f}｜{slope:+.3f}"
+        )
+
+    rows, cols = np.nonzero(flags)
+    if len(rows):
+        shown = slice(-max_violations, None)   # 只列最近的幾筆
+        lines += ["", f"超標紀錄（共 {len(rows)} 格，列出最近 {min(len(rows), max_violations)} 格；時間｜項目｜數值）："]
+        for r, c in zip(rows[shown], cols[shown]):
+            col = result.columns[c]
+            low, high = thresholds[col]
+            value = pd.to_numeric(part[col].iloc[r], errors="coerce")
+            when = part[date_col].iloc[r] if date_col in part else part.index[r]
+            side = "缺值" if pd.isna(value) else (f"高於 {high}" if value > high else f"低於 {low}")
+            lines.append(f"- {when}｜{col}｜{'' if pd.isna(value) else f'{value:.2f}'}（{side}）")
+    else:
+        lines += ["", "此範圍內沒有超標紀錄。"]
+    return AnalysisRequest(tank=tank, window=window, prompt="\n".join(lines), n_rows=n)
+
+
+def build_analysis_requests(tanks: dict[str, tuple[pd.DataFrame, object]],
+                            thresholds: dict[str, tuple[float,float]],
+                            windows=tuple(ANALYSIS_WINDOWS), date_col: str = "電鍍開始時間") -> list[AnalysisRequest]:
+    return [
+        build_compact_prompt(tank, window, df, result, thresholds, date_col)
+        for tank, (df, result) in tanks.items()
+        for window in windows
+    ]
+
+
+# 3. 所有請求共用的速率限制（token bucket）：等待時只 await，不佔用執行緒
+class AsyncRateLimiter:
+    def __init__(self, rate_per_minute: float = 60.0, burst: int = 1):
+        self.interval = 60.0 / rate_per_minute
+        self.capacity = float(burst)
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) / self.interval)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * self.interval)
+
+
+async def _generate(client, model: str, prompt_text: str) -> str:
+    # google-genai 提供 client.aio 非同步介面；沒有的替身就丟到執行緒執行
+    aio = getattr(client, "aio", None)
+    if aio is not None:
+        response = await aio.models.generate_content(model=model, contents=prompt_text)
+    else:
+        response = await asyncio.to_thread(client.models.generate_content, model=model, contents=prompt_text)
+    return response.text
+
+
+# 4. 單一請求：semaphore 只包住實際呼叫，退避等待期間讓出名額；503 以指數退避 + 隨機抖動重試
+async def _analyze_one(req: AnalysisRequest, client, model: str, semaphore: asyncio.BoundedSemaphore,
+                       limiter: AsyncRateLimiter, cache: ResponseCache | None, max_retries: int,
+                       initial_backoff: float, backoff_factor: float) -> AnalysisResult:
+    key = prompt_key(req.prompt, model)
+    base = dict(tank=req.tank, window=req.window, prompt_chars=len(req.prompt))
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        return AnalysisResult(text=cached, ok=True, cached=True, **base)
+
+    t0 = time.perf_counter()
+    backoff = initial_backoff
+    for attempt in range(1, max_retries + 1):
+        await limiter.acquire()
+        try:
+            async with semaphore:
+                text = await _generate(client, model, req.prompt)
+        except Exception as e:
+            if is_overloaded(e) and attempt < max_retries:
+                await asyncio.sleep(random.uniform(0, backoff))   # full jitter，避免大家同時重試
+                backoff *= backoff_factor
+                continue
+            error = f"模型連續 {max_retries} 次 503 過載" if is_overloaded(e) else f"呼叫過程中發生例外：{e}"
+            return AnalysisResult(text=f"Error: {error}", ok=False, attempts=attempt,
+                                  latency_s=time.perf_counter() - t0, error=error, **base)
+        if cache is not None:
+            cache.put(key, text)
+        return AnalysisResult(text=text, ok=True, attempts=attempt, latency_s=time.perf_counter() - t0, **base)
+
+
+async def analyze_batch_async(requests: list[AnalysisRequest], client=None, model: str = "gemini-2.0-flash",
+                              concurrency: int = 4, rate_per_minute: float = 60.0,
+                              cache: ResponseCache | None = None, max_retries: int = 4,
+                              initial_backoff: float = 1.0, backoff_factor: float = 2.0) -> list[AnalysisResult]:
+    if client is None:
+        try:
+            client = get_client()
+        except (ValueError, ImportError) as e:
+            error = f"無法建立 Gemini client：{e}"
+            return [AnalysisResult(req.tank, req.window, f"Error: {error}", ok=False, error=error) for req in requests]
+    semaphore = asyncio.BoundedSemaphore(concurrency)
+    limiter = AsyncRateLimiter(rate_per_minute, burst=concurrency)
+    return list(await asyncio.gather(*(
+        _analyze_one(req, client, model, semaphore, limiter, cache, max_retries, initial_backoff, backoff_factor)
+        for req in requests
+    )))
+
+
+# 5. 同步入口（報表 CLI 使用）：結果順序與 requests 相同
+@timed()
+def analyze_batch(requests: list[AnalysisRequest], **kwargs) -> list[AnalysisResult]:
+    """
+    並行分析多個 prompt，回傳與 requests 同順序的 AnalysisResult。
+
+    kwargs 同 analyze_batch_async（client、model、concurrency、rate_per_minute、cache、重試參數）。
+    """
+    return asyncio.run(analyze_batch_async(requests, **kwargs))
@@ -0,0 +1,278 @@
+# 余振中 (Yu Chen Chung)
+# history_utils.py
+# 歷史資料庫：把各鍍槽工作表轉成依「鍍槽 / 月份」分區的 Parquet，之後的查詢只讀需要的分區與欄位，不再解析 XLSX
+#
+# 匯入：python history_utils.py import 電鍍履歷表.xlsx [更多工作簿...] [--root history]
+# 查詢：python history_utils.py sql "SELECT tank, count(*) FROM history GROUP BY tank" [--root history]
+#
+# 目錄結構：<root>/tank=EP15/month=2018-01/part-<來源>.parquet
+#   <來源> 為工作簿路徑的雜湊：同一份工作簿重新匯入時只取代它自己的檔案，不同工作簿的同一鍍槽 / 月份各自保留
+# 全部在本機執行：Parquet 由 pyarrow 讀寫，SQL 彙總用內嵌的 DuckDB（沒有安裝時退回 pandas）
+import argparse
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from data_utils import DATETIME_COLUMNS, FLOAT32_COLUMNS, load_sheets, normalize_dtypes
+from fleet_utils import TANK_SHEET_PATTERN, discover_tank_sheets
+from perf_utils import timed
+from time_utils import build_time_buckets
+
+HISTORY_DIR = os.getenv("HISTORY_DIR", "history")
+DATE_COL = "電鍍開始時間"
+
+# 每列在原工作表中的順序與來源工作簿，讀回時用來還原列順序
+_SEQ = "_seq"
+_SOURCE = "_source"
+_LEGACY_PART = "part-0.parquet"
+_PARTITION_COLS = ["tank", "month"]
+_UNKNOWN_MONTH = "unknown"
+
+# 1. 寫入前統一欄位型別，讓同一鍍槽各月份、各次匯入的檔案 schema 盡量一致：
+#    量測值 float32、其他數值 float64、時間 timestamp、其餘（含數字文字混雜的欄位）一律字串
+def _to_storage_frame(df: pd.DataFrame) -> pd.DataFrame:
+    df = normalize_dtypes(df)
+    converted = {}
+    for col in df.columns:
+        s = df[col]
+        if col in FLOAT32_COLUMNS or col in DATETIME_COLUMNS:
+            continue
+        if pd.api.types.is_bool_dtype(s) or pd.api.types.is_numeric_dtype(s):
+            converted[col] = s.astype("float64")
+        elif not pd.api.types.is_datetime64_any_dtype(s):
+            text = s.astype(object)
+            converted[col] = text.where(text.isna(), text.astype(str)).astype(object)
+    return df.assign(**converted)
+
+
+def _write_partition(path: str, table) -> None:
+    import pyarrow.parquet as pq
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    pq.write_table(table, tmp, compression="zstd")
+    os.replace(tmp, path)
+
+
+def source_id(path: str) -> str:
+    return hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+
+
+def _part_name(source: str) -> str:
+    return f"part-{source}.parquet"
+
+
+# 2. 匯入：一次讀取工作簿，依鍍槽與月份拆成分區寫入；回傳各鍍槽匯入的列數
+#    同一份工作簿上次匯入、這次已沒有資料的月份檔案一併刪除
+@timed()
+def import_workbook(path: str, root: str = HISTORY_DIR, pattern: str = TANK_SHEET_PATTERN) -> dict[str, int]:
+    sheets = tuple(discover_tank_sheets(path, pattern))
+    import pyarrow as pa
+
+    source = source_id(path)
+    counts = {}
+    for tank, raw in load_sheets(path, sheets).items():
+        frame = _to_storage_frame(raw).assign(**{_SEQ: np.arange(len(raw), dtype=np.int64), _SOURCE: source})
+        # 整張表先轉成一個 Arrow table 再切分區，各月份檔案的 schema 才會一致（不會因某月全是空值而推成別的型別）；
+        # 不保存 pandas metadata：讀回時字串欄位是一般 object，與從 Excel 讀入的型別一致
+        table = pa.Table.from_pandas(frame, preserve_index=False).replace_schema_metadata(None)
+        dates = pd.to_datetime(frame[DATE_COL], errors="coerce") if DATE_COL in frame else pd.Series(pd.NaT, index=frame.index)
+        months = dates.dt.strftime("%Y-%m").fillna(_UNKNOWN_MONTH).to_numpy()
+        base = os.path.join(root, f"tank={tank}")
+        written = set()
+        for month in pd.unique(months):
+            part = table.take(np.flatnonzero(months == month))
+            target = os.path.join(base, f"month={month}", _part_name(source))
+            _write_partition(target, part)
+            written.add(target)
+            # 舊版本固定寫成 part-0.parquet（每次匯入整個分區覆寫），同一月份重新匯入時照舊取代它
+            legacy = os.path.join(base, f"month={month}", _LEGACY_PART)
+            if os.path.exists(legacy):
+                os.remove(legacy)
+        for month_dir in os.listdir(base):
+            stale = os.path.join(base, month_dir, _part_name(source))
+            if stale not in written and os.path.exists(stale):
+                os.remove(stale)
+        counts[tank] = len(frame)
+    return counts
+
+
+# 3. 查詢介面：鍍槽 / 月份條件在分區層級就排除檔案（partition pruning），時間條件下推到 row group，
+#    只讀取指定欄位（column pushdown）
+class HistoryStore:
+    def __init__(self, root: str = HISTORY_DIR):
+        self.root = root
+        self._datasets: dict[str, tuple[str, object]] = {}   # 鍍槽 → (版本, pyarrow dataset)
+
+    def tanks(self) -> list[str]:
+        if not os.path.isdir(self.root):
+            return []
+        names = [d[len("tank="):] for d in os.listdir(self.root) if d.startswith("tank=")]
+        return sorted(names, key=lambda s: (len(s), s))
+
+    def _files(self, tank: str | None = None) -> list[str]:
+        tanks = [tank] if tank is not None else self.tanks()
+        files = []
+        for t in tanks:
+            base = os.path.join(self.root, f"tank={t}")
+            if not os.path.isdir(base):
+                continue
+            for month in sorted(os.listdir(base)):
+                folder = os.path.join(base, month)
+                if os.path.isdir(folder):
+                    files += [os.path.join(folder, f) for f in sorted(os.listdir(folder))
+                              if f.startswith("part-") and f.endswith(".parquet")]
+        return files
+
+    # 分區檔案的（路徑, 大小, 修改時間）雜湊：重新匯入後改變，可作為共用資料集快取鍵的一部分
+    def version(self, tank: str | None = None) -> str:
+        h = hashlib.sha1()
+        for path in self._files(tank):
+            st = os.stat(path)
+            h.update(f"{os.path.relpath(path, self.root)}|{st.st_size}|{st.st_mtime_ns}".encode("utf-8"))
+        return h.hexdigest()
+
+    # 每個鍍槽各自一個 dataset：不同工作表同名欄位的型別可能不同（例如一槽是數字、另一槽混有文字）
+    def _pa_dataset(self, tank: str):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        version = self.version(tank)
+        cached = self._datasets.get(tank)
+        if cached is None or cached[0] != version:
+            partitioning = ds.partitioning(pa.schema([("tank", pa.string()), ("month", pa.string())]), flavor="hive")
+            files = self._files(tank)
+            # 不同次匯入的檔案欄位可能略有不同，先合併 schema，缺的欄位讀成空值
+            schemas = [ds.dataset(f, format="parquet").schema for f in files]
+            schema = pa.unify_schemas([*schemas, partitioning.schema], promote_options="permissive")
+            dataset = ds.dataset(files, format="parquet", partitioning=partitioning,
+                                 partition_base_dir=self.root, schema=schema)
+            self._datasets[tank] = cached = (version, dataset)
+        return cached[1]
+
+    @timed()
+    def scan(self, tank: str, columns: list[str] | None = None,
+             start: pd.Timestamp | None = None, end: pd.Timestamp | None = None) -> pd.DataFrame:
+        """
+        讀取單一鍍槽的資料（依原工作表順序）。columns 為 None 時讀全部欄位；start / end 為電鍍開始時間的範圍（含端點）。
+        """
+        import pyarrow.dataset as ds
+
+        if not self._files(tank):
+            raise KeyError(f"歷史資料庫中沒有鍍槽 {tank}")
+        dataset = self._pa_dataset(tank)
+        names = set(dataset.schema.names)
+        expr = ds.field("tank") == tank
+        if start is not None:
+            start = pd.Timestamp(start)
+            expr &= (ds.field("month") >= start.strftime("%Y-%m")) & (ds.field(DATE_COL) >= start.to_pydatetime())
+        if end is not None:
+            end = pd.Timestamp(end)
+            expr &= (ds.field("month") <= end.strftime("%Y-%m")) & (ds.field(DATE_COL) <= end.to_pydatetime())
+
+        data_cols = [c for c in dataset.schema.names if c not in (*_PARTITION_COLS, _SEQ, _SOURCE)] if columns is None \
+            else [c for c in columns if c in names]
+        order = ["month", *([_SOURCE] if _SOURCE in names else []), _SEQ]
+        table = dataset.to_table(columns=[*data_cols, *order], filter=expr)
+        df = table.to_pandas()
+        # 分區月份字串可直接排序（unknown 排最後），同月內依來源工作簿、原本列順序
+        df = df.sort_values(order, kind="stable").drop(columns=order).reset_index(drop=True)
+        return normalize_dtypes(df)
+
+    # 3.1 月彙總：SQL group-by 只掃描該鍍槽（與時間範圍內）的分區；require 欄位有空值的列不計（與清洗規則相同），
+    #     給 thresholds 時另外算出每月 NG 筆數
+    @timed()
+    def monthly(self, tank: str, sum_cols: tuple[str, ...] = (), mean_cols: tuple[str, ...] = (),
+                require: tuple[str, ...] = (), thresholds: dict[str, tuple[float,float]] | None = None,
+                start: pd.Timestamp | None = None, end: pd.Timestamp | None = None) -> pd.DataFrame:
+        try:
+            import duckdb
+        except ImportError:
+            return self._monthly_pandas(tank, sum_cols, mean_cols, require, thresholds, start, end)
+
+        files = self._files(tank)
+        if not files:
+            return pd.DataFrame(columns=["period", "count", "period_str"])
+        q = lambda c: '"' + c.replace('"', '""') + '"'
+        select = [f"date_trunc('month', {q(DATE_COL)}) AS period", "count(*) AS count"]
+        select += [f"coalesce(sum({q(c)}), 0) AS {q(c + '_sum')}" for c in sum_cols]
+        select += [f"avg({q(c)}) AS {q(c + '_mean')}" for c in mean_cols]
+        if thresholds:
+            within = " AND ".join(f"({q(c)} BETWEEN {float(lo)} AND {float(hi)})" for c, (lo, hi) in thresholds.items())
+            select.append(f"count_if(NOT ({within})) AS ng")
+        where = [f"{q(DATE_COL)} IS NOT NULL", *(f"{q(c)} IS NOT NULL" for c in require)]
+        params = []
+        if start is not None:
+            where += ["month >= ?", f"{q(DATE_COL)} >= ?"]
+            params += [pd.Timestamp(start).strftime("%Y-%m"), pd.Timestamp(start).to_pydatetime()]
+        if end is not None:
+            where += ["month <= ?", f"{q(DATE_COL)} <= ?"]
+            params += [pd.Timestamp(end).strftime("%Y-%m"), pd.Timestamp(end).to_pydatetime()]
+
+        sql = (
+            f"SELECT {', '.join(select)} "
+            f"FROM read_parquet(?, hive_partitioning = true, union_by_name = true) "
+            f"WHERE {' AND '.join(where)} GROUP BY 1 ORDER BY 1"
+        )
+        with duckdb.connect() as con:
+            out = con.execute(sql, [files, *params]).df()
+        out["period"] = pd.to_datetime(out["period"]).astype("datetime64[ns]")
+        out["period_str"] = out["period"].dt.strftime("%Y-%m")
+        return out
+
+    def _monthly_pandas(self, tank, sum_cols, mean_cols, require, thresholds, start, end) -> pd.DataFrame:
+        cols = list(dict.fromkeys([DATE_COL, *sum_cols, *mean_cols, *require, *(thresholds or {})]))
+        df = self.scan(tank, cols, start, end).dropna(subset=list(require))
+        if thresholds:
+            values = df[list(thresholds)].to_numpy(dtype="float64")
+            lows = np.array([lo for lo, _ in thresholds.values()])
+            highs = np.array([hi for _, hi in thresholds.values()])
+            df = df.assign(ng=(~((values >= lows) & (values <= highs)).all(axis=1)).astype("float64"))
+        out = build_time_buckets(df, DATE_COL).aggregate("month", sum_cols=(*sum_cols, *(["ng"] if thresholds else [])),
+                                                         mean_cols=mean_cols)
+        return out.rename(columns={"ng_sum": "ng"})
+
+    # 3.2 任意 SQL：整個歷史資料庫以 history 這個 view 提供（含 tank、month 分區欄位）
+    def sql(self, query: str, params: list | None = None) -> pd.DataFrame:
+        import duckdb
+
+        files = self._files()
+        # CREATE VIEW 不能帶參數，檔案清單以 SQL 字串常值展開
+        paths = ", ".join("'" + f.replace("'", "''") + "'" for f in files)
+        source = (f"read_parquet([{paths}], hive_partitioning = true, union_by_name = true)" if files
+                  else "(SELECT NULL::VARCHAR AS tank, NULL::VARCHAR AS month WHERE false)")
+        with duckdb.connect() as con:
+            con.execute(f"CREATE VIEW history AS SELECT * FROM {source}")
+            return con.execute(query, params or []).df()
+
+
+def open_history(root: str = HISTORY_DIR) -> HistoryStore | None:
+    store = HistoryStore(root)
+    return store if store.tanks() else None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="電鍍歷史資料庫（Parquet 分區 + DuckDB）")
+    parser.add_argument("--root", default=HISTORY_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_import = sub.add_parser("import", help="把工作簿的鍍槽工作表匯入歷史資料庫")
+    p_import.add_argument("workbooks", nargs="+")
+    p_import.add_argument("--pattern", default=TANK_SHEET_PATTERN)
+    p_sql = sub.add_parser("sql", help="對 history view 執行 SQL")
+    p_sql.add_argument("query")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        for path in args.workbooks:
+            for tank, n in import_workbook(path, args.root, args.pattern).items():
+                print(f"{path} {tank}: {n} 列")
+        return 0
+    print(HistoryStore(args.root).sql(args.query).to_string())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
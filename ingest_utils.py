@@ -0,0 +1,382 @@
+# 余振中 (Yu Chen Chung)
+# ingest_utils.py
+import datetime
+import glob
+import hashlib
+import io
+import json
+import logging
+import os
+import uuid
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from cache_utils import arrow_safe, workbook_cache_dir
+from data_utils import ThresholdResult, clean_numeric_columns, compute_status, evaluate_thresholds
+from parse_utils import PARSER_VERSION
+from time_utils import build_time_buckets
+
+logger = logging.getLogger(__name__)
+
+# 1. 增量處理狀態：已消化的原始列數、已處理部分的指紋、處理後資料與月彙總
+@dataclass
+class IngestState:
+    sheet: str
+    thresholds: dict[str, tuple[float,float]]
+    raw_rows: int               # 已處理的原始資料列數（不含表頭、不含尾端空白列）
+    last_row_key: str           # 最後一列原始資料的指紋，用來確認它沒被改動
+    data: pd.DataFrame          # 清洗 + 狀態計算後的資料
+    violations: np.ndarray      # 與 data 對齊的超標矩陣
+    monthly: pd.DataFrame       # 月彙總（period、count、<物料>_sum、period_str）
+    new_rows: int = 0           # 本次更新新增的原始列數
+    prefix_key: str = ""        # 表頭 + 最後一列之前各列的內容指紋（見 _scan_sheet_xml），空字串表示無法增量
+    columns: list = field(default_factory=list)   # 原始欄位（依工作表順序）
+    version: str = ""           # 內容版本：每次寫入狀態（重建或新增列）都換新，作為下游快取鍵
+    shared_strings: int = 0     # 寫入狀態時共用字串表的筆數；prefix_key 只納入這麼多筆
+
+    @property
+    def threshold_result(self) -> ThresholdResult:
+        return ThresholdResult(list(self.thresholds), self.violations, self.data.index)
+
+
+# 列指紋：數值統一成 float、時間統一成 ISO 字串，避免整份讀取與尾端讀取推斷出不同 dtype
+def _row_key(row: pd.Series) -> str:
+    parts = []
+    for v in row.tolist():
+        if v is None or (isinstance(v, float) and np.isnan(v)) or v is pd.NaT:
+            parts.append("")
+        elif isinstance(v, (int, float, np.number)) and not isinstance(v, bool):
+            parts.append(repr(float(v)))
+        elif isinstance(v, (pd.Timestamp, datetime.datetime, datetime.date)):
+            parts.append(pd.Timestamp(v).isoformat())
+        else:
+            parts.append(str(v))
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+# 去掉尾端全空的列（Excel 常見的格式化空白列）
+def _trim_trailing_empty(df: pd.DataFrame) -> pd.DataFrame:
+    filled = np.flatnonzero(df.notna().any(axis=1).to_numpy())
+    return df.iloc[: filled[-1] + 1].copy() if len(filled) else df.iloc[:0].copy()
+
+
+# 2. 只讀尾端：xlsx 的工作表是 zip 裡的一份 XML，無法跳著解壓，但解壓與位元組比對很便宜，
+#    真正花時間的是把儲存格解析成 Python 物件。這裡串流解壓，以位元組比對找到 <row r="N"> 的位置：
+#    在它之前的部分只做雜湊（已處理列的指紋，任何一格被改都會不同），之後的部分才交給 openpyxl 解析
+_CHUNK = 1 << 20
+
+
+def _scan_sheet_xml(src, first_row: int) -> tuple[bytes, bytes, "hashlib._Hash", bytes] | None:
+    """
+    回傳（<sheetData> 之前的 XML, 表頭列 XML, 已更新表頭與 first_row 之前各列的雜湊, 第 first_row 列起的 XML）。
+    工作表是空的、或找不到第 first_row 列時回傳 None。
+    """
+    buf = b""
+    while True:
+        chunk = src.read(_CHUNK)
+        buf += chunk
+        start = buf.find(b"<sheetData")
+        open_end = buf.find(b">", start) if start >= 0 else -1
+        header_end = buf.find(b"</row>", open_end) if open_end >= 0 else -1
+        if header_end >= 0 or (open_end >= 0 and buf[open_end - 1:open_end] == b"/"):
+            break
+        if not chunk:
+            return None
+    if header_end < 0:
+        return None     # <sheetData/>：空白工作表
+    header_end += len(b"</row>")
+    preamble, header = buf[:open_end + 1], buf[open_end + 1:header_end]
+    digest = hashlib.sha1(header)
+    buf = buf[header_end:]
+
+    marker = f'<row r="{first_row}"'.encode()
+    keep = len(marker) - 1
+    while True:
+        pos = buf.find(marker)
+        if pos >= 0:
+            digest.update(buf[:pos])
+            buf = buf[pos:]
+            break
+        if len(buf) > keep:
+            digest.update(buf[:-keep])
+            buf = buf[-keep:]
+        chunk = src.read(_CHUNK)
+        if not chunk:
+            return None
+        buf += chunk
+    rest = buf + src.read()
+    end = rest.find(b"</sheetData>")
+    return (preamble, header, digest, rest[:end]) if end >= 0 else None
+
+
+# 表頭 + first_row 之前各列的指紋；共用字串表（儲存格裡存的是它的索引）只納入前 n 筆：
+# Excel 存檔時新字串接在表尾，新增列帶來的新字串（例如每列不同的電鍍次數）不會影響已處理列的指紋
+def _prefix_key(digest, strings: list, n: int) -> str:
+    if n > len(strings):
+        return ""       # 字串表變短：一定有已處理的列被改動
+    h = digest.copy()
+    h.update("\x1f".join(map(str, strings[:n])).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _column_names(header: tuple, width: int) -> list:
+    names, seen = [], {}
+    for i in range(width):
+        name = str(header[i]) if i < len(header) and header[i] is not None else f"Unnamed: {i}"
+        # 重複欄名比照 pandas：第二個起加上 .1、.2
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        names.append(name if count == 0 else f"{name}.{count}")
+    return names
+
+
+@dataclass
+class _SheetRows:
+    header: tuple
+    rows: list                  # 第 first_row 列起的各列值（已去掉尾端空白儲存格）
+    first_row: int
+    tail_xml: bytes
+    digest: object              # 表頭 + first_row 之前各列的雜湊（尚未納入共用字串表）
+    strings: list               # 共用字串表
+
+    # 第 row（Excel 列號，>= first_row）之前所有列的指紋：由尾端 XML 接續雜湊，不必重新解壓；
+    # n_strings 為上次存檔時的共用字串筆數，預設為目前整張表
+    def prefix_key_before(self, row: int, n_strings: int | None = None) -> str:
+        digest = self.digest.copy()
+        if row > self.first_row:
+            pos = self.tail_xml.find(f'<row r="{row}"'.encode())
+            if pos < 0:
+                return ""
+            digest.update(self.tail_xml[:pos])
+        return _prefix_key(digest, self.strings, len(self.strings) if n_strings is None else n_strings)
+
+
+def _read_rows(path: str, sheet: str, first_row: int) -> _SheetRows | None:
+    from openpyxl import load_workbook
+
+    try:
+        wb = load_workbook(path, read_only=True, data_only=True)
+    except Exception:
+        logger.warning("openpyxl 無法開啟 %s，改為整份讀取", path, exc_info=True)
+        return None
+    try:
+        ws = wb[sheet]
+        with wb._archive.open(ws._worksheet_path) as src:
+            scanned = _scan_sheet_xml(src, first_row)
+        if scanned is None:
+            logger.info("%s / %s 的 XML 找不到第 %d 列，改為完整重建", path, sheet, first_row)
+            return None
+        preamble, header_xml, digest, tail_xml = scanned
+        # 只把「表頭 + 尾端各列」組成一份小 XML 交給 openpyxl 解析（樣式、日期格式、共用字串照常套用）
+        xml = preamble + header_xml + tail_xml + b"</sheetData></worksheet>"
+        ws._get_source = lambda: io.BytesIO(xml)
+        ws.reset_dimensions()    # 不依 <dimension> 把每列補到最寬（格式化過的欄常有上萬欄）
+
+        def trimmed(values):
+            values = list(values)
+            while values and values[-1] is None:
+                values.pop()
+            return tuple(values)
+
+        header = trimmed(next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ()))
+        rows = [trimmed(r) for r in ws.iter_rows(min_row=first_row, values_only=True)]
+        return _SheetRows(header, rows, first_row, tail_xml, digest, list(ws._shared_strings))
+    except Exception:
+        # 這裡用到 openpyxl 的內部介面（_archive、_worksheet_path、_get_source、_shared_strings），
+        # 升級後若失效會每次都完整重建，所以一定要留下紀錄
+        logger.warning("%s / %s 尾端讀取失敗，改為完整重建", path, sheet, exc_info=True)
+        return None
+    finally:
+        wb.close()
+
+
+def _frame(rows: list, columns: list, index_start: int) -> pd.DataFrame:
+    width = len(columns)
+    df = pd.DataFrame([r[:width] + (None,) * (width - len(r)) for r in rows], columns=columns)
+    df.index = pd.RangeIndex(index_start, index_start + len(df))
+    return _trim_trailing_empty(df)
+
+
+# 3. 狀態檔：放在私有快取目錄，內容只用 JSON / Parquet / .npy（不用 pickle，讀檔不會執行任何程式碼）；
+#    每次寫入使用新的代號，最後才改寫 JSON，讀到的永遠是一組完整的檔案；
+#    JSON 記錄寫入時的 PARSER_VERSION，解析規則改版後舊狀態一律作廢、完整重建
+def _state_dir(path: str, state_dir: str | None) -> str:
+    return state_dir or workbook_cache_dir(path, "ingest")
+
+
+def _load_state(folder: str, sheet: str) -> IngestState | None:
+    try:
+        with open(os.path.join(folder, f"{sheet}.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("parser_version") != PARSER_VERSION:
+            logger.info("%s 的解析規則版本已變更，完整重建", sheet)
+            return None
+        base = os.path.join(folder, f"{sheet}.{meta['token']}")
+        data = pd.read_parquet(f"{base}.data.parquet")
+        violations = np.load(f"{base}.violations.npy", allow_pickle=False)
+        monthly = pd.read_parquet(f"{base}.monthly.parquet")
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning("%s 的增量狀態檔無法讀取，完整重建", sheet, exc_info=True)
+        return None
+    if len(violations) != len(data):
+        return None
+    return IngestState(
+        sheet=sheet,
+        thresholds={c: tuple(v) for c, v in meta["thresholds"].items()},
+        raw_rows=meta["raw_rows"],
+        last_row_key=meta["last_row_key"],
+        data=data,
+        violations=violations,
+        monthly=monthly,
+        prefix_key=meta["prefix_key"],
+        columns=meta["columns"],
+        version=meta["token"],
+        shared_strings=meta.get("shared_strings", 0),
+    )
+
+
+def _save_state(folder: str, state: IngestState) -> None:
+    os.makedirs(folder, mode=0o700, exist_ok=True)
+    token = uuid.uuid4().hex[:12]
+    base = os.path.join(folder, f"{state.sheet}.{token}")
+    state.data.to_parquet(f"{base}.data.parquet")
+    np.save(f"{base}.violations.npy", state.violations, allow_pickle=False)
+    state.monthly.to_parquet(f"{base}.monthly.parquet")
+    meta = {
+        "token": token,
+        "parser_version": PARSER_VERSION,
+        "thresholds": {c: list(v) for c, v in state.thresholds.items()},
+        "raw_rows": state.raw_rows,
+        "last_row_key": state.last_row_key,
+        "prefix_key": state.prefix_key,
+        "shared_strings": state.shared_strings,
+        "columns": [str(c) for c in state.columns],
+    }
+    path = os.path.join(folder, f"{state.sheet}.json")
+    tmp = f"{path}.{token}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    state.version = token
+    # 清掉前幾次的檔案
+    for old in glob.glob(os.path.join(glob.escape(folder), f"{glob.escape(state.sheet)}.*.*")):
+        if not os.path.basename(old).startswith(f"{state.sheet}.{token}.") and not old.endswith(".tmp"):
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+def _monthly_of(df: pd.DataFrame, date_col: str, material_col: str) -> pd.DataFrame:
+    return build_time_buckets(df, date_col).aggregate("month", sum_cols=[material_col])
+
+
+# 月彙總只存可相加的量（筆數、總和），新資料的彙總直接加上去
+def _merge_monthly(old: pd.DataFrame, delta: pd.DataFrame) -> pd.DataFrame:
+    merged = (
+        pd.concat([old, delta])
+        .drop(columns="period_str")
+        .groupby("period", as_index=False)
+        .sum()
+    )
+    merged["period_str"] = merged["period"].dt.strftime("%Y-%m")
+    return merged
+
+
+def _process(raw: pd.DataFrame, thresholds: dict[str, tuple[float,float]]) -> tuple[pd.DataFrame, ThresholdResult]:
+    df = clean_numeric_columns(raw, list(thresholds.keys()))
+    result = evaluate_thresholds(df, thresholds)
+    return compute_status(df, thresholds, result), result
+
+
+# 尾端整欄都是空白時推斷成 object，先轉成既有資料的型別，合併後數值 / 時間欄才不會退化成 object
+def _align_dtypes(tail: pd.DataFrame, like: pd.DataFrame) -> pd.DataFrame:
+    converted = {}
+    for col in tail.columns:
+        if col in like and tail[col].isna().all() and tail[col].dtype != like[col].dtype:
+            kind = like[col].dtype.kind
+            if kind in "fM":
+                converted[col] = tail[col].astype(like[col].dtype)
+            elif kind in "iu":
+                converted[col] = tail[col].astype("float64")
+    return tail.assign(**converted) if converted else tail
+
+
+# 4. 增量更新：只解析、清洗、判定新增在尾端的列，並合併進已處理的資料
+def refresh_sheet(path: str, sheet: str, thresholds: dict[str, tuple[float,float]],
+                  date_col: str = "電鍍開始時間", material_col: str = "磷銅球(kg)",
+                  state_dir: str | None = None) -> IngestState:
+    """
+    讀取工作表中上次處理之後新增的列，處理後合併進私有快取目錄中的狀態檔。
+
+    每次更新都會串流比對已處理部分的指紋（表頭、每一列的內容與上次存檔時既有的共用字串），
+    以下情況會退回完整重建：沒有狀態檔、門檻設定或解析規則版本（PARSER_VERSION）改變、已處理的任何一列被修改 / 刪除 / 插入列、
+    表頭改變，或新列出現在沒有表頭的欄位。
+    """
+    folder = _state_dir(path, state_dir)
+    state = _load_state(folder, sheet)
+    if state is not None and (state.thresholds != thresholds or not state.prefix_key or state.raw_rows == 0):
+        state = None
+
+    tail = None
+    if state is not None:
+        # 從上次最後一列（Excel 第 raw_rows + 1 列）開始解析，第一列用來比對指紋
+        sheet_rows = _read_rows(path, sheet, state.raw_rows + 1)
+        if sheet_rows is None or sheet_rows.prefix_key_before(state.raw_rows + 1, state.shared_strings) != state.prefix_key:
+            state = None
+        elif any(len(r) > len(state.columns) and any(v is not None for v in r[len(state.columns):])
+                 for r in sheet_rows.rows):
+            state = None
+        else:
+            tail = _frame(sheet_rows.rows, state.columns, state.raw_rows - 1)
+            if len(tail) == 0 or _row_key(tail.iloc[0]) != state.last_row_key:
+                state = None
+            else:
+                tail = _align_dtypes(tail.iloc[1:], state.data)
+
+    if state is None:
+        sheet_rows = _read_rows(path, sheet, 2)
+        if sheet_rows is not None:
+            width = max([len(sheet_rows.header), *map(len, sheet_rows.rows)])
+            columns = _column_names(sheet_rows.header, width)
+            raw = _frame(sheet_rows.rows, columns, 0)
+            prefix_key = sheet_rows.prefix_key_before(len(raw) + 1) if len(raw) else ""
+            shared_strings = len(sheet_rows.strings)
+        else:
+            # 不是 xlsx 或 XML 沒有列號（少數第三方工具產生的檔案）：整份讀取，下次同樣完整重建
+            raw = _trim_trailing_empty(pd.read_excel(path, sheet_name=sheet))
+            columns, prefix_key, shared_strings = list(raw.columns), "", 0
+        data, result = _process(raw, thresholds)
+        state = IngestState(
+            sheet=sheet,
+            thresholds=dict(thresholds),
+            raw_rows=len(raw),
+            last_row_key=_row_key(raw.iloc[-1]) if len(raw) else "",
+            data=arrow_safe(data),
+            violations=result.violations,
+            monthly=_monthly_of(data, date_col, material_col),
+            new_rows=len(raw),
+            prefix_key=prefix_key,
+            columns=columns,
+            shared_strings=shared_strings,
+        )
+    elif len(tail) == 0:
+        state.new_rows = 0
+        return state
+    else:
+        data, result = _process(tail, thresholds)
+        state.data = arrow_safe(pd.concat([state.data, data]))
+        state.violations = np.vstack([state.violations, result.violations])
+        state.monthly = _merge_monthly(state.monthly, _monthly_of(data, date_col, material_col))
+        state.raw_rows += len(tail)
+        state.last_row_key = _row_key(tail.iloc[-1])
+        state.prefix_key = sheet_rows.prefix_key_before(state.raw_rows + 1)
+        state.shared_strings = len(sheet_rows.strings)
+        state.new_rows = len(tail)
+
+    _save_state(folder, state)
+    return state
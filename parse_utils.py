@@ -0,0 +1,113 @@
+# 余振中 (Yu Chen Chung)
+# parse_utils.py
+# 數值欄位解析：現場手填的儲存格常見「65.2 g/l」「６５」「<5」「64~66」「65,2」，
+# pd.to_numeric(errors="coerce") 會把它們全部變成 NaN、之後整列被清洗掉
+import re
+from dataclasses import asdict, dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from perf_utils import timed
+
+# 解析規則改變時遞增：工作簿快取與共用資料集的鍵都帶這個版本，舊規則解析的快照不會被沿用
+PARSER_VERSION = 1
+
+_NUMBER = r"[-+]?(?:\d+(?:\.\d*)?|\.\d+)"
+
+# 正規化後的完整格式：[比較符號] 數字 [範圍分隔 數字] [單位（不含數字）]
+_VALUE_RE = re.compile(
+    rf"^(?P<cmp><=|>=|<|>|≤|≥|≦|≧|約|~)?\s*(?P<a>{_NUMBER})"
+    rf"(?:\s*(?:~|〜|-|–|—|to|至)\s*(?P<b>{_NUMBER}))?"
+    r"\s*(?P<unit>[^\d]*)$",
+    re.IGNORECASE,
+)
+# 千分位：1,200 / 12,345.6；其他逗號視為小數點（65,2 → 65.2）
+_THOUSANDS_RE = re.compile(r"^\s*[-+]?\d{1,3}(?:,\d{3})+(?:\.\d+)?(?!\d)")
+_CENSORED = {"<", ">", "<=", ">=", "≤", "≥", "≦", "≧"}
+
+# 「沒有量」的習慣寫法，視同空白，不算解析失敗
+PLACEHOLDERS = {"", "-", "--", "—", "/", "N/A", "NA", "NAN", "NONE", "無", "待測", "未測"}
+
+# 每欄保留的無法解析樣本數
+MAX_FAILURE_SAMPLES = 5
+
+# 1. 單欄解析統計
+@dataclass
+class ParseStats:
+    total: int = 0          # 列數
+    blank: int = 0          # 空白（NaN、None、空字串與 PLACEHOLDERS）
+    numeric: int = 0        # 本來就是數字或可直接轉換
+    recovered: int = 0      # 經正規化後才解析成功（全形、單位、逗號小數、範圍、比較符號）
+    ranges: int = 0         # 其中以範圍中點取值者
+    censored: int = 0       # 其中帶 < / > 的偵測極限值（以該界限值計）
+    failed: int = 0         # 有內容但無法解析，結果為 NaN
+    samples: list[str] = field(default_factory=list)   # 無法解析的原始內容（最多 MAX_FAILURE_SAMPLES 種）
+
+
+# 2. 向量化解析：整欄先走 pd.to_numeric 快速路徑，只有轉不過的字串才進 regex（通常只佔極少數）
+@timed()
+def parse_numeric(values: pd.Series) -> tuple[np.ndarray, ParseStats]:
+    n = len(values)
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        out = values.to_numpy(dtype="float64", na_value=np.nan)
+        blank = int(np.isnan(out).sum())
+        return out, ParseStats(total=n, blank=blank, numeric=n - blank)
+
+    fast = pd.to_numeric(values, errors="coerce")
+    out = fast.to_numpy(dtype="float64", na_value=np.nan)
+    missing = np.flatnonzero(np.isnan(out))
+    pending = missing[pd.notna(values.to_numpy()[missing])]
+    stats = ParseStats(total=n, numeric=n - len(missing), blank=len(missing) - len(pending))
+    if not len(pending):
+        return out, stats
+
+    # 現場雜訊重複性很高（同樣的「65.2 g/l」「-」一再出現），只對不重複的字串跑 regex，再依代碼展開
+    codes, uniques = pd.factorize(values.iloc[pending].astype(str))
+    text = pd.Series(uniques, dtype=object).str.normalize("NFKC").str.strip()
+    empty = text.str.upper().isin(PLACEHOLDERS).to_numpy()
+    thousands = text.str.match(_THOUSANDS_RE).to_numpy()
+    text = text.where(~thousands, text.str.replace(",", "", regex=False)).str.replace(",", ".", regex=False)
+    parts = text.str.extract(_VALUE_RE)
+    a = pd.to_numeric(parts["a"], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    b = pd.to_numeric(parts["b"], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    is_range = ~np.isnan(b)
+    parsed = np.where(is_range, (a + b) / 2, a)
+    ok = ~np.isnan(parsed)
+    failed = ~ok & ~empty
+    censored = ok & parts["cmp"].isin(_CENSORED).to_numpy()
+    out[pending] = parsed[codes]
+
+    # 每種字串出現的列數，統計以列為單位
+    counts = np.bincount(codes, minlength=len(uniques))
+    stats.blank += int(counts[empty].sum())
+    stats.recovered = int(counts[ok].sum())
+    stats.ranges = int(counts[ok & is_range].sum())
+    stats.censored = int(counts[censored].sum())
+    stats.failed = int(counts[failed].sum())
+    stats.samples = [str(u) for u in uniques[failed][:MAX_FAILURE_SAMPLES]]
+    return out, stats
+
+
+# 3. 統計存放在 DataFrame.attrs["parse_stats"]（純 dict，pandas 會隨切片 / 取列傳遞，Parquet 快照也會保存）
+PARSE_STATS_ATTR = "parse_stats"
+
+# 統計表的中文欄名
+STATS_LABELS = {
+    "total": "列數", "blank": "空白", "numeric": "數值", "recovered": "正規化後解析",
+    "ranges": "範圍取中點", "censored": "<> 界限值", "failed": "無法解析",
+}
+
+
+def record_parse_stats(df: pd.DataFrame, stats: dict[str, ParseStats]) -> pd.DataFrame:
+    if stats:
+        df.attrs[PARSE_STATS_ATTR] = {**df.attrs.get(PARSE_STATS_ATTR, {}), **{c: asdict(s) for c, s in stats.items()}}
+    return df
+
+
+def parse_stats_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """每欄一列的解析統計表（沒有統計時回傳空表）。"""
+    stats = df.attrs.get(PARSE_STATS_ATTR, {})
+    rows = [{"欄位": col, **{label: s[k] for k, label in STATS_LABELS.items()}, "無法解析範例": "、".join(s["samples"])}
+            for col, s in stats.items()]
+    return pd.DataFrame(rows)
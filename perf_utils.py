@@ -0,0 +1,137 @@
+# 余振中 (Yu Chen Chung)
+# perf_utils.py
+import functools
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from pandas.io.formats.style import Styler
+
+# 每個 Streamlit session 的腳本在各自的執行緒執行，所以開關與紀錄都放在 thread-local：
+# 一位使用者打開效能面板不會影響其他人，也不會混到別人的紀錄
+_local = threading.local()
+
+
+def enable(flag: bool = True, track_memory: bool = False) -> None:
+    _local.enabled = flag
+    _local.track_memory = flag and track_memory
+
+
+# tracemalloc 是整個行程共用的：一直開著會讓所有 session 的每次配置都變慢。
+# 所以只在「開啟記憶體追蹤的計時區塊」執行期間啟動，以計數器記錄有幾個區塊正在追蹤，歸零就停止；
+# 外部（例如 benchmark.py）自己啟動的追蹤不由這裡停止
+_trace_lock = threading.Lock()
+_trace_users = 0
+_trace_owned = False
+
+
+def _trace_acquire() -> None:
+    global _trace_users, _trace_owned
+    with _trace_lock:
+        if _trace_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _trace_owned = True
+        _trace_users += 1
+
+
+def _trace_release() -> None:
+    global _trace_users, _trace_owned
+    with _trace_lock:
+        _trace_users -= 1
+        if _trace_users == 0 and _trace_owned:
+            tracemalloc.stop()
+            _trace_owned = False
+
+
+def is_enabled() -> bool:
+    return getattr(_local, "enabled", False)
+
+
+def reset() -> None:
+    _local.records = []
+
+
+def records() -> list[dict]:
+    return list(getattr(_local, "records", []))
+
+
+# 盡量從輸入 / 輸出物件推得列數（DataFrame、Styler、ThresholdResult、TimeBuckets、dict of DataFrame）
+#    只認得明確的型別：Streamlit 的 DeltaGenerator 對任何屬性都會回傳函式，不能用 hasattr 判斷
+def _rows_of(obj) -> int | None:
+    if isinstance(obj, (pd.DataFrame, pd.Series, np.ndarray)):
+        return int(obj.shape[0]) if obj.ndim else None
+    if isinstance(obj, Styler):
+        return int(obj.data.shape[0])
+    if isinstance(obj, dict):
+        counts = [c for c in map(_rows_of, obj.values()) if c is not None]
+        return sum(counts) if counts else None
+    fields = getattr(obj, "__dict__", {})
+    if isinstance(fields.get("violations"), np.ndarray):
+        return int(fields["violations"].shape[0])
+    if isinstance(fields.get("frame"), pd.DataFrame):
+        return int(fields["frame"].shape[0])
+    return None
+
+
+# 1. 計時區塊：記錄牆鐘時間、輸入 / 輸出列數，開啟記憶體追蹤時另記錄記憶體增減
+#    mem_delta_mb 是整個行程在區塊期間的淨配置，其他 session 同時執行時會一併算入，只是近似值
+@contextmanager
+def stage(name: str, rows_in: int | None = None):
+    if not is_enabled():
+        yield {}
+        return
+
+    info = {"stage": name, "rows_in": rows_in, "rows_out": None}
+    track = getattr(_local, "track_memory", False)
+    if track:
+        _trace_acquire()
+    mem_before = tracemalloc.get_traced_memory()[0] if track else None
+    t0 = time.perf_counter()
+    try:
+        yield info
+    finally:
+        info["wall_ms"] = (time.perf_counter() - t0) * 1000
+        if track:
+            info["mem_delta_mb"] = (tracemalloc.get_traced_memory()[0] - mem_before) / 1e6
+            _trace_release()
+        info["ts"] = time.time()
+        if not hasattr(_local, "records"):
+            _local.records = []
+        _local.records.append(info)
+
+
+# 2. 裝飾器版本：關閉時只多一次 thread-local 屬性查詢
+def timed(name: str | None = None):
+    def decorator(fn):
+        label = name or f"{fn.__module__}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not getattr(_local, "enabled", False):
+                return fn(*args, **kwargs)
+            with stage(label, rows_in=_rows_of(args[0]) if args else None) as info:
+                result = fn(*args, **kwargs)
+                info["rows_out"] = _rows_of(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+# 3. 匯出成 JSON lines，每列一個步驟，run_id 用來分辨同一次 rerun
+def to_jsonl(run_id: str, extra: dict | None = None) -> str:
+    lines = [
+        json.dumps({"run_id": run_id, **(extra or {}), **rec}, ensure_ascii=False, default=str)
+        for rec in records()
+    ]
+    return "\n".join(lines) + ("\n" if lines else "")
+
+
+def append_jsonl(path: str, run_id: str, extra: dict | None = None) -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(to_jsonl(run_id, extra))
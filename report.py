@@ -0,0 +1,318 @@
+# 余振中 (Yu Chen Chung)
+# report.py
+# 早上 8:00 報表的批次產生器：不需要 Streamlit 伺服器或瀏覽器，可直接排進 cron
+#
+# 用法：python report.py 電鍍履歷表.xlsx [更多工作簿...] [--out reports] [--formats html,png,pdf] [--workers 4]
+# cron：50 7 * * * cd /srv/custom-data-visualizer && python report.py 電鍍履歷表.xlsx --out reports
+#
+# HTML 一律產生（圖表以 vega-embed 顯示）：static/vega/ 有函式庫時直接內嵌，報表離線也能開；
+#   沒有時改由 CDN 載入固定版本，可先執行 python report.py --fetch-vega 下載一次
+# PNG / PDF 是選用功能，需要安裝 vl-convert-python，沒有時只輸出 HTML，並在總覽頁註明
+# --ai 會為每個鍍槽的最近 7 筆 / 7 天 / 30 天各產生一段 Gemini 評語，附在總覽頁
+import argparse
+import datetime as dt
+import html
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+
+import pandas as pd
+
+import chart_specs
+from genai_utils import AnalysisResult, ResponseCache, analyze_batch, build_analysis_requests
+from fleet_utils import TANK_SHEET_PATTERN, discover_tank_sheets, fleet_summary, process_tank
+from spc_utils import compute_spc
+from threshold_utils import THRESHOLD_CONFIG_PATH, ThresholdConfig, evaluate_config, load_threshold_config
+from style_utils import add_flag_columns, style_from_mask
+from time_utils import build_time_buckets
+
+DATE_COL = "電鍍開始時間"
+IMAGE_FORMATS = ("png", "pdf")
+
+# 超標表格最多列出的列數（取最近的），避免報表檔案過大
+MAX_TABLE_ROWS = 2000
+
+# 圖表函式庫：(套件, 固定版本, 檔名)；本機資料夾（REPORT_VEGA_DIR，預設 static/vega）有檔案就內嵌
+VEGA_LIBRARIES = (
+    ("vega", "5.30.0", "vega.min.js"),
+    ("vega-lite", "5.21.0", "vega-lite.min.js"),
+    ("vega-embed", "6.26.0", "vega-embed.min.js"),
+)
+VEGA_DIR = os.getenv("REPORT_VEGA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "vega"))
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html lang="zh-Hant">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+{scripts}
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; font-size: 13px; }}
+th, td {{ border: 1px solid #ddd; padding: 2px 6px; }}
+.chart {{ margin: 1em 0 2em; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+<p id="vega-missing" hidden>⚠ 無法載入圖表函式庫（離線且報表未內嵌 vega），圖表無法顯示；請在產生報表的機器上執行 python report.py --fetch-vega 後重新產生。</p>
+{body}
+<script>
+const specs = {specs};
+if (typeof vegaEmbed === "undefined") {{
+  if (Object.keys(specs).length) document.getElementById("vega-missing").hidden = false;
+}} else {{
+  for (const [id, spec] of Object.entries(specs)) {{
+    vegaEmbed("#" + id, spec, {{actions: false}});
+  }}
+}}
+</script>
+</body>
+</html>
+"""
+
+
+# 1. 本機圖片輸出器：vl-convert 是選用套件，沒裝就只輸出 HTML
+def _image_renderer():
+    try:
+        import vl_convert as vlc
+    except ImportError:
+        return None
+    return {
+        "png": lambda spec: vlc.vegalite_to_png(vl_spec=spec, scale=2),
+        "pdf": lambda spec: vlc.vegalite_to_pdf(vl_spec=spec),
+    }
+
+
+# 1.1 圖表函式庫的 <script>：本機有檔案就內嵌（離線可看），否則以 CDN 載入固定版本
+@lru_cache(maxsize=None)
+def _vega_scripts(vega_dir: str = VEGA_DIR) -> str:
+    tags = []
+    for package, version, filename in VEGA_LIBRARIES:
+        local = os.path.join(vega_dir, filename)
+        if os.path.exists(local):
+            with open(local, encoding="utf-8") as f:
+                source = f.read().replace("</script", "<\\/script")
+            tags.append(f"<script>{source}</script>")
+        else:
+            tags.append(f'<script src="https://cdn.jsdelivr.net/npm/{package}@{version}/build/{filename}"></script>')
+    return "\n".join(tags)
+
+
+def fetch_vega(vega_dir: str = VEGA_DIR) -> list[str]:
+    """下載固定版本的 vega / vega-lite / vega-embed 到本機資料夾，之後產生的報表會內嵌它們。"""
+    import requests
+
+    os.makedirs(vega_dir, exist_ok=True)
+    paths = []
+    for package, version, filename in VEGA_LIBRARIES:
+        response = requests.get(f"https://cdn.jsdelivr.net/npm/{package}@{version}/build/{filename}", timeout=60)
+        response.raise_for_status()
+        path = os.path.join(vega_dir, filename)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(response.content)
+        os.replace(f"{path}.tmp", path)
+        paths.append(path)
+    _vega_scripts.cache_clear()
+    return paths
+
+
+def _page(title: str, body: str, specs: dict[str, dict]) -> str:
+    # </script> 不能出現在內嵌的 JSON 裡
+    payload = json.dumps(specs, ensure_ascii=False).replace("</", "<\\/")
+    scripts = _vega_scripts() if specs else ""
+    return HTML_TEMPLATE.format(title=html.escape(title), body=body, specs=payload, scripts=scripts)
+
+
+# 2. 單一鍍槽報表的所有圖表 spec（與儀表板相同的圖表，全部由 chart_specs 在伺服器端算好）
+def tank_charts(df: pd.DataFrame, thresholds: dict[str, tuple[float,float]], result) -> list[tuple[str, str, dict]]:
+    buckets = build_time_buckets(df, DATE_COL)
+    charts = [
+        ("line", "電鍍次數 vs 三項濃度",
+         chart_specs.line_spec(df, "電鍍次數", list(thresholds), keep=result.oos_rows)),
+        ("pie", "OK/NG 比例", chart_specs.pie_spec(df, "狀態")),
+        ("scatter", "SP10平均 vs 硬度HB", chart_specs.scatter_trend_spec(df, "SP10平均", "硬度HB")),
+        ("monthly_count", "每月電鍍批次總數", chart_specs.monthly_count_spec(buckets.aggregate("month"))),
+        ("monthly_material", "每月磷銅球使用量", chart_specs.monthly_material_spec(
+            buckets.aggregate("month", sum_cols=["磷銅球(kg)"]), "磷銅球(kg)")),
+    ]
+    spc_frames, _ = compute_spc(df, list(thresholds), specs=thresholds)
+    for i, (col, spc) in enumerate(spc_frames.items()):
+        charts.append((f"spc{i}", f"SPC 管制圖：{col}", chart_specs.control_spec(spc, col, x=df[DATE_COL])))
+    return charts
+
+
+# 3. 超標表格：沿用儀表板的標色方式（超標矩陣 → 單一 Styler），輸出成靜態 HTML
+def oos_table_html(df: pd.DataFrame, result, max_rows: int = MAX_TABLE_ROWS) -> str:
+    oos_result = result.subset_oos()
+    oos = df.loc[result.oos_rows]
+    n = len(oos)
+    if n == 0:
+        return "<p>沒有超標紀錄。</p>"
+    if n > max_rows:
+        rows = slice(n - max_rows, n)
+        oos, oos_result = oos.iloc[rows], oos_result.take(rows)
+    table = style_from_mask(add_flag_columns(oos, oos_result), oos_result)
+    table = table.format(precision=2, na_rep="")
+    note = f"<p>共 {n} 筆超標，僅列出最近 {max_rows} 筆。</p>" if n > max_rows else f"<p>共 {n} 筆超標。</p>"
+    return note + table.to_html()
+
+
+# 4. 單一鍍槽的完整工作（讀取 → 判定 → 圖表 → 寫檔），給行程池呼叫
+#    上下限與儀表板相同：設定檔的預設值用來清洗，該槽依生效日期的修訂用來判定，SPC 與 AI 用目前生效的上下限
+def build_tank_report(path: str, sheet: str, config: ThresholdConfig,
+                      out_dir: str, formats: tuple[str, ...], projected: bool = True,
+                      ai: bool = False) -> dict:
+    t0 = time.perf_counter()
+    df = process_tank(path, sheet, config.default, projected, config)
+    result = evaluate_config(df, config, sheet)
+    thresholds = config.current(sheet)
+    stem = f"{os.path.splitext(os.path.basename(path))[0]}__{sheet}"
+    title = f"{os.path.basename(path)} {sheet} 電鍍報表"
+
+    charts = tank_charts(df, thresholds, result)
+    sections = [f"<h2>🚨 超標列</h2>{oos_table_html(df, result)}"]
+    sections += [f'<h2>{html.escape(name)}</h2><div class="chart" id="{cid}"></div>' for cid, name, _ in charts]
+    files = [os.path.join(out_dir, f"{stem}.html")]
+    with open(files[0], "w", encoding="utf-8") as f:
+        f.write(_page(title, "\n".join(sections), {cid: spec for cid, _, spec in charts}))
+
+    renderer = _image_renderer() if any(fmt in IMAGE_FORMATS for fmt in formats) else None
+    if renderer is not None:
+        for cid, _, spec in charts:
+            spec_json = chart_specs.to_json(spec)
+            for fmt in formats:
+                if fmt in renderer:
+                    target = os.path.join(out_dir, f"{stem}__{cid}.{fmt}")
+                    with open(target, "wb") as f:
+                        f.write(renderer[fmt](spec_json))
+                    files.append(target)
+
+    return {
+        "summary": fleet_summary(df, thresholds, DATE_COL),
+        "page": os.path.basename(files[0]),
+        "files": files,
+        # AI 分析只在子行程裡組好精簡 prompt，實際呼叫在主行程一次並行送出
+        "ai_requests": build_analysis_requests(
+            {f"{os.path.basename(path)} {sheet}": (df, result)}, thresholds, date_col=DATE_COL
+        ) if ai else [],
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+# 5. 總覽頁：各槽摘要表，連到各槽報表；有 AI 分析時附在後面
+def _analysis_html(analyses: list[AnalysisResult]) -> str:
+    if not analyses:
+        return ""
+    parts = ["<h2>🧠 Gemini 分析</h2>"]
+    for tank in dict.fromkeys(a.tank for a in analyses):
+        parts.append(f"<h3>{html.escape(tank)}</h3>")
+        for a in (a for a in analyses if a.tank == tank):
+            text = html.escape(a.text).replace("\n", "<br>")
+            style = "" if a.ok else ' style="color: #b00"'
+            parts.append(f"<h4>{html.escape(a.window)}</h4><p{style}>{text}</p>")
+    return "\n".join(parts)
+
+
+def write_index(out_dir: str, reports: list[dict], generated_at: str,
+                analyses: list[AnalysisResult] | None = None, notes: list[str] | None = None) -> str:
+    summary = pd.concat([r["summary"] for r in reports], ignore_index=True)
+    summary["報表"] = [f'<a href="{html.escape(r["page"])}">開啟</a>' for r in reports]
+    table = (
+        summary.style
+        .format({"NG比例": "{:.1%}", **{c: "{:.2f}" for c in summary.columns if c.endswith(" 平均")}})
+        .hide(axis="index")
+        .to_html()
+    )
+    path = os.path.join(out_dir, "index.html")
+    with open(path, "w", encoding="utf-8") as f:
+        notes_html = "".join(f"<p>ℹ {html.escape(n)}</p>" for n in notes or [])
+        f.write(_page(f"電鍍日報 {generated_at}", notes_html + table + _analysis_html(analyses or []), {}))
+    return path
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="電鍍日報批次產生器（不需 Streamlit）")
+    parser.add_argument("workbooks", nargs="*", default=["電鍍履歷表.xlsx"])
+    parser.add_argument("--out", default="reports", help="輸出資料夾（底下再依日期分資料夾）")
+    parser.add_argument("--formats", default="html", help="逗號分隔：html,png,pdf（PNG/PDF 需要 vl-convert-python）")
+    parser.add_argument("--workers", type=int, default=None, help="平行行程數，預設為 CPU 核心數")
+    parser.add_argument("--pattern", default=TANK_SHEET_PATTERN, help="鍍槽工作表名稱的正規表示式")
+    parser.add_argument("--config", default=THRESHOLD_CONFIG_PATH, help="規格上下限設定檔（與儀表板相同，預設讀 THRESHOLD_CONFIG 環境變數）")
+    parser.add_argument("--full", action="store_true", help="讀取全部欄位（預設只串流讀取儀表板用到的欄位）")
+    parser.add_argument("--ai", action="store_true", help="為每個鍍槽的各分析範圍產生 Gemini 評語（需要 GOOGLE_API_KEY）")
+    parser.add_argument("--ai-concurrency", type=int, default=4, help="同時進行的 Gemini 請求數")
+    parser.add_argument("--ai-rate", type=float, default=60.0, help="每分鐘最多送出的 Gemini 請求數")
+    parser.add_argument("--fetch-vega", action="store_true", help=f"下載圖表函式庫到 {VEGA_DIR}（之後的報表內嵌，離線可看）後結束")
+    args = parser.parse_args()
+
+    if args.fetch_vega:
+        for path in fetch_vega():
+            print(path)
+        return 0
+
+    formats = tuple(f.strip().lower() for f in args.formats.split(",") if f.strip())
+    notes = []
+    if any(f in IMAGE_FORMATS for f in formats) and _image_renderer() is None:
+        notes.append("PNG / PDF 匯出為選用功能，需要安裝 vl-convert-python；本次只輸出 HTML。")
+        print("未安裝 vl-convert-python，略過 PNG / PDF，只輸出 HTML", file=sys.stderr)
+    if not all(os.path.exists(os.path.join(VEGA_DIR, name)) for _, _, name in VEGA_LIBRARIES):
+        notes.append("圖表函式庫由 CDN 載入，離線開啟時圖表不會顯示；執行 python report.py --fetch-vega 後重新產生即可內嵌。")
+
+    generated_at = dt.datetime.now().strftime("%Y-%m-%d")
+    out_dir = os.path.join(args.out, generated_at)
+    os.makedirs(out_dir, exist_ok=True)
+
+    t0 = time.perf_counter()
+    jobs = [(path, sheet) for path in args.workbooks for sheet in discover_tank_sheets(path, args.pattern)]
+    if not jobs:
+        print("找不到任何鍍槽工作表", file=sys.stderr)
+        return 1
+
+    # 各槽、各工作簿平行處理；單一工作就不開行程池
+    build = partial(build_tank_report, config=load_threshold_config(args.config), out_dir=out_dir,
+                    formats=formats, projected=not args.full, ai=args.ai)
+    outcomes = []
+    if len(jobs) == 1 or args.workers == 1:
+        for job in jobs:
+            try:
+                outcomes.append((job, build(*job), None))
+            except Exception as e:
+                outcomes.append((job, None, e))
+    else:
+        workers = min(len(jobs), args.workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [(job, pool.submit(build, *job)) for job in jobs]
+            for job, future in futures:
+                try:
+                    outcomes.append((job, future.result(), None))
+                except Exception as e:
+                    outcomes.append((job, None, e))
+
+    # 單槽失敗不影響其他槽的報表，但結束代碼非 0，讓排程看得出來
+    reports, failed = [], 0
+    for (path, sheet), report, error in outcomes:
+        if error is not None:
+            failed += 1
+            print(f"{path} {sheet}: 失敗 - {error}", file=sys.stderr)
+        else:
+            reports.append(report)
+            print(f"{path} {sheet}: {report['seconds']:.2f}s")
+
+    analyses = []
+    ai_requests = [req for r in reports for req in r["ai_requests"]]
+    if ai_requests:
+        analyses = analyze_batch(ai_requests, concurrency=args.ai_concurrency, rate_per_minute=args.ai_rate,
+                                 cache=ResponseCache(disk_dir=os.getenv("GEMINI_CACHE_DIR")))
+        print(f"Gemini 分析：{sum(a.ok for a in analyses)}/{len(analyses)} 成功")
+
+    if reports:
+        print(f"總覽：{write_index(out_dir, reports, generated_at, analyses, notes)}（{time.perf_counter() - t0:.2f}s）")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
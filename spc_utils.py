@@ -0,0 +1,195 @@
+# 余振中 (Yu Chen Chung)
+# spc_utils.py
+from dataclasses import dataclass, replace
+
+import numpy as np
+import pandas as pd
+
+from perf_utils import timed
+
+# Western Electric 規則：(視窗長度, 需達到的點數, 門檻 σ 倍數)
+WE_RULES = {
+    "rule1": (1, 1, 3.0),   # 1 點超出 ±3σ
+    "rule2": (3, 2, 2.0),   # 連續 3 點中有 2 點在同側 2σ 之外
+    "rule3": (5, 4, 1.0),   # 連續 5 點中有 4 點在同側 1σ 之外
+    "rule4": (8, 8, 0.0),   # 連續 8 點在中心線同一側
+}
+_CONTEXT = max(w for w, _, _ in WE_RULES.values())
+
+# 1. 管制參數與增量狀態（每個欄位一份）
+@dataclass(frozen=True)
+class SPCState:
+    column: str
+    center: float            # 中心線 μ
+    sigma: float             # 標準差 σ
+    window: int = 20         # 移動平均 / 移動標準差的視窗
+    lam: float = 0.2         # EWMA 平滑係數 λ
+    k: float = 0.5           # CUSUM 容許量（σ 單位）
+    h: float = 5.0           # CUSUM 決策界限（σ 單位）
+    n_seen: int = 0          # 已處理的點數（EWMA 管制界限隨點數收斂）
+    ewma: float = np.nan     # 上一點的 EWMA
+    cusum_pos: float = 0.0   # 上一點的 CUSUM+
+    cusum_neg: float = 0.0   # 上一點的 CUSUM-
+    tail: tuple = ()         # 最後幾點原始值，給移動視窗與 WE 規則銜接用
+
+
+# 視窗內計數 / 加總：cumsum 相減，O(n)
+def _window_sum(x: np.ndarray, w: int) -> np.ndarray:
+    c = np.cumsum(x, axis=0)
+    out = c.copy()
+    out[w:] = c[w:] - c[:-w]
+    return out
+
+
+# 表格式 CUSUM 的封閉解：C_t = max(0, C_{t-1} + d_t) 等於 S_t - min(-C_0, min_{j<=t} S_j)
+def _cusum(d: np.ndarray, c0: float) -> np.ndarray:
+    s = np.cumsum(d)
+    return s - np.minimum(-c0, np.minimum.accumulate(s))
+
+
+# 2.1 超過決策界限 h 即發出訊號，下一點從 0 重新累積（不重設的話漂移過一次之後會一直警報）
+#     分段套用封閉解：每段找到第一個訊號就從下一點重來，沒有訊號的段落長度加倍，整體仍接近 O(n)
+_CUSUM_BLOCK = 256
+
+
+def _cusum_reset(d: np.ndarray, c0: float, h: float) -> np.ndarray:
+    out = np.empty(len(d), dtype="float64")
+    c = 0.0 if c0 > h else c0
+    i, block = 0, _CUSUM_BLOCK
+    while i < len(d):
+        seg = _cusum(d[i:i + block], c)
+        hit = np.flatnonzero(seg > h)
+        if len(hit):
+            j = int(hit[0]) + 1
+            out[i:i + j] = seg[:j]
+            c, i, block = 0.0, i + j, _CUSUM_BLOCK
+        else:
+            out[i:i + len(seg)] = seg
+            c, i, block = float(seg[-1]), i + len(seg), block * 2
+    return out
+
+
+# 2. 核心計算：values 前面接上一批的 tail 作為視窗銜接，EWMA / CUSUM 由狀態延續
+def _spc_core(state: SPCState, values: np.ndarray) -> tuple[pd.DataFrame, SPCState]:
+    tail = np.asarray(state.tail, dtype="float64")
+    full = np.concatenate([tail, values])
+    p = len(tail)
+    valid = ~np.isnan(full)
+    filled = np.where(valid, full, 0.0)
+
+    # 移動平均 / 標準差（只計入有效值）
+    w = state.window
+    cnt = _window_sum(valid.astype("float64"), w)
+    s1 = _window_sum(filled, w)
+    s2 = _window_sum(filled * filled, w)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        roll_mean = np.where(cnt > 0, s1 / cnt, np.nan)
+        roll_var = np.where(cnt > 1, (s2 - s1 * s1 / cnt) / (cnt - 1), np.nan)
+    roll_std = np.sqrt(np.clip(roll_var, 0, None))
+
+    # 標準化後套 Western Electric 規則（NaN 不觸發任何規則）
+    z = (full - state.center) / state.sigma
+    rules = {}
+    for name, (win, need, limit) in WE_RULES.items():
+        if limit == 0.0:
+            above, below = z > 0, z < 0
+        else:
+            above, below = z > limit, z < -limit
+        hit_above = _window_sum(above.astype(np.int32), win) >= need
+        hit_below = _window_sum(below.astype(np.int32), win) >= need
+        # 前面點數不足視窗長度時不判定
+        enough = np.arange(len(full)) + state.n_seen - p + 1 >= win
+        rules[name] = (hit_above | hit_below) & enough
+
+    new = slice(p, None)
+    zn = z[new]
+
+    # EWMA：從上一點的值延續；缺值沿用前值
+    start = state.ewma if not np.isnan(state.ewma) else state.center
+    ewma = pd.Series(np.concatenate([[start], values])).ewm(alpha=state.lam, adjust=False, ignore_na=True).mean().to_numpy()[1:]
+    t = np.arange(state.n_seen + 1, state.n_seen + len(values) + 1)
+    width = 3 * state.sigma * np.sqrt(state.lam / (2 - state.lam) * (1 - (1 - state.lam) ** (2 * t)))
+
+    # CUSUM（σ 單位），缺值當作沒有變化
+    dz = np.nan_to_num(zn, nan=0.0)
+    cusum_pos = _cusum_reset(np.where(np.isnan(zn), 0.0, dz - state.k), state.cusum_pos, state.h)
+    cusum_neg = _cusum_reset(np.where(np.isnan(zn), 0.0, -dz - state.k), state.cusum_neg, state.h)
+
+    frame = pd.DataFrame({
+        "value": values,
+        "z": zn,
+        "center": state.center,
+        "ucl": state.center + 3 * state.sigma,
+        "lcl": state.center - 3 * state.sigma,
+        "roll_mean": roll_mean[new],
+        "roll_std": roll_std[new],
+        "ewma": ewma,
+        "ewma_ucl": state.center + width,
+        "ewma_lcl": state.center - width,
+        "cusum_pos": cusum_pos,
+        "cusum_neg": cusum_neg,
+        **{name: hit[new] for name, hit in rules.items()},
+    })
+    frame["ewma_alarm"] = (frame["ewma"] > frame["ewma_ucl"]) | (frame["ewma"] < frame["ewma_lcl"])
+    frame["cusum_alarm"] = (frame["cusum_pos"] > state.h) | (frame["cusum_neg"] > state.h)
+    frame["alarm"] = frame[[*WE_RULES, "ewma_alarm", "cusum_alarm"]].any(axis=1)
+
+    n_total = state.n_seen + len(values)
+    new_state = replace(
+        state,
+        n_seen=n_total,
+        ewma=float(ewma[-1]) if len(ewma) else state.ewma,
+        cusum_pos=float(cusum_pos[-1]) if len(values) else state.cusum_pos,
+        cusum_neg=float(cusum_neg[-1]) if len(values) else state.cusum_neg,
+        tail=tuple(full[-max(state.window, _CONTEXT) + 1:].tolist()),
+    )
+    return frame, new_state
+
+
+# 3. 建立初始狀態：μ 與 σ 由前 baseline 筆有效資料（視為管制內的基準期）估計，
+#    σ 用移動全距 MR̄ / 1.128，不受基準期內緩慢漂移影響；基準期不足 2 筆（或 baseline=0）時才退回規格中心與規格寬度 / 6
+#    （規格寬度 / 6 遠大於實際製程變異時 σ 被高估，反之則幾乎每點都警報，所以不作為預設）
+_D2 = 1.128
+
+
+def init_state(column: str, values: np.ndarray, spec: tuple[float, float] | None = None,
+               baseline: int = 100, **params) -> SPCState:
+    head = np.asarray(values, dtype="float64")
+    head = head[~np.isnan(head)][:baseline]
+    if len(head) >= 2:
+        center = float(head.mean())
+        sigma = float(np.abs(np.diff(head)).mean() / _D2)
+        if sigma <= 0:
+            sigma = float(head.std(ddof=1))
+    elif spec is not None:
+        low, high = spec
+        center, sigma = (low + high) / 2, (high - low) / 6
+    else:
+        center, sigma = float(head[0]) if len(head) else 0.0, np.nan
+    if not np.isfinite(sigma) or sigma <= 0:
+        sigma = 1.0
+    return SPCState(column=column, center=float(center), sigma=float(sigma), **params)
+
+
+# 4. 整段歷史一次算完：回傳每個欄位的管制統計表與可供增量更新的狀態
+@timed()
+def compute_spc(df: pd.DataFrame, cols: list[str],
+                specs: dict[str, tuple[float, float]] | None = None,
+                **params) -> tuple[dict[str, pd.DataFrame], dict[str, SPCState]]:
+    frames, states = {}, {}
+    for col in cols:
+        values = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype="float64")
+        state = init_state(col, values, (specs or {}).get(col), **params)
+        frame, states[col] = _spc_core(state, values)
+        frames[col] = frame.set_axis(df.index, axis=0)
+    return frames, states
+
+
+# 5. 增量更新：只計算新進資料，移動視窗與 EWMA / CUSUM 從上次狀態接續
+def update_spc(states: dict[str, SPCState], new_rows: pd.DataFrame) -> tuple[dict[str, pd.DataFrame], dict[str, SPCState]]:
+    frames, new_states = {}, {}
+    for col, state in states.items():
+        values = pd.to_numeric(new_rows[col], errors="coerce").to_numpy(dtype="float64")
+        frame, new_states[col] = _spc_core(state, values)
+        frames[col] = frame.set_axis(new_rows.index, axis=0)
+    return frames, new_states
@@ -0,0 +1,80 @@
+# 余振中 (Yu Chen Chung)
+# startup_check.py
+# 冷啟動匯入時間檢查：用 `python -X importtime` 匯入儀表板模組，統計耗時並確認重量級套件沒有被提早載入
+#
+# 用法：python startup_check.py [--budget-ms 1500] [--top 15]
+import argparse
+import os
+import subprocess
+import sys
+
+# 儀表板啟動時會匯入的自家模組
+STARTUP_MODULES = [
+    "data_utils", "style_utils", "chart_utils", "genai_utils",
+    "time_utils", "ingest_utils", "fleet_utils", "cache_utils", "store_utils", "perf_utils",
+    "spc_utils", "chart_specs", "watch_utils", "filter_utils", "history_utils",
+    "threshold_utils", "parse_utils", "table_utils", "analytics_utils",
+]
+
+# 這些套件只有在第一次用到時才應該載入（tests/test_startup.py 會檢查）
+LAZY_MODULES = ["google.genai", "duckdb", "watchdog", "yaml", "vl_convert"]
+
+
+# 1. 解析 -X importtime 的輸出：import time: self [us] | cumulative | imported package
+#    套件名稱前的縮排（每層兩個空白）代表巢狀深度，0 表示由 -c 直接匯入
+def parse_importtime(stderr: str) -> list[tuple[str, int, int, int]]:
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, raw_name = line[len("import time:"):].split("|")
+        name = raw_name[1:]
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def measure(modules: list[str]) -> list[tuple[str, int, int, int]]:
+    code = "; ".join(f"import {m}" for m in modules)
+    env = dict(os.environ)
+    env.pop("GOOGLE_API_KEY", None)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"匯入失敗：\n{proc.stderr[-2000:]}")
+    return parse_importtime(proc.stderr)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="儀表板冷啟動匯入時間檢查")
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="自家模組匯入總時間上限（毫秒）")
+    parser.add_argument("--top", type=int, default=15, help="列出最耗時的前幾個套件")
+    args = parser.parse_args()
+
+    rows = measure(STARTUP_MODULES)
+    # 頂層匯入（深度 0）的累積時間加總即為總匯入時間，巢狀匯入已包含在內
+    total_ms = sum(cum for _, depth, _, cum in rows if depth == 0) / 1000
+    imported = {name for name, _, _, _ in rows}
+
+    print(f"{'累積(ms)':>10}  套件")
+    for name, _, _, cum in sorted(rows, key=lambda r: r[3], reverse=True)[: args.top]:
+        print(f"{cum / 1000:10.1f}  {name}")
+    print(f"\n自家模組匯入總時間：{total_ms:.1f} ms（上限 {args.budget_ms:.0f} ms）")
+
+    failed = False
+    eager = [m for m in LAZY_MODULES if m in imported]
+    if eager:
+        print(f"✗ 啟動時就載入了應延遲載入的套件：{', '.join(eager)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print("✗ 超出啟動時間預算")
+        failed = True
+    if not failed:
+        print("✓ 符合啟動時間預算")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
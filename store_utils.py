@@ -0,0 +1,212 @@
+# 余振中 (Yu Chen Chung)
+# store_utils.py
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from data_utils import ThresholdResult, clean_numeric_columns, compute_status, evaluate_thresholds
+from parse_utils import PARSER_VERSION
+from time_utils import TimeBuckets, build_time_buckets
+
+# 預設共用記憶體上限（可用環境變數 DATASET_STORE_MB 調整）
+DEFAULT_MAX_MB = 512
+
+# 違規矩陣寫進 Arrow 檔時的欄名前綴
+_VIOLATION_PREFIX = "__violation__"
+
+# 1. 處理完成的資料集：清洗後資料 + 超標矩陣 + 時間分桶，全部唯讀、所有 session 共用
+@dataclass
+class ProcessedDataset:
+    data: pd.DataFrame
+    result: ThresholdResult
+    buckets: TimeBuckets
+    nbytes: int
+
+
+def thresholds_fingerprint(thresholds: dict[str, tuple[float,float]]) -> str:
+    payload = json.dumps({k: list(v) for k, v in thresholds.items()}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def dataset_key(workbook_hash: str, sheet: str, thresholds: dict[str, tuple[float,float]],
+                variant: str = "") -> str:
+    return f"{workbook_hash[:16]}__{sheet}__{variant or 'full'}.p{PARSER_VERSION}__{thresholds_fingerprint(thresholds)}"
+
+
+# 把底層陣列設成唯讀：任何 session 想就地修改共用資料（iloc / loc / to_numpy 寫入）都會直接報錯，而不是悄悄影響別人。
+# 只對 df[col].values 設旗標沒有用：pandas 會把同型別欄位合併成一個區塊，取出的只是暫時的 view，
+# 所以這裡逐欄取出 view 設成唯讀，再用這些 view 組成不合併的新 DataFrame（不複製資料）
+def _freeze(data: pd.DataFrame, result: ThresholdResult) -> pd.DataFrame:
+    arrays = {}
+    for i in range(data.shape[1]):
+        col = data.iloc[:, i]
+        if isinstance(col.dtype, np.dtype):
+            values = col.to_numpy(copy=False)
+            values.setflags(write=False)
+        elif isinstance(col.dtype, pd.CategoricalDtype):
+            codes = col.cat.codes.to_numpy(copy=False)
+            codes.setflags(write=False)
+            values = pd.Categorical.from_codes(codes, dtype=col.dtype)
+        else:
+            values = col.array      # 其他擴充型別沒有通用的唯讀旗標
+        arrays[i] = values
+    frozen = pd.DataFrame(arrays, index=data.index, copy=False)
+    frozen.columns = data.columns
+    result.violations.setflags(write=False)
+    return frozen
+
+
+def _nbytes(data: pd.DataFrame, result: ThresholdResult) -> int:
+    return int(data.memory_usage(deep=True).sum()) + result.violations.nbytes
+
+
+# 1.1 由原始工作表建立共用資料集的內容（儀表板與投遞資料夾常駐程式共用，保證兩邊結果一致）
+def build_processed(raw: pd.DataFrame, thresholds: dict[str, tuple[float,float]],
+                    date_col: str = "電鍍開始時間", material_col: str = "磷銅球(kg)"):
+    # 不複製：清洗會產生新的 DataFrame，快取中的原始資料不會被修改
+    data = clean_numeric_columns(raw, list(thresholds.keys()))
+    # 一次算出超標矩陣，狀態、標紅、超標列都共用這份結果
+    result = evaluate_thresholds(data, thresholds)
+    data = compute_status(data, thresholds, result)
+    # 時間分桶：日期只解析一次，所有月份圖表需要的彙總在同一次 groupby 算完
+    buckets = build_time_buckets(data, date_col=date_col)
+    buckets.aggregate("month", sum_cols=[material_col] if material_col in data else [])
+    return data, result, buckets
+
+
+# 2. 選用：Arrow IPC 檔 + memory map，讓同一台機器上的多個 worker 行程共用同一份位元組
+def _arrow_path(arrow_dir: str, key: str) -> str:
+    return os.path.join(arrow_dir, f"{key}.arrow")
+
+
+def _write_arrow(path: str, dataset: ProcessedDataset) -> bool:
+    try:
+        import pyarrow as pa
+        import pyarrow.feather as feather
+    except ImportError:
+        return False
+    flags = {f"{_VIOLATION_PREFIX}{c}": dataset.result.violations[:, i] for i, c in enumerate(dataset.result.columns)}
+    try:
+        table = pa.Table.from_pandas(dataset.data.assign(**flags), preserve_index=True)
+        tmp = f"{path}.tmp"
+        feather.write_feather(table, tmp, compression="uncompressed")
+        os.replace(tmp, path)
+        return True
+    except Exception:
+        # 數字與文字混雜的欄位 Arrow 無法表示，這份資料就只留在本行程記憶體
+        return False
+
+
+def _read_arrow(path: str, date_col: str) -> ProcessedDataset | None:
+    try:
+        import pyarrow.feather as feather
+        table = feather.read_table(path, memory_map=True)
+    except Exception:
+        return None
+    frame = table.to_pandas(split_blocks=True)
+    flag_cols = [c for c in frame.columns if c.startswith(_VIOLATION_PREFIX)]
+    columns = [c[len(_VIOLATION_PREFIX):] for c in flag_cols]
+    violations = frame[flag_cols].to_numpy(dtype=bool)
+    data = frame.drop(columns=flag_cols)
+    result = ThresholdResult(columns, violations, data.index)
+    return ProcessedDataset(data, result, build_time_buckets(data, date_col), _nbytes(data, result))
+
+
+# 2.1 由其他行程（例如 watch_utils）預先寫好 Arrow 快照，儀表板開頁時直接 memory map
+def write_snapshot(arrow_dir: str, key: str, data: pd.DataFrame, result: ThresholdResult,
+                   buckets: TimeBuckets) -> bool:
+    os.makedirs(arrow_dir, exist_ok=True)
+    return _write_arrow(_arrow_path(arrow_dir, key), ProcessedDataset(data, result, buckets, 0))
+
+
+# 3. 行程內共用資料集倉庫：同一把鍵只會建一次，其他同時到達的 session 等待並共用結果
+class DatasetStore:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024, arrow_dir: str | None = None):
+        self.max_bytes = max_bytes
+        self.arrow_dir = arrow_dir
+        self._entries: OrderedDict[str, ProcessedDataset] = OrderedDict()
+        self._lock = threading.Lock()
+        self._building: dict[str, threading.Lock] = {}
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(d.nbytes for d in self._entries.values())
+
+    def _lookup(self, key: str) -> ProcessedDataset | None:
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None:
+                self._entries.move_to_end(key)
+            return hit
+
+    def _insert(self, key: str, dataset: ProcessedDataset) -> None:
+        with self._lock:
+            self._entries[key] = dataset
+            self._entries.move_to_end(key)
+            # 超過上限時淘汰最久未使用者，但至少保留剛放進來的這一份
+            total = sum(d.nbytes for d in self._entries.values())
+            while total > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                total -= evicted.nbytes
+
+    def get_or_build(self, key: str, builder, date_col: str = "電鍍開始時間") -> ProcessedDataset:
+        """
+        取得共用資料集；不存在時呼叫 builder() -> (data, result, buckets) 建立。
+
+        回傳的 DataFrame 與陣列為唯讀共用物件，呼叫端不可就地修改。
+        """
+        hit = self._lookup(key)
+        if hit is not None:
+            return hit
+
+        # 每把鍵一把建構鎖：8:00 同時開頁面的 N 個人只會觸發一次解析
+        with self._lock:
+            build_lock = self._building.setdefault(key, threading.Lock())
+        try:
+            with build_lock:
+                hit = self._lookup(key)
+                if hit is not None:
+                    return hit
+
+                dataset = None
+                if self.arrow_dir and os.path.exists(_arrow_path(self.arrow_dir, key)):
+                    dataset = _read_arrow(_arrow_path(self.arrow_dir, key), date_col)
+                if dataset is None:
+                    data, result, buckets = builder()
+                    dataset = ProcessedDataset(data, result, buckets, _nbytes(data, result))
+                    if self.arrow_dir:
+                        os.makedirs(self.arrow_dir, exist_ok=True)
+                        _write_arrow(_arrow_path(self.arrow_dir, key), dataset)
+
+                dataset.data = _freeze(dataset.data, dataset.result)
+                self._insert(key, dataset)
+        finally:
+            # builder() 失敗時也要移除，否則建構鎖會一直留在 _building
+            with self._lock:
+                self._building.pop(key, None)
+        return dataset
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# 4. 模組層級單例：Streamlit 同一個行程內所有 session 共用
+_store: DatasetStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> DatasetStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            max_mb = float(os.getenv("DATASET_STORE_MB", DEFAULT_MAX_MB))
+            _store = DatasetStore(int(max_mb * 1024 * 1024), arrow_dir=os.getenv("DATASET_STORE_ARROW_DIR"))
+        return _store
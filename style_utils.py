@@ -1,22 +1,42 @@
 # 余振中 (Yu Chen Chung)
 # style_utils.py
+from functools import reduce
+
+import numpy as np
 import pandas as pd
 
+from data_utils import ThresholdResult, evaluate_thresholds
+from perf_utils import timed
+
 # 樣式化：把超出範圍的儲存格底色標紅
-def apply_marking(df: pd.DataFrame, thresholds: dict[str, tuple[float,float]]):
-    def mark(v, low, high):
-        return "background-color: salmon" if (v < low or v > high) else ""
-    styler = df.style
-    for col, (low, high) in thresholds.items():
-        styler = styler.applymap(
-            lambda v, low=low, high=high: mark(v, low, high),
-            subset=[col]
-        )
-    return styler
+@timed()
+def apply_marking(df: pd.DataFrame, thresholds: dict[str, tuple[float,float]],
+                  result: ThresholdResult | None = None):
+    # 有現成的超標矩陣就直接用，不再逐格呼叫 Python 函式判斷
+    if result is None:
+        result = evaluate_thresholds(df, thresholds)
+    return style_from_mask(df, result)
+
+# 由超標矩陣一次產生整塊 CSS，交給單一個 Styler.apply
+def style_from_mask(df: pd.DataFrame, result: ThresholdResult):
+    css = np.where(result.violations, "background-color: salmon", "")
+    css_frame = pd.DataFrame(css, index=df.index, columns=result.columns)
+    return df.style.apply(lambda _: css_frame, axis=None, subset=result.columns)
 
 # 選出至少一個超標的列，並用 Styler 樣式標記
-def filter_oos_and_style(df: pd.DataFrame, thresholds: dict[str, tuple[float,float]]):
-    mask = pd.DataFrame({col: df[col].between(low, high) for col,(low,high) in thresholds.items()})
-    oos = df.loc[~mask.all(axis=1)]
+@timed()
+def filter_oos_and_style(df: pd.DataFrame, thresholds: dict[str, tuple[float,float]],
+                         result: ThresholdResult | None = None):
+    if result is None:
+        result = evaluate_thresholds(df, thresholds)
+    oos_result = result.subset_oos()
+    oos = df.loc[result.oos_rows]
     # 樣式標記同 apply_marking
-    return apply_marking(oos, thresholds)
+    return apply_marking(oos, thresholds, oos_result)
+
+# 不用 Styler 的標記方式：新增「超標數」「超標欄位」兩欄，直接由超標矩陣向量化產生
+@timed()
+def add_flag_columns(df: pd.DataFrame, result: ThresholdResult) -> pd.DataFrame:
+    parts = [np.where(result.violations[:, i], f"{col} ", "") for i, col in enumerate(result.columns)]
+    flags = reduce(np.char.add, parts) if parts else np.full(len(df), "")
+    return df.assign(超標數=result.row_violations, 超標欄位=np.char.strip(flags))
@@ -0,0 +1,75 @@
+# 余振中 (Yu Chen Chung)
+# synth_utils.py
+import numpy as np
+import pandas as pd
+
+# 三項濃度的中心值與每批飄移幅度（與 app.py 的標準範圍對應）
+CONCENTRATIONS = {
+    "硫酸實際值(g/l)"     : (65.0,  0.35),
+    "硫酸銅實際值(g/l)"   : (205.0, 0.8),
+    "氯離子實際值(ppm/l)" : (72.0,  0.9),
+}
+
+# 數值欄位裡常見的現場雜訊
+STRING_NOISE = np.array(["-", "N/A", "待測", "65.2 g/l", "６５", "<5", "64~66", "65,2", " "], dtype=object)
+
+# 1. 有「補藥重置」的隨機漂移：每隔一段時間濃度被拉回中心，期間隨機漂移（完全向量化）
+def _drift(rng: np.random.Generator, n: int, center: float, step: float, reset_every: int) -> np.ndarray:
+    steps = rng.normal(0.0, step, n)
+    walk = np.cumsum(steps)
+    starts = (np.arange(n) // reset_every) * reset_every
+    walk -= walk[starts] - steps[starts]
+    # 疊加一個緩慢的季節性變化
+    seasonal = 0.3 * step * 10 * np.sin(np.arange(n) / max(n / 6, 1) * 2 * np.pi)
+    return center + walk + seasonal
+
+# 2. 產生與 EP15/EP16 相同欄位結構的電鍍履歷
+def generate_plating_log(n_rows: int, seed: int = 0, start: str = "2017-05-01",
+                         nan_rate: float = 0.02, noise_rate: float = 0.01) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    n = n_rows
+
+    # 每批平均間隔 6 小時；列數很多時壓縮間隔，整段歷史不超過約 20 年（避免超出 datetime64 範圍）
+    mean_gap = min(6 * 3600, 20 * 365 * 86400 / max(n, 1))
+    gaps = rng.uniform(1 / 3, 5 / 3, n) * mean_gap
+    times = (pd.Timestamp(start) + pd.to_timedelta(np.cumsum(gaps), unit="s")).floor("min")
+    hours = rng.uniform(10, 20, n)
+    cycle = np.arange(n) // 50 + 1
+    run = np.arange(n) % 50 + 1
+
+    df = pd.DataFrame({
+        "廠商": rng.choice(["聚飛", "東佳杰", "維偉嘉"], n),
+        "版輪編號": rng.integers(1, 120, n),
+        "模具規格": rng.choice(["320*1400", "270*1350", "260*1400"], n),
+        "電鍍開始時間": times,
+        "實際完成日期": times + pd.to_timedelta(hours, unit="h"),
+        "電鍍次數": np.char.add(np.char.add(cycle.astype(str), "-"), run.astype(str)),
+    })
+    for col, (center, step) in CONCENTRATIONS.items():
+        df[col] = np.round(_drift(rng, n, center, step, reset_every=40), 2)
+
+    df["記錄者"] = rng.choice(["余振中", "王小明", "林大華"], n)
+    df["電流(A)"] = rng.choice([800.0, 1000.0], n)
+    df["磷銅球(kg)"] = np.round(rng.gamma(2.0, 8.0, n), 1)
+    # SP10 與硬度與硫酸銅濃度相關，讓散點圖與相關分析有訊號
+    cu = df["硫酸銅實際值(g/l)"].to_numpy()
+    df["SP10平均"] = np.round(64 + 0.15 * (cu - 205) + rng.normal(0, 0.8, n), 2)
+    df["硬度HB"] = np.round(240 + 4.5 * (df["SP10平均"].to_numpy() - 64) + rng.normal(0, 4, n), 1)
+    df["合格"] = np.where(rng.random(n) < 0.95, "OK", "NG")
+    df["備註"] = np.where(rng.random(n) < 0.1, "更換濾心", None)
+
+    numeric = list(CONCENTRATIONS) + ["磷銅球(kg)", "SP10平均", "硬度HB"]
+    for col in numeric:
+        values = df[col].to_numpy(dtype=object)
+        values[rng.random(n) < nan_rate] = np.nan
+        noisy = rng.random(n) < noise_rate
+        values[noisy] = rng.choice(STRING_NOISE, int(noisy.sum()))
+        df[col] = values if noisy.any() else values.astype("float64")
+    return df
+
+# 3. 寫成多工作表的 Excel（EP15、EP16…）
+def write_workbook(path: str, n_rows: int, sheets: tuple[str, ...] = ("EP15", "EP16"), seed: int = 0) -> str:
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        for i, sheet in enumerate(sheets):
+            generate_plating_log(n_rows, seed=seed + i).to_excel(writer, sheet_name=sheet, index=False)
+    return path
@@ -0,0 +1,180 @@
+# 余振中 (Yu Chen Chung)
+# table_utils.py
+# 伺服器端分頁表格：排序、搜尋、只看超標都在伺服器端以列位置完成，瀏覽器每次只收到目前這一頁；
+# 超標標色直接由 ThresholdResult 的超標矩陣切出該頁產生，不重新判定
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from data_utils import ThresholdResult
+from filter_utils import run_keys
+from perf_utils import timed
+from style_utils import add_flag_columns, style_from_mask
+
+PAGE_SIZES = (50, 100, 200, 500)
+
+# 依電鍍次數「主-次」排序（字串排序會得到 10-1 < 2-1）
+RUN_COL = "電鍍次數"
+
+# 1. 查詢條件（不含頁碼：同一組條件的所有頁共用同一份列位置）
+@dataclass(frozen=True)
+class TableQuery:
+    sort_col: str | None = None
+    ascending: bool = True
+    search_col: str | None = None
+    search: str = ""
+    oos_only: bool = False
+
+
+# 2. 排序鍵：空值一律排最後；數字 / 時間直接排序，其餘依字典序（混雜型別先轉字串）
+def _sort_keys(s: pd.Series) -> np.ndarray:
+    if s.name == RUN_COL:
+        keys = run_keys(s)
+        return np.where(keys == np.iinfo(np.int64).max, np.nan, keys.astype("float64"))
+    if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        return s.to_numpy(dtype="float64", na_value=np.nan)
+    if pd.api.types.is_datetime64_any_dtype(s):
+        values = s.to_numpy(dtype="datetime64[ns]").view(np.int64).astype("float64")
+        return np.where(s.isna().to_numpy(), np.nan, values)
+    try:
+        codes, _ = pd.factorize(s, sort=True)
+    except TypeError:
+        codes, _ = pd.factorize(s.astype(str).where(s.notna()), sort=True)
+    return np.where(codes < 0, np.nan, codes.astype("float64"))
+
+
+@timed()
+def search_mask(s: pd.Series, text: str) -> np.ndarray:
+    # 不分大小寫的子字串比對；類別欄位只比對各類別一次再依代碼展開
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        hits = s.cat.categories.astype(str).str.contains(text, case=False, regex=False)
+        codes = s.cat.codes.to_numpy()
+        return np.where(codes >= 0, np.append(hits, False)[codes], False)
+    return s.astype(str).str.contains(text, case=False, regex=False).to_numpy() & s.notna().to_numpy()
+
+
+# 3. 快取：以（資料鍵, 欄位 / 條件）為鍵，同一份資料的排序與搜尋結果所有 session 共用
+_cache: OrderedDict[tuple, np.ndarray] = OrderedDict()
+_cache_lock = threading.Lock()
+_CACHE_MAX = 64
+
+
+def _cached(key: tuple, build) -> np.ndarray:
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None:
+            _cache.move_to_end(key)
+            return hit
+    value = build()
+    value.setflags(write=False)
+    with _cache_lock:
+        _cache[key] = value
+        while len(_cache) > _CACHE_MAX:
+            _cache.popitem(last=False)
+    return value
+
+
+@timed()
+def query_positions(data_key: str, df: pd.DataFrame, result: ThresholdResult, query: TableQuery) -> np.ndarray:
+    """
+    依查詢條件回傳列位置（已排序）。data_key 需能代表 df 的內容（資料集鍵 + 篩選條件等）。
+    """
+    base = (data_key, len(df))
+
+    def build() -> np.ndarray:
+        keep = np.ones(len(df), dtype=bool)
+        if query.oos_only:
+            keep &= result.oos_rows
+        if query.search and query.search_col in df:
+            keep &= _cached((*base, "search", query.search_col, query.search),
+                            lambda: search_mask(df[query.search_col], query.search))
+        if query.sort_col in df:
+            keys = _cached((*base, "keys", query.sort_col), lambda: _sort_keys(df[query.sort_col]))
+            # 穩定排序、NaN 在最後；遞減時只反轉有值的部分，空值仍留在最後
+            order = _cached((*base, "sort", query.sort_col), lambda: np.argsort(keys, kind="stable"))
+            if not query.ascending:
+                n_valid = int((~np.isnan(keys)).sum())
+                order = np.concatenate([order[:n_valid][::-1], order[n_valid:]])
+            return order[keep[order]]
+        return np.flatnonzero(keep)
+
+    return _cached((*base, "query", query), build)
+
+
+# 4. 取出一頁：只有這一頁的列會被複製、加上超標欄位並樣式化
+def page_frame(df: pd.DataFrame, result: ThresholdResult, positions: np.ndarray, page: int, page_size: int):
+    rows = positions[page * page_size:(page + 1) * page_size]
+    page_result = result.take(rows)
+    page_df = add_flag_columns(df.iloc[rows], page_result)
+    return style_from_mask(page_df, page_result)
+
+
+# 5. 元件：查詢列 + 目前這一頁；翻頁時下一頁已在背景算好（預取），點下一頁不必等待
+_prefetched: OrderedDict[tuple, object] = OrderedDict()
+_PREFETCH_MAX = 32
+
+
+def _page(cache_key: tuple, df, result, positions, page: int, page_size: int):
+    with _cache_lock:
+        hit = _prefetched.pop(cache_key, None)
+    return hit if hit is not None else page_frame(df, result, positions, page, page_size)
+
+
+def _prefetch(cache_key: tuple, df, result, positions, page: int, page_size: int) -> None:
+    with _cache_lock:
+        if cache_key in _prefetched:
+            return
+
+    def work():
+        styler = page_frame(df, result, positions, page, page_size)
+        with _cache_lock:
+            _prefetched[cache_key] = styler
+            while len(_prefetched) > _PREFETCH_MAX:
+                _prefetched.popitem(last=False)
+    threading.Thread(target=work, daemon=True).start()
+
+
+@timed()
+def render_paged_table(df: pd.DataFrame, result: ThresholdResult, key: str, data_key: str,
+                       oos_only: bool = False, default_page_size: int = PAGE_SIZES[1]):
+    """
+    伺服器端分頁表格。key 為 widget 前綴；data_key 代表 df 的內容，用來共用排序 / 搜尋快取。
+    oos_only=True 時固定只顯示超標列（不顯示切換）。
+    """
+    columns = list(df.columns)
+    c1, c2, c3, c4, c5 = st.columns([3, 1, 3, 3, 2])
+    sort_col = c1.selectbox("排序欄位", ["（原始順序）", *columns], key=f"{key}_sort")
+    descending = c2.toggle("遞減", key=f"{key}_desc")
+    search_col = c3.selectbox("搜尋欄位", columns, key=f"{key}_search_col")
+    search = c4.text_input("搜尋（包含文字）", key=f"{key}_search").strip()
+    page_size = c5.selectbox("每頁筆數", PAGE_SIZES, index=PAGE_SIZES.index(default_page_size), key=f"{key}_size")
+    if not oos_only:
+        oos_only = st.checkbox("只看超標列", key=f"{key}_oos")
+
+    query = TableQuery(None if sort_col == "（原始順序）" else sort_col, not descending, search_col, search, oos_only)
+    positions = query_positions(data_key, df, result, query)
+    n_rows = len(positions)
+    if n_rows == 0:
+        st.info("沒有符合條件的資料")
+        return None
+
+    n_pages = (n_rows + page_size - 1) // page_size
+    # 條件改變時回到第一頁
+    signature = (data_key, query, page_size)
+    if st.session_state.get(f"{key}_signature") != signature:
+        st.session_state[f"{key}_signature"] = signature
+        st.session_state[f"{key}_page"] = 1
+    page = st.number_input(f"頁數（共 {n_pages} 頁）", min_value=1, max_value=n_pages, step=1, key=f"{key}_page")
+    page = min(int(page), n_pages) - 1
+
+    page_key = (data_key, len(df), query, page_size)
+    styler = _page((*page_key, page), df, result, positions, page, page_size)
+    first = page * page_size + 1
+    st.caption(f"第 {first}–{min(first + page_size - 1, n_rows)} 筆，共 {n_rows} 筆（資料 {len(df)} 筆）")
+    if page + 1 < n_pages:
+        _prefetch((*page_key, page + 1), df, result, positions, page + 1, page_size)
+    return st.dataframe(styler, use_container_width=True)
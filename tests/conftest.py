@@ -0,0 +1,7 @@
+# 余振中 (Yu Chen Chung)
+# tests/conftest.py
+# 專案模組都放在根目錄（非套件），測試時把根目錄加進 sys.path
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
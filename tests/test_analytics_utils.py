@@ -0,0 +1,92 @@
+# 余振中 (Yu Chen Chung)
+# tests/test_analytics_utils.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from analytics_utils import MIN_PAIRS, correlation_matrix, fit_line, numeric_columns, pair_regression
+
+
+@pytest.fixture(scope="module")
+def frame() -> pd.DataFrame:
+    rng = np.random.default_rng(11)
+    n = 3000
+    a = rng.normal(65, 2, n)
+    df = pd.DataFrame({
+        "電鍍開始時間": pd.date_range("2020-01-01", periods=n, freq="h"),
+        "a": a,
+        "b": 0.5 * a + rng.normal(0, 1, n),
+        "c": np.r_[rng.normal(0, 1, 3), a[:-3]] + rng.normal(0, 0.5, n),    # 落後 a 三批
+        "d": rng.normal(1e6, 1, n).astype("float32"),                       # 大數值：檢查精度
+        "sparse": np.where(rng.random(n) < 0.997, np.nan, rng.normal(0, 1, n)),
+        "flag": rng.random(n) < 0.5,
+    })
+    for col in ("a", "b", "c"):
+        df.loc[rng.choice(n, 200, replace=False), col] = np.nan
+    return df
+
+
+# 1. 同批相關矩陣與 DataFrame.corr（成對去除缺值）相同
+def test_matrix_matches_pandas_corr(frame):
+    cols = numeric_columns(frame)
+    assert "flag" not in cols and "電鍍開始時間" not in cols
+    result = correlation_matrix(frame, cols, max_lag=0)
+    expected = frame[cols].astype("float64").corr(min_periods=MIN_PAIRS)
+    pd.testing.assert_frame_equal(result.matrix(0), expected, check_names=False, atol=1e-9)
+    n = frame[cols].notna().astype(int)
+    np.testing.assert_array_equal(result.n[0], (n.T @ n).to_numpy())
+
+
+# 2. 延遲相關：r[k, i, j] = corr(第 t 批的 i, 第 t+k 批的 j)，依時間排序後計算
+def test_lagged_matches_shifted_corr(frame):
+    shuffled = frame.sample(frac=1.0, random_state=1)
+    result = correlation_matrix(shuffled, ["a", "b", "c"], max_lag=4)
+    for k in range(5):
+        for x in ("a", "b", "c"):
+            for y in ("a", "b", "c"):
+                expected = frame[x].corr(frame[y].shift(-k), min_periods=MIN_PAIRS)
+                assert result.matrix(k).loc[x, y] == pytest.approx(expected, abs=1e-9)
+    profile = result.lag_profile("a", "c").set_index("lag")["r"]
+    assert profile.abs().idxmax() == 3
+    top = result.leading_pairs(1).iloc[0]
+    assert (top["領先"], top["落後"], top["延遲批數"]) == ("a", "c", 3)
+
+
+# 3. 快取依內容：同一份資料命中，內容改變時重算
+def test_result_cached_by_content(frame):
+    first = correlation_matrix(frame, ["a", "b"], max_lag=0)
+    assert correlation_matrix(frame, ["a", "b"], max_lag=0) is first
+    changed = frame.assign(b=-frame["b"])
+    assert correlation_matrix(changed, ["a", "b"], max_lag=0).matrix().loc["a", "b"] == pytest.approx(
+        -first.matrix().loc["a", "b"])
+
+
+# 4. 回歸：OLS 與 polyfit 相同；Huber 不被離群值拉走
+def test_ols_matches_polyfit():
+    rng = np.random.default_rng(5)
+    x = rng.normal(0, 1, 500)
+    y = 2.0 * x + 1.0 + rng.normal(0, 0.3, 500)
+    fit = fit_line(x, y, "OLS")
+    slope, intercept = np.polyfit(x, y, 1)
+    assert (fit.slope, fit.intercept) == pytest.approx((slope, intercept))
+    assert fit.r2 == pytest.approx(np.corrcoef(x, y)[0, 1] ** 2)
+    assert (fit.band["lo"] <= fit.band["fit"]).all() and (fit.band["fit"] <= fit.band["hi"]).all()
+
+
+def test_huber_resists_outliers():
+    rng = np.random.default_rng(6)
+    x = rng.uniform(0, 10, 300)
+    y = 2.0 * x + rng.normal(0, 0.5, 300)
+    y[:15] += 40
+    df = pd.DataFrame({"x": x, "y": y})
+    fits = pair_regression(df, "x", "y")
+    assert abs(fits["Huber"].slope - 2.0) < abs(fits["OLS"].slope - 2.0)
+    assert fits["Huber"].slope == pytest.approx(2.0, abs=0.1)
+    assert fits["Huber"].outliers >= 15
+
+
+def test_degenerate_inputs():
+    assert fit_line(np.ones(20), np.arange(20.0)) is None
+    assert fit_line(np.arange(2.0), np.arange(2.0)) is None
+    result = correlation_matrix(pd.DataFrame({"a": [1.0, 2.0, 3.0], "b": [3.0, 1.0, 2.0]}), max_lag=0)
+    assert np.isnan(result.r[0]).all()       # 成對筆數少於 MIN_PAIRS
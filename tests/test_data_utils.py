@@ -0,0 +1,49 @@
+# 余振中 (Yu Chen Chung)
+# tests/test_data_utils.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_utils import DEFAULT_THRESHOLDS, clean_numeric_columns, compute_status, evaluate_thresholds
+from synth_utils import generate_plating_log
+
+
+# 原本逐列判定的寫法（向量化之前），作為對照
+def _row_status(df: pd.DataFrame, thresholds) -> np.ndarray:
+    def status(row):
+        return "OK" if all(low <= row[col] <= high for col, (low, high) in thresholds.items()) else "NG"
+    return df.apply(status, axis=1).to_numpy(dtype=object)
+
+
+@pytest.fixture(scope="module")
+def plating() -> pd.DataFrame:
+    return clean_numeric_columns(generate_plating_log(2000, seed=1), list(DEFAULT_THRESHOLDS))
+
+
+# 1. 狀態與逐列判定一致
+def test_status_matches_row_wise(plating):
+    result = evaluate_thresholds(plating, DEFAULT_THRESHOLDS)
+    out = compute_status(plating.copy(), DEFAULT_THRESHOLDS, result)
+    np.testing.assert_array_equal(out["狀態"].astype(str).to_numpy(), _row_status(plating, DEFAULT_THRESHOLDS))
+    assert {"OK", "NG"} <= set(out["狀態"].astype(str))
+
+
+# 2. 邊界值算合格，NaN 算超標（與 low <= v <= high 相同）
+def test_boundaries_and_nan():
+    thresholds = {"a": (1.0, 2.0), "b": (0.0, 10.0)}
+    df = pd.DataFrame({"a": [1.0, 2.0, 0.999, 2.001, np.nan], "b": [5.0, 5.0, 5.0, 5.0, 5.0]})
+    result = evaluate_thresholds(df, thresholds)
+    np.testing.assert_array_equal(result.status, _row_status(df, thresholds))
+    np.testing.assert_array_equal(result.status, ["OK", "OK", "NG", "NG", "NG"])
+
+
+# 3. 逐格標紅與超標列篩選與原本的 between / 比較結果一致
+def test_cell_flags_and_oos_rows(plating):
+    result = evaluate_thresholds(plating, DEFAULT_THRESHOLDS)
+    for col, (low, high) in DEFAULT_THRESHOLDS.items():
+        np.testing.assert_array_equal(result.cell_flags()[col].to_numpy(), ~plating[col].between(low, high).to_numpy())
+    mask = pd.DataFrame({c: plating[c].between(lo, hi) for c, (lo, hi) in DEFAULT_THRESHOLDS.items()})
+    np.testing.assert_array_equal(result.oos_rows, ~mask.all(axis=1).to_numpy())
+    oos = result.subset_oos()
+    assert oos.index.equals(plating.index[~mask.all(axis=1).to_numpy()])
+    assert oos.violations.any(axis=1).all()
@@ -0,0 +1,100 @@
+# 余振中 (Yu Chen Chung)
+# tests/test_filter_utils.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_utils import DEFAULT_THRESHOLDS, ThresholdResult, clean_numeric_columns, evaluate_thresholds
+from filter_utils import RUN_KEY_BASE, FilterSpec, filter_view, get_filter_index, parse_run, run_keys
+from synth_utils import generate_plating_log
+
+
+# 1. 電鍍次數解析
+@pytest.mark.parametrize("text, expected", [
+    ("12-3", (12, 3)),
+    ("12", (12, 0)),
+    (12, (12, 0)),
+    (" 12 - 3 ", (12, 3)),
+    ("１２－３", (12, 3)),             # 全形先經 NFKC
+    ("000012-003", (12, 3)),
+    ("999999999999-999999", (999999999999, 999999)),
+    ("1 2-3", None),                   # 數字中間夾空白
+    ("12-3 4", None),
+    ("1-1000000", None),               # 次數超過 RUN_KEY_BASE 會與下一個主次數重疊
+    ("9999999999999-1", None),         # 主次數超過 12 位
+    ("99999999999999999999-1", None),  # 會溢位
+    ("3-1-2", None),
+    ("a-1", None),
+    ("-3", None),
+    ("", None),
+    (None, None),
+])
+def test_parse_run(text, expected):
+    assert parse_run(text) == expected
+
+
+def test_run_keys_order_matches_tuples():
+    runs = pd.Series(["2-10", "2-9", "10-1", "１-５", "bad", None, "3"], dtype=object)
+    keys = run_keys(runs)
+    missing = np.iinfo(np.int64).max
+    assert keys[4] == keys[5] == missing
+    valid = [(int(k) // RUN_KEY_BASE, int(k) % RUN_KEY_BASE) for k in keys if k != missing]
+    assert valid == [(2, 10), (2, 9), (10, 1), (1, 5), (3, 0)]
+    order = np.argsort(keys[keys != missing], kind="stable")
+    assert [valid[i] for i in order] == sorted(valid)
+
+
+# 2. 篩選結果與逐列比對相同
+@pytest.fixture(scope="module")
+def dataset():
+    df = clean_numeric_columns(generate_plating_log(1500, seed=2), list(DEFAULT_THRESHOLDS))
+    df = df.sample(frac=1.0, random_state=0)      # 時間亂序：走排序後位置的路徑
+    return df, evaluate_thresholds(df, DEFAULT_THRESHOLDS)
+
+
+@pytest.mark.parametrize("spec", [
+    FilterSpec(status="NG"),
+    FilterSpec(start=pd.Timestamp("2017-06-01"), end=pd.Timestamp("2017-08-31 23:59")),
+    FilterSpec(run_min=(3, 0), run_max=(8, 20), status="OK"),
+    FilterSpec(start=pd.Timestamp("2017-07-01"), run_min=(5, 1)),
+])
+def test_filter_view_matches_brute_force(dataset, spec):
+    df, result = dataset
+    view, view_result = filter_view(df, result, get_filter_index(None, df, result), spec)
+
+    keep = np.ones(len(df), dtype=bool)
+    dates = df["電鍍開始時間"]
+    if spec.start is not None:
+        keep &= (dates >= spec.start).to_numpy()
+    if spec.end is not None:
+        keep &= (dates <= spec.end).to_numpy()
+    if spec.status is not None:
+        keep &= result.status == spec.status
+    keys = run_keys(df["電鍍次數"])
+    if spec.run_min is not None:
+        keep &= keys >= spec.run_min[0] * RUN_KEY_BASE + spec.run_min[1]
+    if spec.run_max is not None:
+        keep &= keys <= spec.run_max[0] * RUN_KEY_BASE + spec.run_max[1]
+    assert 0 < keep.sum() < len(df)
+    assert view.index.equals(df.index[keep])
+    np.testing.assert_array_equal(view_result.violations, result.violations[keep])
+
+
+# 3. 索引快取依內容失效：同樣列數、內容不同時不會拿到舊索引
+def test_filter_index_invalidates_on_content_change(dataset):
+    df, result = dataset
+    first = get_filter_index(None, df, result)
+    assert get_filter_index(None, df, result) is first
+
+    edited = df.copy()
+    edited["電鍍開始時間"] = edited["電鍍開始時間"] + pd.Timedelta(days=30)
+    moved = get_filter_index(None, edited, result)
+    assert moved is not first
+    assert moved.date_max == first.date_max + pd.Timedelta(days=30)
+
+    flipped = ThresholdResult(result.columns, ~result.violations, result.index)
+    assert get_filter_index(None, df, flipped) is not first
+
+    # 呼叫端給的內容鍵相同但列數不同（例如增量新增後沿用舊鍵）也不會共用
+    keyed = get_filter_index("dataset-a", df, result)
+    assert get_filter_index("dataset-a", df.iloc[:-5], result.take(slice(0, len(df) - 5))) is not keyed
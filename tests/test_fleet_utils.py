@@ -0,0 +1,23 @@
+# 余振中 (Yu Chen Chung)
+# tests/test_fleet_utils.py
+import pandas as pd
+
+from data_utils import DEFAULT_THRESHOLDS
+from fleet_utils import fleet_summary, fleet_summary_subprocess, process_fleet
+from synth_utils import generate_plating_log
+from threshold_utils import ThresholdConfig
+
+
+# 1. 子行程（spawn 行程池）算出的總覽與本行程逐槽處理相同，設定（含調整中的修訂）完整傳到子行程
+def test_subprocess_summary_matches_in_process(tmp_path):
+    path = tmp_path / "book.xlsx"
+    with pd.ExcelWriter(path) as writer:
+        for i, sheet in enumerate(["EP15", "EP16", "EP17"]):
+            generate_plating_log(120, seed=i).to_excel(writer, sheet_name=sheet, index=False)
+        pd.DataFrame({"x": [1]}).to_excel(writer, sheet_name="說明", index=False)
+
+    config = ThresholdConfig(dict(DEFAULT_THRESHOLDS)).revise("EP16", {"硫酸實際值(g/l)": (63.0, 67.0)}, None)
+    expected = fleet_summary(process_fleet([str(path)], config.default, max_workers=1, config=config), config.default)
+    got = fleet_summary_subprocess([str(path)], config, max_workers=2)
+    assert list(got["槽號"]) == ["EP15", "EP16", "EP17"]
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False)
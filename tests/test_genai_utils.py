@@ -0,0 +1,118 @@
+# 余振中 (Yu Chen Chung)
+# tests/test_genai_utils.py
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from data_utils import evaluate_thresholds
+from genai_utils import (
+    AnalysisRequest,
+    GeminiRunner,
+    ResponseCache,
+    analyze_batch,
+    ask_gemini,
+    build_analysis_requests,
+    prompt_key,
+)
+
+
+class Overloaded(Exception):
+    code = 503
+
+
+class StubClient:
+    """只有 models.generate_content 的本地替身：記錄呼叫，可指定某些 prompt 失敗或先過載幾次。"""
+
+    def __init__(self, fail: set[str] = frozenset(), overload_first: int = 0):
+        self.calls: list[str] = []
+        self.fail = set(fail)
+        self.overload_left = overload_first
+        self._lock = threading.Lock()
+        self.models = SimpleNamespace(generate_content=self.generate_content)
+
+    def generate_content(self, model: str, contents: str):
+        with self._lock:
+            self.calls.append(contents)
+            if self.overload_left > 0:
+                self.overload_left -= 1
+                raise Overloaded("503 UNAVAILABLE")
+        if contents in self.fail:
+            raise RuntimeError("bad request")
+        return SimpleNamespace(text=f"回覆：{contents}")
+
+
+def _requests(n: int) -> list[AnalysisRequest]:
+    return [AnalysisRequest(tank=f"EP{i}", window="最近 7 筆", prompt=f"prompt {i}") for i in range(n)]
+
+
+# 1. 批次結果與 requests 同順序，每個 prompt 只呼叫一次
+def test_batch_returns_results_in_request_order():
+    client = StubClient()
+    reqs = _requests(8)
+    results = analyze_batch(reqs, client=client, concurrency=3, rate_per_minute=60000)
+    assert [(r.tank, r.window) for r in results] == [(q.tank, q.window) for q in reqs]
+    assert all(r.ok and r.attempts == 1 for r in results)
+    assert [r.text for r in results] == [f"回覆：{q.prompt}" for q in reqs]
+    assert sorted(client.calls) == sorted(q.prompt for q in reqs)
+
+
+# 2. 快取命中時不再呼叫 client
+def test_batch_cache_skips_repeat_calls():
+    client = StubClient()
+    cache = ResponseCache()
+    reqs = _requests(4)
+    analyze_batch(reqs, client=client, cache=cache, rate_per_minute=60000)
+    again = analyze_batch(reqs, client=client, cache=cache, rate_per_minute=60000)
+    assert len(client.calls) == 4
+    assert all(r.cached and r.ok for r in again)
+
+
+# 3. 單一請求失敗只影響自己，錯誤回覆不進快取
+def test_batch_failure_is_isolated():
+    reqs = _requests(3)
+    client = StubClient(fail={reqs[1].prompt})
+    cache = ResponseCache()
+    results = analyze_batch(reqs, client=client, cache=cache, rate_per_minute=60000)
+    assert [r.ok for r in results] == [True, False, True]
+    assert results[1].text.startswith("Error:") and "bad request" in results[1].error
+    assert cache.get(prompt_key(reqs[1].prompt, "gemini-2.0-flash")) is None
+
+
+# 4. 503 過載會退避重試，最後成功
+def test_batch_retries_overloaded():
+    client = StubClient(overload_first=2)
+    results = analyze_batch(_requests(1), client=client, rate_per_minute=60000, initial_backoff=0.001)
+    assert results[0].ok and results[0].attempts == 3
+
+
+# 5. 單次呼叫：超過重試次數回傳錯誤字串
+def test_ask_gemini_gives_up_after_max_retries():
+    client = StubClient(overload_first=10)
+    text = ask_gemini("x", client=client, max_retries=3, initial_backoff=0.001)
+    assert text.startswith("Error:") and len(client.calls) == 3
+
+
+# 6. GeminiRunner：結果寫入快取，相同 prompt 直接取回
+def test_runner_caches_results():
+    client = StubClient()
+    runner = GeminiRunner(client=client, max_workers=2)
+    assert runner.submit("hello").result(timeout=5) == "回覆：hello"
+    assert runner.submit("hello").result(timeout=5) == "回覆：hello"
+    assert client.calls == ["hello"]
+
+
+# 7. 由資料建出的精簡 prompt 可直接送進批次
+def test_build_requests_feed_batch():
+    n = 50
+    df = pd.DataFrame({
+        "電鍍開始時間": pd.date_range("2024-01-01", periods=n, freq="6h"),
+        "a": np.linspace(60, 70, n),
+    })
+    thresholds = {"a": (62.0, 68.0)}
+    result = evaluate_thresholds(df, thresholds)
+    reqs = build_analysis_requests({"EP15": (df, result)}, thresholds)
+    assert len(reqs) == 3 and all("EP15" in q.prompt for q in reqs)
+    results = analyze_batch(reqs, client=StubClient(), rate_per_minute=60000)
+    assert all(r.ok for r in results)
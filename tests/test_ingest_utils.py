@@ -0,0 +1,125 @@
+# 余振中 (Yu Chen Chung)
+# tests/test_ingest_utils.py
+import re
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_utils import DEFAULT_THRESHOLDS
+from ingest_utils import refresh_sheet
+from synth_utils import generate_plating_log
+
+SHEET = "EP15"
+
+
+@pytest.fixture
+def log() -> pd.DataFrame:
+    return generate_plating_log(305, seed=4)
+
+
+def _write(path, df: pd.DataFrame) -> None:
+    df.to_excel(path, sheet_name=SHEET, index=False)
+
+
+# Excel 的寫法：字串放在 sharedStrings.xml，儲存格只存索引，新字串依出現順序接在表尾
+# （pandas / openpyxl 寫出的是 inlineStr，共用字串表是空的，測不到字串表變長的情況）
+def _write_shared_strings(path, df: pd.DataFrame) -> None:
+    _write(path, df)
+    with zipfile.ZipFile(path) as z:
+        parts = {name: z.read(name) for name in z.namelist()}
+    strings: dict[bytes, int] = {}
+
+    def to_index(m: re.Match) -> bytes:
+        return b'"s"><v>%d</v>' % strings.setdefault(m.group(1), len(strings))
+
+    sheet = "xl/worksheets/sheet1.xml"
+    parts[sheet] = re.sub(rb'"inlineStr"><is><t(?: [^>]*)?>(.*?)</t></is>', to_index, parts[sheet])
+    items = b"".join(b"<si><t>%s</t></si>" % text for text in strings)
+    parts["xl/sharedStrings.xml"] = (
+        b'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="%d" uniqueCount="%d">%s</sst>'
+        % (len(strings), len(strings), items)
+    )
+    parts["[Content_Types].xml"] = parts["[Content_Types].xml"].replace(b"</Types>", (
+        b'<Override PartName="/xl/sharedStrings.xml" '
+        b'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml" /></Types>'))
+    parts["xl/_rels/workbook.xml.rels"] = parts["xl/_rels/workbook.xml.rels"].replace(b"</Relationships>", (
+        b'<Relationship Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" '
+        b'Target="sharedStrings.xml" Id="rIdSst" /></Relationships>'))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in parts.items():
+            z.writestr(name, data)
+
+
+def _assert_same(a, b) -> None:
+    pd.testing.assert_frame_equal(a.data, b.data)
+    np.testing.assert_array_equal(a.violations, b.violations)
+    pd.testing.assert_frame_equal(a.monthly.reset_index(drop=True), b.monthly.reset_index(drop=True), check_dtype=False)
+
+
+# 1. 尾端新增列：只處理新列，結果與整份重建相同
+def test_append_processes_only_new_rows(tmp_path, log):
+    path = tmp_path / "book.xlsx"
+    _write(path, log.iloc[:300])
+    first = refresh_sheet(str(path), SHEET, DEFAULT_THRESHOLDS, state_dir=str(tmp_path / "state"))
+    assert (first.new_rows, first.raw_rows) == (300, 300)
+    assert refresh_sheet(str(path), SHEET, DEFAULT_THRESHOLDS, state_dir=str(tmp_path / "state")).new_rows == 0
+
+    _write(path, log)
+    appended = refresh_sheet(str(path), SHEET, DEFAULT_THRESHOLDS, state_dir=str(tmp_path / "state"))
+    assert (appended.new_rows, appended.raw_rows) == (5, 305)
+    assert appended.version != first.version
+    _assert_same(appended, refresh_sheet(str(path), SHEET, DEFAULT_THRESHOLDS, state_dir=str(tmp_path / "fresh")))
+
+
+# 2. 已處理的列被修改（列數不變）：偵測到指紋不同並完整重建
+def test_edit_in_processed_rows_rebuilds(tmp_path, log):
+    path = tmp_path / "book.xlsx"
+    _write(path, log)
+    before = refresh_sheet(str(path), SHEET, DEFAULT_THRESHOLDS, state_dir=str(tmp_path / "state"))
+
+    edited = log.copy()
+    edited.loc[10, "硫酸實際值(g/l)"] = 99.0
+    _write(path, edited)
+    after = refresh_sheet(str(path), SHEET, DEFAULT_THRESHOLDS, state_dir=str(tmp_path / "state"))
+    assert after.new_rows == after.raw_rows == 305
+    assert after.version != before.version
+    _assert_same(after, refresh_sheet(str(path), SHEET, DEFAULT_THRESHOLDS, state_dir=str(tmp_path / "fresh")))
+
+
+# 3. 刪除列、門檻改變：都退回完整重建
+def test_full_rebuild_on_deleted_rows_and_new_thresholds(tmp_path, log):
+    path = tmp_path / "book.xlsx"
+    state_dir = str(tmp_path / "state")
+    _write(path, log)
+    refresh_sheet(str(path), SHEET, DEFAULT_THRESHOLDS, state_dir=state_dir)
+
+    _write(path, log.drop(index=[3, 4]))
+    shrunk = refresh_sheet(str(path), SHEET, DEFAULT_THRESHOLDS, state_dir=state_dir)
+    assert shrunk.new_rows == shrunk.raw_rows == 303
+
+    tighter = {**DEFAULT_THRESHOLDS, "硫酸實際值(g/l)": (63.0, 67.0)}
+    rebuilt = refresh_sheet(str(path), SHEET, tighter, state_dir=state_dir)
+    assert rebuilt.new_rows == 303
+    assert rebuilt.thresholds == tighter
+
+
+# 4. 共用字串表：新增列帶來新字串（每列不同的電鍍次數）時仍只處理新列；改動已處理列的字串則完整重建
+def test_append_with_new_shared_strings(tmp_path, log):
+    path = tmp_path / "book.xlsx"
+    state_dir = str(tmp_path / "state")
+    _write_shared_strings(path, log.iloc[:300])
+    first = refresh_sheet(str(path), SHEET, DEFAULT_THRESHOLDS, state_dir=state_dir)
+    assert first.shared_strings > 0
+
+    _write_shared_strings(path, log.iloc[:301])
+    appended = refresh_sheet(str(path), SHEET, DEFAULT_THRESHOLDS, state_dir=state_dir)
+    assert (appended.new_rows, appended.raw_rows) == (1, 301)
+    assert appended.shared_strings > first.shared_strings
+    _assert_same(appended, refresh_sheet(str(path), SHEET, DEFAULT_THRESHOLDS, state_dir=str(tmp_path / "fresh")))
+
+    edited = log.iloc[:301].copy()
+    edited.loc[0, "電鍍次數"] = "0-0"
+    _write_shared_strings(path, edited)
+    assert refresh_sheet(str(path), SHEET, DEFAULT_THRESHOLDS, state_dir=state_dir).new_rows == 301
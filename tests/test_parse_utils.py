@@ -0,0 +1,93 @@
+# 余振中 (Yu Chen Chung)
+# tests/test_parse_utils.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_utils import clean_numeric_columns
+from parse_utils import PLACEHOLDERS, parse_numeric, parse_stats_frame
+
+
+def _parse_one(value):
+    values, _ = parse_numeric(pd.Series([value], dtype=object))
+    return values[0]
+
+
+# 1. 現場常見寫法
+@pytest.mark.parametrize("text, expected", [
+    ("65.2", 65.2),
+    ("  66  ", 66.0),
+    ("65.2 g/l", 65.2),
+    ("65.2g/l", 65.2),
+    ("65%", 65.0),
+    ("６５", 65.0),              # 全形數字
+    ("６５．２", 65.2),
+    ("65,2", 65.2),              # 逗號小數
+    ("1,200", 1200.0),           # 千分位
+    ("12,345.6", 12345.6),
+    ("64~66", 65.0),             # 範圍取中點
+    ("64-66", 65.0),
+    ("64 to 66", 65.0),
+    ("64至66", 65.0),
+    ("約65", 65.0),
+    ("<5", 5.0),                 # 偵測極限以界限值計
+    (">= 3", 3.0),
+    ("-5", -5.0),
+    (".5", 0.5),
+    ("5e2", 500.0),
+])
+def test_recovers_hand_written_values(text, expected):
+    assert _parse_one(text) == pytest.approx(expected)
+
+
+# 2. 空白與佔位符號是空值，不算失敗；真正的雜訊才是失敗
+@pytest.mark.parametrize("text", [None, np.nan, "", "   ", *sorted(PLACEHOLDERS), "n/a", "None"])
+def test_placeholders_are_blank(text):
+    values, stats = parse_numeric(pd.Series([text], dtype=object))
+    assert np.isnan(values[0])
+    assert (stats.blank, stats.failed) == (1, 0)
+
+
+@pytest.mark.parametrize("text", ["abc", "65..2", "6 5", "1-2-3", "65 + 3"])
+def test_garbage_fails(text):
+    values, stats = parse_numeric(pd.Series([text], dtype=object))
+    assert np.isnan(values[0])
+    assert stats.failed == 1
+    assert stats.samples == [text]
+
+
+# 3. 統計以列為單位（重複字串只解析一次，但每列都計入）
+def test_stats_count_rows():
+    s = pd.Series(["65.2 g/l"] * 3 + ["64~66", "<5", "-", "abc", "abc", 66.0, None], dtype=object)
+    values, stats = parse_numeric(s)
+    assert stats.total == 10
+    assert stats.numeric == 1
+    assert stats.recovered == 5
+    assert stats.ranges == 1
+    assert stats.censored == 1
+    assert stats.blank == 2
+    assert stats.failed == 2
+    assert stats.samples == ["abc"]
+    np.testing.assert_allclose(values[:5], [65.2, 65.2, 65.2, 65.0, 5.0])
+
+
+# 4. 數值欄位直接走快速路徑；其他型別（混有數字與文字）仍可解析
+def test_numeric_dtype_fast_path():
+    values, stats = parse_numeric(pd.Series([1.0, np.nan, 3.0]))
+    np.testing.assert_array_equal(values, [1.0, np.nan, 3.0])
+    assert (stats.numeric, stats.blank, stats.recovered) == (2, 1, 0)
+
+
+def test_empty_series():
+    values, stats = parse_numeric(pd.Series([], dtype=object))
+    assert len(values) == 0 and stats.total == 0
+
+
+# 5. 清洗時記錄統計：救回的列保留下來，無法解析的列被去除
+def test_clean_records_stats():
+    df = pd.DataFrame({"a": ["65.2 g/l", "abc", "66", None], "b": [1.0, 2.0, 3.0, 4.0]})
+    out = clean_numeric_columns(df, ["a", "b"])
+    np.testing.assert_allclose(out["a"].to_numpy(), [65.2, 66.0])
+    table = parse_stats_frame(out)
+    row = table.set_index("欄位").loc["a"]
+    assert (row["正規化後解析"], row["無法解析"], row["無法解析範例"]) == (1, 1, "abc")
@@ -0,0 +1,61 @@
+# 余振中 (Yu Chen Chung)
+# tests/test_perf_utils.py
+import threading
+import tracemalloc
+
+import numpy as np
+
+import perf_utils
+
+
+# 1. 記憶體追蹤只在區塊執行期間開啟，結束後停止；巢狀區塊共用同一次追蹤
+def test_tracemalloc_runs_only_inside_tracked_stages():
+    perf_utils.enable(True, track_memory=True)
+    perf_utils.reset()
+    assert not tracemalloc.is_tracing()
+    with perf_utils.stage("outer"):
+        with perf_utils.stage("inner"):
+            assert tracemalloc.is_tracing()
+            block = np.ones(1_000_000)
+        assert tracemalloc.is_tracing()
+    assert not tracemalloc.is_tracing()
+    inner, outer = perf_utils.records()
+    assert inner["mem_delta_mb"] > 7 and outer["mem_delta_mb"] > 7
+    del block
+    perf_utils.enable(False)
+
+
+# 2. 其他執行緒（其他 session）沒開追蹤時不受影響；關閉效能面板時完全不啟動
+def test_tracking_is_per_session():
+    perf_utils.enable(True, track_memory=True)
+    seen = []
+
+    def other_session():
+        perf_utils.enable(True)
+        with perf_utils.stage("other") as info:
+            pass
+        seen.append(info)
+
+    with perf_utils.stage("mine"):
+        t = threading.Thread(target=other_session)
+        t.start()
+        t.join()
+    assert "mem_delta_mb" not in seen[0]
+
+    perf_utils.enable(False)
+    with perf_utils.stage("off"):
+        assert not tracemalloc.is_tracing()
+    assert not tracemalloc.is_tracing()
+
+
+# 3. 外部自行啟動的追蹤（例如 benchmark.py）不會被計時區塊停掉
+def test_external_tracing_is_left_running():
+    tracemalloc.start()
+    try:
+        perf_utils.enable(True, track_memory=True)
+        with perf_utils.stage("x"):
+            pass
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+        perf_utils.enable(False)
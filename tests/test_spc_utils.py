@@ -0,0 +1,61 @@
+# 余振中 (Yu Chen Chung)
+# tests/test_spc_utils.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from spc_utils import WE_RULES, compute_spc, update_spc
+
+
+def _in_control(seed: int, n: int = 5000) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"x": rng.normal(65.0, 1.3, n)})
+
+
+# 1. 管制內資料的誤警報率有上限（規格寬度 / 6 當 σ、CUSUM 不重設時會接近 100%）
+@pytest.mark.parametrize("seed", range(5))
+def test_in_control_false_alarm_rate_is_bounded(seed):
+    frames, _ = compute_spc(_in_control(seed), ["x"], specs={"x": (62.0, 68.0)}, baseline=200)
+    spc = frames["x"]
+    assert spc["alarm"].mean() < 0.08
+    assert spc["cusum_alarm"].mean() < 0.03
+    assert spc["alarm"].tail(20).sum() < 20
+
+
+# 2. CUSUM 發出訊號後歸零重新累積
+def test_cusum_resets_after_signal():
+    x = np.r_[np.full(50, 65.0), np.full(50, 70.0)]
+    frames, states = compute_spc(pd.DataFrame({"x": x}), ["x"], baseline=50)
+    spc = frames["x"]
+    assert spc["cusum_alarm"].any()
+    signals = np.flatnonzero(spc["cusum_pos"].to_numpy() > states["x"].h)
+    assert all(spc["cusum_pos"].iloc[i + 1] <= spc["cusum_pos"].iloc[i] for i in signals if i + 1 < len(spc))
+
+
+# 3. 持續偏移仍會被偵測到
+def test_detects_mean_shift():
+    rng = np.random.default_rng(7)
+    x = np.r_[rng.normal(65.0, 1.3, 200), rng.normal(67.0, 1.3, 200)]
+    spc = compute_spc(pd.DataFrame({"x": x}), ["x"])[0]["x"]
+    assert spc["alarm"].iloc[200:].mean() > 0.5
+    assert spc["alarm"].iloc[:200].mean() < 0.1
+
+
+# 4. 分批增量更新與整段一次計算結果相同（baseline=0：μ / σ 取自規格，兩邊參數一致）
+@pytest.mark.parametrize("split", [1, 10, 137, 399])
+def test_update_matches_full_compute(split):
+    rng = np.random.default_rng(3)
+    x = np.r_[rng.normal(65.0, 1.3, 200), rng.normal(67.0, 1.3, 200)]
+    x[rng.choice(len(x), 20, replace=False)] = np.nan
+    df = pd.DataFrame({"x": x})
+    specs = {"x": (62.0, 68.0)}
+
+    full, full_states = compute_spc(df, ["x"], specs=specs, baseline=0)
+    head, states = compute_spc(df.iloc[:split], ["x"], specs=specs, baseline=0)
+    tail, tail_states = update_spc(states, df.iloc[split:])
+
+    pd.testing.assert_frame_equal(pd.concat([head["x"], tail["x"]]), full["x"], check_exact=False, rtol=1e-9)
+    a, b = tail_states["x"], full_states["x"]
+    assert (a.n_seen, a.center, a.sigma) == (b.n_seen, b.center, b.sigma)
+    assert np.allclose([a.ewma, a.cusum_pos, a.cusum_neg], [b.ewma, b.cusum_pos, b.cusum_neg])
+    np.testing.assert_array_equal(a.tail, b.tail)
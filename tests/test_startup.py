@@ -0,0 +1,24 @@
+# 余振中 (Yu Chen Chung)
+# tests/test_startup.py
+import json
+import os
+import subprocess
+import sys
+
+from startup_check import LAZY_MODULES, STARTUP_MODULES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# 1. 在乾淨的行程匯入儀表板模組：重量級 / 選用套件只能在第一次用到時才載入
+def test_startup_does_not_import_lazy_modules():
+    code = "; ".join([
+        "import json, sys",
+        *(f"import {m}" for m in STARTUP_MODULES),
+        f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))",
+    ])
+    env = dict(os.environ)
+    env.pop("GOOGLE_API_KEY", None)
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT, env=env)
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    assert json.loads(proc.stdout.splitlines()[-1]) == []
@@ -0,0 +1,53 @@
+# 余振中 (Yu Chen Chung)
+# tests/test_store_utils.py
+import pandas as pd
+import pytest
+
+from data_utils import DEFAULT_THRESHOLDS
+from store_utils import DatasetStore, build_processed
+from synth_utils import generate_plating_log
+
+
+@pytest.fixture(scope="module")
+def raw() -> pd.DataFrame:
+    return generate_plating_log(200, seed=9)
+
+
+# 1. 共用資料集唯讀：iloc / loc / to_numpy 就地寫入都會失敗，資料保持不變
+def test_shared_dataset_is_read_only(raw):
+    store = DatasetStore()
+    dataset = store.get_or_build("k", lambda: build_processed(raw, DEFAULT_THRESHOLDS))
+    data = dataset.data
+    col = "硫酸實際值(g/l)"
+    j = data.columns.get_loc(col)
+    before = data[col].copy()
+
+    with pytest.raises(ValueError):
+        data.iloc[0, j] = 1.0
+    with pytest.raises(ValueError):
+        data.loc[data.index[1], col] = 1.0
+    with pytest.raises(ValueError):
+        data[col].to_numpy()[2] = 5.0
+    with pytest.raises(ValueError):
+        data.iloc[0, data.columns.get_loc("狀態")] = "NG"
+    with pytest.raises(ValueError):
+        dataset.result.violations[0, 0] = True
+    pd.testing.assert_series_equal(data[col], before)
+
+    # 與未凍結的建構結果內容一致，第二次取得共用同一份
+    expected, _, _ = build_processed(raw, DEFAULT_THRESHOLDS)
+    pd.testing.assert_frame_equal(data, expected)
+    assert store.get_or_build("k", lambda: pytest.fail("不應重建")) is dataset
+
+
+# 2. builder 失敗時不留下建構鎖，之後可以重試
+def test_failed_build_releases_lock(raw):
+    store = DatasetStore()
+
+    def broken():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        store.get_or_build("k", broken)
+    assert store._building == {}
+    assert len(store.get_or_build("k", lambda: build_processed(raw, DEFAULT_THRESHOLDS)).data) > 0
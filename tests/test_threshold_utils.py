@@ -0,0 +1,130 @@
+# 余振中 (Yu Chen Chung)
+# tests/test_threshold_utils.py
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import threshold_utils
+from data_utils import DEFAULT_THRESHOLDS, clean_numeric_columns, compute_status, evaluate_thresholds
+from synth_utils import generate_plating_log
+from threshold_utils import (
+    ARCHIVE_DIR_NAME,
+    ThresholdConfig,
+    apply_config,
+    evaluate_config,
+    load_threshold_config,
+    save_threshold_config,
+)
+
+CL = "氯離子實際值(ppm/l)"
+HAS_YAML = importlib.util.find_spec("yaml") is not None
+
+
+@pytest.fixture
+def config() -> ThresholdConfig:
+    return ThresholdConfig(dict(DEFAULT_THRESHOLDS)).revise("EP15", {CL: (60.0, 78.0)}, pd.Timestamp("2017-07-01"))
+
+
+# 1. 版本只看內容：版次不同、存檔再讀回都是同一版；內容一改就換版
+def test_version_follows_content(config):
+    base = ThresholdConfig(dict(DEFAULT_THRESHOLDS))
+    assert config.version != base.version
+    assert ThresholdConfig.from_dict({**config.to_dict(), "revision": 9}).version == config.version
+    assert config.revise("EP15", {CL: (60.0, 78.0)}, pd.Timestamp("2017-07-01")).version == config.version
+    assert config.revise("EP15", {CL: (60.0, 77.0)}, pd.Timestamp("2017-07-01")).version != config.version
+
+
+@pytest.mark.parametrize("name", [
+    "thresholds.json",
+    pytest.param("thresholds.yaml", marks=pytest.mark.skipif(not HAS_YAML, reason="PyYAML 未安裝")),
+])
+def test_save_load_round_trip_and_archive(tmp_path, config, name):
+    path = str(tmp_path / name)
+    assert load_threshold_config(path).version == ThresholdConfig(dict(DEFAULT_THRESHOLDS)).version
+
+    first = save_threshold_config(config, path)
+    second = save_threshold_config(first.revise("EP16", {CL: (62.0, 79.0)}), path)
+    loaded = load_threshold_config(path)
+    assert (first.revision, second.revision, loaded.revision) == (1, 2, 2)
+    assert loaded.version == second.version
+    stem, ext = os.path.splitext(name)
+    archived = tmp_path / ARCHIVE_DIR_NAME / f"{stem}.r1{ext}"
+    assert load_threshold_config(str(archived)).version == first.version
+
+
+def test_invalid_config_is_rejected():
+    with pytest.raises(ValueError):
+        ThresholdConfig.from_dict({"default": {CL: [80, 60]}})
+    with pytest.raises(ValueError):
+        ThresholdConfig.from_dict({"default": {CL: [60, 80]}, "tanks": {"EP15": [{"limits": {"硬度HB": [1, 2]}}]}})
+
+
+# 2. 上下限時程：依生效日期取當時的上下限，沒有時間的列用最新的
+def test_schedule_by_effective_date(config):
+    assert config.schedule("EP16", CL) == ((None, *DEFAULT_THRESHOLDS[CL]),)
+    assert config.current("EP15")[CL] == (60.0, 78.0)
+    df = pd.DataFrame({
+        "電鍍開始時間": pd.to_datetime(["2017-06-30", "2017-07-01", None]),
+        **{c: [np.mean(v)] * 3 for c, v in DEFAULT_THRESHOLDS.items()},
+    })
+    df[CL] = 79.0     # 預設 (64, 80) 合格、修訂後 (60, 78) 超標
+    np.testing.assert_array_equal(evaluate_config(df, config, "EP15").oos_rows, [False, True, True])
+    np.testing.assert_array_equal(evaluate_config(df, config, "EP16").oos_rows, [False, False, False])
+
+
+# 3. 重新判定：結果與直接判定相同；重複呼叫命中快取；只重算時程有變的欄位
+@pytest.fixture
+def dataset():
+    df = clean_numeric_columns(generate_plating_log(800, seed=3), list(DEFAULT_THRESHOLDS))
+    result = evaluate_thresholds(df, DEFAULT_THRESHOLDS)
+    return compute_status(df, DEFAULT_THRESHOLDS, result), result
+
+
+def test_apply_config_matches_direct_evaluation(dataset, config):
+    df, result = dataset
+    same_df, same_result = apply_config("t-same", df, result, ThresholdConfig(dict(DEFAULT_THRESHOLDS)), "EP15")
+    assert same_df is df and same_result is result
+
+    out_df, out_result = apply_config("t-direct", df, result, config, "EP15")
+    expected = evaluate_config(df, config, "EP15")
+    np.testing.assert_array_equal(out_result.violations, expected.violations)
+    np.testing.assert_array_equal(out_df["狀態"].astype(str).to_numpy(), expected.status)
+    assert not df["狀態"].equals(out_df["狀態"])     # 共用資料不被修改
+    np.testing.assert_array_equal(df["狀態"].astype(str).to_numpy(), result.status)
+
+
+def test_apply_config_reuses_cached_columns(dataset, config, monkeypatch):
+    df, result = dataset
+    calls = []
+    original = threshold_utils._column_violations
+    monkeypatch.setattr(threshold_utils, "_column_violations",
+                        lambda values, schedule, dates: calls.append(schedule) or original(values, schedule, dates))
+
+    first = apply_config("t-cache", df, result, config, "EP15")
+    assert len(calls) == 3
+    assert apply_config("t-cache", df, result, config, "EP15") is first
+    assert len(calls) == 3
+
+    # EP16 沒有修訂：只有氯離子的預設時程是新的；之後兩槽來回切換都不必重算
+    apply_config("t-cache", df, result, config, "EP16")
+    assert len(calls) == 4 and calls[-1] == config.schedule("EP16", CL)
+    apply_config("t-cache", df, result, config, "EP15")
+    apply_config("t-cache", df, result, config, "EP16")
+    assert len(calls) == 4
+
+    # 只改一欄：只重算那一欄
+    tweaked = config.revise("EP15", {CL: (61.0, 78.0)}, pd.Timestamp("2017-07-01"))
+    apply_config("t-cache", df, result, tweaked, "EP15")
+    assert len(calls) == 5 and calls[-1] == tweaked.schedule("EP15", CL)
+
+
+def test_apply_config_rebuilds_when_rows_change(dataset, config):
+    df, result = dataset
+    full = apply_config("t-rows", df, result, config, "EP15")
+    head, head_result = df.iloc[:100], result.take(slice(0, 100))
+    out_df, out_result = apply_config("t-rows", head, head_result, config, "EP15")
+    assert len(out_df) == 100
+    np.testing.assert_array_equal(out_result.violations, full[1].violations[:100])
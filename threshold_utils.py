@@ -0,0 +1,281 @@
+# 余振中 (Yu Chen Chung)
+# threshold_utils.py
+# 規格上下限設定：預設值 + 各鍍槽依生效日期的修訂，存成 JSON（副檔名 .yaml / .yml 且有安裝 PyYAML 時用 YAML）
+#
+# 設定檔範例（thresholds.json）：
+# {
+#   "revision": 3,
+#   "default": {"硫酸實際值(g/l)": [62, 68], "硫酸銅實際值(g/l)": [200, 210], "氯離子實際值(ppm/l)": [64, 80]},
+#   "tanks": {
+#     "EP15": [
+#       {"effective": "2018-01-01", "limits": {"氯離子實際值(ppm/l)": [60, 78]}}
+#     ]
+#   }
+# }
+# 某鍍槽在某日起生效的修訂只覆蓋有列出的欄位；effective 為 null 表示該鍍槽從最早就使用這組上下限
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+
+import numpy as np
+import pandas as pd
+
+from data_utils import DEFAULT_THRESHOLDS, ThresholdResult
+from perf_utils import timed
+
+THRESHOLD_CONFIG_PATH = os.getenv("THRESHOLD_CONFIG", "thresholds.json")
+
+# 儲存時舊版本另存一份到這個子資料夾（thresholds.r<版次>.json），方便追溯與還原
+ARCHIVE_DIR_NAME = ".threshold_history"
+
+_NS_MIN = np.iinfo(np.int64).min
+
+# 1. 設定結構
+@dataclass(frozen=True)
+class LimitRevision:
+    effective: pd.Timestamp | None              # None：從最早就生效
+    limits: dict[str, tuple[float,float]]       # 只列出這次修訂的欄位
+
+
+@dataclass(frozen=True)
+class ThresholdConfig:
+    default: dict[str, tuple[float,float]]
+    tanks: dict[str, tuple[LimitRevision, ...]] = field(default_factory=dict)
+    revision: int = 0                           # 儲存次數（顯示用）；快取鍵用 version
+
+    @property
+    def columns(self) -> list[str]:
+        return list(self.default)
+
+    def to_dict(self) -> dict:
+        return {
+            "revision": self.revision,
+            "default": {c: [float(x) for x in v] for c, v in self.default.items()},
+            "tanks": {
+                tank: [
+                    {"effective": None if r.effective is None else r.effective.strftime("%Y-%m-%d"),
+                     "limits": {c: [float(x) for x in v] for c, v in r.limits.items()}}
+                    for r in revisions
+                ]
+                for tank, revisions in self.tanks.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "ThresholdConfig":
+        default = {c: _limit_pair(c, v) for c, v in d.get("default", DEFAULT_THRESHOLDS).items()}
+        tanks = {}
+        for tank, revisions in (d.get("tanks") or {}).items():
+            parsed = []
+            for r in revisions:
+                unknown = set(r.get("limits", {})) - set(default)
+                if unknown:
+                    # 修訂只能調整已有預設值的欄位；新增管制欄位要先加進 default（清洗與判定的欄位集合由它決定）
+                    raise ValueError(f"{tank} 的修訂含有未在 default 中的欄位：{', '.join(sorted(unknown))}")
+                effective = r.get("effective")
+                parsed.append(LimitRevision(
+                    None if effective in (None, "") else pd.Timestamp(effective),
+                    {c: _limit_pair(c, v) for c, v in r["limits"].items()},
+                ))
+            tanks[tank] = tuple(_sorted_revisions(parsed))
+        return cls(default, tanks, int(d.get("revision", 0)))
+
+    # 內容雜湊（不含 revision）：內容相同就是同一版，作為判定結果快取鍵的一部分
+    @property
+    def version(self) -> str:
+        payload = self.to_dict()
+        payload.pop("revision")
+        text = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+    # 1.1 某鍍槽某欄位的上下限時程：[(生效時間或 None, 下限, 上限), ...]，依生效時間遞增
+    def schedule(self, tank: str, col: str) -> tuple[tuple[pd.Timestamp | None, float, float], ...]:
+        steps = [(None, *self.default[col])]
+        for r in self.tanks.get(tank, ()):
+            if col in r.limits:
+                if r.effective is None:
+                    steps[0] = (None, *r.limits[col])
+                else:
+                    steps.append((r.effective, *r.limits[col]))
+        return tuple(steps)
+
+    # 目前（最新生效）的上下限，給 SPC、Gemini 提示詞與側邊欄顯示
+    def current(self, tank: str) -> dict[str, tuple[float,float]]:
+        return {c: self.schedule(tank, c)[-1][1:] for c in self.columns}
+
+    # 1.2 產生新設定（不修改原物件）：同一生效時間的修訂直接覆蓋，否則新增一筆
+    def revise(self, tank: str, limits: dict[str, tuple[float,float]],
+               effective: pd.Timestamp | None = None) -> "ThresholdConfig":
+        effective = None if effective is None else pd.Timestamp(effective).normalize()
+        revisions = [r for r in self.tanks.get(tank, ()) if r.effective != effective]
+        merged = dict(next((r.limits for r in self.tanks.get(tank, ()) if r.effective == effective), {}))
+        merged.update({c: _limit_pair(c, v) for c, v in limits.items()})
+        revisions.append(LimitRevision(effective, merged))
+        return replace(self, tanks={**self.tanks, tank: tuple(_sorted_revisions(revisions))})
+
+
+def _limit_pair(col: str, value) -> tuple[float,float]:
+    low, high = (float(v) for v in value)
+    if low > high:
+        raise ValueError(f"{col} 的下限 {low} 大於上限 {high}")
+    return low, high
+
+
+def _sorted_revisions(revisions: list[LimitRevision]) -> list[LimitRevision]:
+    return sorted(revisions, key=lambda r: (r.effective is not None, r.effective or pd.Timestamp.min))
+
+
+# 2. 讀寫設定檔
+def _is_yaml(path: str) -> bool:
+    return path.lower().endswith((".yaml", ".yml"))
+
+
+def load_threshold_config(path: str = THRESHOLD_CONFIG_PATH) -> ThresholdConfig:
+    """讀取設定檔；檔案不存在時回傳以 DEFAULT_THRESHOLDS 為預設、沒有修訂的設定。"""
+    if not os.path.exists(path):
+        return ThresholdConfig(dict(DEFAULT_THRESHOLDS))
+    with open(path, encoding="utf-8") as f:
+        if _is_yaml(path):
+            import yaml
+            data = yaml.safe_load(f) or {}
+        else:
+            data = json.load(f)
+    return ThresholdConfig.from_dict(data)
+
+
+def save_threshold_config(config: ThresholdConfig, path: str = THRESHOLD_CONFIG_PATH) -> ThresholdConfig:
+    """版次 +1 後寫入（先寫暫存檔再改名）；原本的檔案另存到 .threshold_history/。回傳寫入後的設定。"""
+    if os.path.exists(path):
+        previous = load_threshold_config(path)
+        archive_dir = os.path.join(os.path.dirname(os.path.abspath(path)), ARCHIVE_DIR_NAME)
+        os.makedirs(archive_dir, exist_ok=True)
+        stem, ext = os.path.splitext(os.path.basename(path))
+        shutil.copy2(path, os.path.join(archive_dir, f"{stem}.r{previous.revision}{ext}"))
+        config = replace(config, revision=max(config.revision, previous.revision) + 1)
+    else:
+        config = replace(config, revision=config.revision + 1)
+
+    payload = {**config.to_dict(), "saved_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        if _is_yaml(path):
+            import yaml
+            yaml.safe_dump(payload, f, allow_unicode=True, sort_keys=False)
+        else:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return config
+
+
+# 3. 逐列上下限：每列依電鍍開始時間以二分搜尋找到當時生效的修訂；沒有時間的列用最新的上下限
+def bound_arrays(schedule, dates_i8: np.ndarray) -> tuple[np.ndarray, np.ndarray] | tuple[float, float]:
+    if len(schedule) == 1:
+        return schedule[0][1], schedule[0][2]
+    starts = np.array([_NS_MIN if eff is None else eff.value for eff, _, _ in schedule], dtype=np.int64)
+    lows = np.array([low for _, low, _ in schedule], dtype="float64")
+    highs = np.array([high for _, _, high in schedule], dtype="float64")
+    pos = np.searchsorted(starts, dates_i8, side="right") - 1
+    pos = np.where(dates_i8 == _NS_MIN, len(schedule) - 1, pos)   # NaT 的 int64 表示即為最小值
+    return lows[pos], highs[pos]
+
+
+def _column_violations(values: np.ndarray, schedule, dates_i8: np.ndarray) -> np.ndarray:
+    low, high = bound_arrays(schedule, dates_i8)
+    # NaN 與任何數比較都是 False，因此 NaN 會落在超標（與 evaluate_thresholds 一致）
+    return ~((values >= low) & (values <= high))
+
+
+def _dates_i8(df: pd.DataFrame, date_col: str) -> np.ndarray:
+    if date_col not in df:
+        return np.full(len(df), _NS_MIN, dtype=np.int64)
+    return pd.to_datetime(df[date_col], errors="coerce").to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+
+@timed()
+def evaluate_config(df: pd.DataFrame, config: ThresholdConfig, tank: str,
+                    date_col: str = "電鍍開始時間") -> ThresholdResult:
+    dates = _dates_i8(df, date_col)
+    cols = config.columns
+    violations = np.empty((len(df), len(cols)), dtype=bool)
+    for j, col in enumerate(cols):
+        values = df[col].to_numpy(dtype="float64", na_value=np.nan)
+        violations[:, j] = _column_violations(values, config.schedule(tank, col), dates)
+    return ThresholdResult(cols, violations, df.index)
+
+
+# 4. 重新判定引擎：每份資料集記住「(欄位, 時程) → 超標欄」，設定改變時只重算時程有變的欄位，
+#    切換鍍槽或來回調整時先前算過的時程都還在；
+#    整體結果再以（資料集鍵, 鍍槽, 設定版本）快取，切回先前的設定不必重算
+@dataclass
+class _Evaluation:
+    n: int
+    dates_i8: np.ndarray
+    columns: OrderedDict = field(default_factory=OrderedDict)                     # (欄位, 時程) → 超標欄
+    results: OrderedDict = field(default_factory=OrderedDict)                     # (鍍槽, 版本) → (df, result)
+
+
+_evaluations: OrderedDict[str, _Evaluation] = OrderedDict()
+_evaluation_lock = threading.Lock()
+_EVALUATION_CACHE_MAX = 16
+_RESULTS_PER_DATASET = 8
+_COLUMNS_PER_DATASET = 32
+
+
+@timed()
+def apply_config(key: str, df: pd.DataFrame, result: ThresholdResult, config: ThresholdConfig, tank: str,
+                 date_col: str = "電鍍開始時間") -> tuple[pd.DataFrame, ThresholdResult]:
+    """
+    以設定重新判定共用資料集，回傳（狀態欄已更新的 df, 超標結果）。
+
+    key 為資料集鍵；df / result 為以預設上下限處理好的共用資料（唯讀，不會被修改）。
+    判定結果與原本完全相同時直接回傳原物件，不複製資料。
+    """
+    with _evaluation_lock:
+        ev = _evaluations.get(key)
+        if ev is None or ev.n != len(df):
+            ev = _evaluations[key] = _Evaluation(len(df), _dates_i8(df, date_col))
+        _evaluations.move_to_end(key)
+        while len(_evaluations) > _EVALUATION_CACHE_MAX:
+            _evaluations.popitem(last=False)
+        hit = ev.results.get((tank, config.version))
+        if hit is not None:
+            ev.results.move_to_end((tank, config.version))
+            return hit
+
+    cols = config.columns
+    violations = np.empty((len(df), len(cols)), dtype=bool)
+    for j, col in enumerate(cols):
+        slot = (col, config.schedule(tank, col))
+        with _evaluation_lock:
+            column = ev.columns.get(slot)
+            if column is not None:
+                ev.columns.move_to_end(slot)
+        if column is None:
+            values = df[col].to_numpy(dtype="float64", na_value=np.nan)
+            column = _column_violations(values, slot[1], ev.dates_i8)
+            with _evaluation_lock:
+                ev.columns[slot] = column
+                while len(ev.columns) > _COLUMNS_PER_DATASET:
+                    ev.columns.popitem(last=False)
+        violations[:, j] = column
+
+    if cols == result.columns and np.array_equal(violations, result.violations):
+        out = (df, result)
+    else:
+        violations.setflags(write=False)
+        new_result = ThresholdResult(cols, violations, df.index)
+        # 淺複製後只換掉狀態欄：其他欄位與共用資料集共用記憶體（df.assign 會整份深複製）
+        data = df.copy(deep=False)
+        data["狀態"] = pd.Categorical.from_codes(new_result.oos_rows.astype(np.int8), categories=["OK", "NG"])
+        out = (data, new_result)
+
+    with _evaluation_lock:
+        ev.results[(tank, config.version)] = out
+        while len(ev.results) > _RESULTS_PER_DATASET:
+            ev.results.popitem(last=False)
+    return out
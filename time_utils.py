@@ -0,0 +1,85 @@
+# 余振中 (Yu Chen Chung)
+# time_utils.py
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from perf_utils import timed
+
+# 每班 8 小時：00-08 夜班、08-16 早班、16-24 中班
+SHIFT_FREQ = "8h"
+
+# 各粒度的顯示格式
+PERIOD_FORMATS = {
+    "day": "%Y-%m-%d",
+    "week": "%Y-%m-%d",
+    "month": "%Y-%m",
+    "shift": "%Y-%m-%d %H:%M",
+}
+
+# 1. 時間分桶：日期只解析一次，各粒度的期間鍵一次算好，聚合結果依粒度記憶
+@dataclass
+class TimeBuckets:
+    frame: pd.DataFrame                 # 只含有效時間的列，index 為 datetime64
+    keys: dict[str, pd.DatetimeIndex]   # 各粒度的期間起點
+    _aggregates: dict[str, pd.DataFrame] = field(default_factory=dict)
+
+    def aggregate(self, freq: str = "month", sum_cols: tuple[str, ...] = (),
+                  mean_cols: tuple[str, ...] = ()) -> pd.DataFrame:
+        """
+        回傳該粒度的彙總表：period、period_str、count，以及 <欄位>_sum / <欄位>_mean。
+
+        已算過的欄位直接重用；需要新欄位時，連同已有欄位在同一次 groupby 中重算。
+        """
+        cached = self._aggregates.get(freq)
+        wanted = [f"{c}_sum" for c in sum_cols] + [f"{c}_mean" for c in mean_cols]
+        if cached is not None and all(w in cached.columns for w in wanted):
+            return cached
+
+        # 把已快取的欄位一起算，避免同粒度出現多份彙總表
+        if cached is not None:
+            sum_cols = list(dict.fromkeys([*sum_cols, *(c[:-4] for c in cached.columns if c.endswith("_sum"))]))
+            mean_cols = list(dict.fromkeys([*mean_cols, *(c[:-5] for c in cached.columns if c.endswith("_mean"))]))
+
+        value_cols = list(dict.fromkeys([*sum_cols, *mean_cols]))
+        values = self.frame[value_cols].apply(pd.to_numeric, errors="coerce")
+        grouped = values.groupby(self.keys[freq].to_numpy())
+
+        spec = {c: [] for c in value_cols}
+        for c in sum_cols:
+            spec[c].append("sum")
+        for c in mean_cols:
+            spec[c].append("mean")
+
+        out = pd.DataFrame({"count": grouped.size()})
+        if value_cols:
+            stats = grouped.agg(spec)
+            stats.columns = [f"{c}_{how}" for c, how in stats.columns]
+            out = out.join(stats)
+        out = out.rename_axis("period").reset_index()
+        out["period_str"] = out["period"].dt.strftime(PERIOD_FORMATS[freq])
+
+        self._aggregates[freq] = out
+        return out
+
+    @classmethod
+    def from_aggregates(cls, aggregates: dict[str, pd.DataFrame]) -> "TimeBuckets":
+        """只帶現成彙總表（例如增量更新維護的月彙總）；要求未包含的粒度或欄位時會拋出 KeyError。"""
+        return cls(pd.DataFrame(), {}, dict(aggregates))
+
+
+@timed()
+def build_time_buckets(df: pd.DataFrame, date_col: str) -> TimeBuckets:
+    times = pd.to_datetime(df[date_col], errors="coerce")
+    valid = times.notna().to_numpy()
+    idx = pd.DatetimeIndex(times[valid])
+
+    keys = {
+        "day": idx.floor("D"),
+        # 週以星期一為起點
+        "week": (idx - pd.to_timedelta(idx.dayofweek, unit="D")).floor("D"),
+        "month": idx.to_period("M").to_timestamp(),
+        "shift": idx.floor(SHIFT_FREQ),
+    }
+    frame = df.loc[valid].set_axis(idx, axis=0)
+    return TimeBuckets(frame, keys)
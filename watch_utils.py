@@ -0,0 +1,298 @@
+# 余振中 (Yu Chen Chung)
+# watch_utils.py
+# 投遞資料夾常駐程式：監看資料夾中新增 / 修改的 .xlsx，寫入完成後在背景行程池處理成共用資料集快照，
+# 儀表板只需讀取最新快照，開頁面時不必再解析 Excel
+#
+# 用法：DATASET_STORE_ARROW_DIR=/srv/processed python watch_utils.py /srv/drop [--quiet-seconds 2] [--workers 2] [--poll]
+#       儀表板以同樣的 DATASET_STORE_ARROW_DIR 啟動，就會自動改用資料夾中最新處理完成的工作簿
+#       加上 --history-dir history 時，處理完的工作簿也會匯入歷史資料庫（見 history_utils.py）
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import zipfile
+
+from cache_utils import file_hash
+from data_utils import load_sheets_compact_cached, load_sheets_projected_cached
+from fleet_utils import TANK_SHEET_PATTERN, discover_tank_sheets, process_pool
+from history_utils import import_workbook
+from store_utils import build_processed, dataset_key, write_snapshot
+from threshold_utils import THRESHOLD_CONFIG_PATH, load_threshold_config
+
+MANIFEST_NAME = "manifest.json"
+
+# 儀表板的兩種讀法各自的載入函式（與 app.py 的精簡欄位開關對應）
+VARIANT_LOADERS = {
+    "projected": load_sheets_projected_cached,
+    "compact": load_sheets_compact_cached,
+}
+
+# 1. 清單檔：記錄每個工作簿最後處理完成的內容雜湊、鍍槽與資料集鍵，儀表板讀這份決定要顯示哪個檔案
+def read_manifest(arrow_dir: str | None) -> dict:
+    if not arrow_dir:
+        return {}
+    try:
+        with open(os.path.join(arrow_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def latest_workbook(arrow_dir: str | None) -> dict | None:
+    manifest = read_manifest(arrow_dir)
+    entries = [e for e in manifest.get("workbooks", {}).values() if os.path.exists(e["path"])]
+    return max(entries, key=lambda e: e["processed_at"]) if entries else None
+
+
+def _write_manifest(arrow_dir: str, manifest: dict) -> None:
+    path = os.path.join(arrow_dir, MANIFEST_NAME)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+# 2. 寫入完成判定：Excel 存檔或網路磁碟複製時檔案會先出現一半，
+#    要大小 / 修改時間在靜止期間內不變，且 zip 結構完整（xlsx 是 zip 檔）才算寫完
+def _signature(path: str) -> tuple[int, int] | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def is_complete_xlsx(path: str) -> bool:
+    try:
+        with zipfile.ZipFile(path) as z:
+            return "[Content_Types].xml" in z.namelist() and z.testzip() is None
+    except (OSError, zipfile.BadZipFile):
+        return False
+
+
+def is_workbook(path: str) -> bool:
+    name = os.path.basename(path)
+    # ~$ 開頭是 Excel 開檔時的鎖定檔，. 開頭是暫存或快照
+    return name.lower().endswith(".xlsx") and not name.startswith(("~$", "."))
+
+
+# 3. 處理單一工作簿：與儀表板相同的流程（載入 → build_processed），結果寫成 Arrow 快照；在子行程執行
+def process_workbook(path: str, arrow_dir: str, thresholds: dict[str, tuple[float,float]],
+                     variants: tuple[str, ...] = ("projected", "compact"),
+                     pattern: str = TANK_SHEET_PATTERN, history_root: str | None = None) -> dict:
+    t0 = time.perf_counter()
+    digest = file_hash(path)
+    sheets = tuple(discover_tank_sheets(path, pattern))
+    keys, snapshots = {}, 0
+    for variant in variants:
+        # 載入函式本身也會在私有快取目錄留下解析快照（見 cache_utils.workbook_cache_dir），儀表板不必再解析同一份 Excel
+        raw_sheets = VARIANT_LOADERS[variant](path, sheets)
+        for sheet in sheets:
+            key = dataset_key(digest, sheet, thresholds, variant)
+            data, result, buckets = build_processed(raw_sheets[sheet], thresholds)
+            snapshots += write_snapshot(arrow_dir, key, data, result, buckets)
+            keys[f"{sheet}@{variant}"] = key
+    # 有指定歷史資料庫時一併匯入（只覆寫這個工作簿出現的鍍槽 / 月份分區）
+    if history_root:
+        import_workbook(path, history_root, pattern)
+    return {
+        "path": os.path.abspath(path),
+        "hash": digest,
+        "sheets": list(sheets),
+        "keys": keys,
+        "arrow_snapshots": snapshots,
+        "processed_at": time.time(),
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+# 4. 監看器：watchdog（inotify 等）收事件，沒有安裝時退回定期掃描；事件只標記待處理，實際處理交給去抖動迴圈
+#    快照以設定檔（與儀表板相同的 THRESHOLD_CONFIG）的預設上下限建立，資料集鍵才會與儀表板一致；
+#    各鍍槽的修訂由儀表板在快照上重新判定（threshold_utils.apply_config）。每次處理前重讀設定檔
+class FolderWatcher:
+    def __init__(self, drop_dir: str, arrow_dir: str,
+                 thresholds: dict[str, tuple[float,float]] | None = None,
+                 quiet_seconds: float = 2.0, workers: int = 2, poll_interval: float = 1.0,
+                 force_polling: bool = False, variants: tuple[str, ...] = ("projected", "compact"),
+                 history_root: str | None = None, config_path: str = THRESHOLD_CONFIG_PATH):
+        self.drop_dir = os.path.abspath(drop_dir)
+        self.arrow_dir = arrow_dir
+        self.thresholds = thresholds          # None：依設定檔
+        self.config_path = config_path
+        self.quiet_seconds = quiet_seconds
+        self.poll_interval = poll_interval
+        self.force_polling = force_polling
+        self.variants = variants
+        self.history_root = history_root
+        self._pool = process_pool(workers)    # 監看執行緒與 watchdog 執行緒同時存在，不能用 fork
+        self._lock = threading.Lock()
+        self._pending: dict[str, tuple[float, tuple[int, int] | None]] = {}  # 路徑 → (最後變動時間, 當時的簽章)
+        self._running: set[str] = set()
+        self._dirty: set[str] = set()        # 處理中又被修改，完成後要再處理一次
+        self._done: dict[str, tuple[int, int]] = {}   # 已處理過的簽章，定期掃描時用來略過沒變的檔案
+        self._stop = threading.Event()
+        self._observer = None
+        self._manifest = read_manifest(arrow_dir) or {"workbooks": {}}
+
+    # 4.1 任何來源（watchdog 事件、定期掃描、啟動時的初次掃描）都只呼叫 touch
+    def touch(self, path: str) -> None:
+        if not is_workbook(path):
+            return
+        path = os.path.abspath(path)
+        sig = _signature(path)
+        with self._lock:
+            if path in self._running:
+                self._dirty.add(path)
+            elif path not in self._pending or self._pending[path][1] != sig:
+                # 簽章沒變就不重新計時，否則定期掃描會讓靜止期間永遠到不了
+                self._pending[path] = (time.monotonic(), sig)
+
+    def _scan(self) -> None:
+        for entry in os.scandir(self.drop_dir):
+            if entry.is_file() and is_workbook(entry.path):
+                path = os.path.abspath(entry.path)
+                if self._done.get(path) != _signature(path):
+                    self.touch(path)
+
+    def _start_observer(self) -> bool:
+        if self.force_polling:
+            return False
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return False
+
+        watcher = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # 只看寫入類事件：開檔 / 關檔事件（包括本程式自己讀檔）不算變動
+                if event.is_directory or event.event_type not in ("created", "modified", "moved"):
+                    return
+                # Excel 常先寫暫存檔再改名，改名事件要看目的路徑
+                watcher.touch(getattr(event, "dest_path", "") or event.src_path)
+
+        self._observer = Observer()
+        self._observer.schedule(_Handler(), self.drop_dir, recursive=False)
+        self._observer.start()
+        return True
+
+    # 4.2 去抖動：靜止超過 quiet_seconds 且簽章沒變、zip 完整，才送進行程池
+    def _ready(self) -> list[str]:
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            for path, (changed_at, sig) in list(self._pending.items()):
+                if now - changed_at < self.quiet_seconds:
+                    continue
+                current = _signature(path)
+                if current is None:
+                    del self._pending[path]          # 檔案已被刪除或移走
+                elif current != sig:
+                    self._pending[path] = (now, current)   # 還在寫入，重新計時
+                else:
+                    del self._pending[path]
+                    self._running.add(path)
+                    ready.append(path)
+        # zip 檢查會讀整個檔案，放在鎖外面
+        complete = []
+        for path in ready:
+            if is_complete_xlsx(path):
+                complete.append(path)
+            else:
+                with self._lock:
+                    self._running.discard(path)
+                    self._pending[path] = (time.monotonic(), _signature(path))
+        return complete
+
+    def _submit(self, path: str) -> None:
+        sig = _signature(path)
+        # 送出時就記下簽章：spawn 的子行程啟動要一秒左右，處理期間定期掃描不該把沒變的檔案標成要重做
+        if sig is not None:
+            with self._lock:
+                self._done[path] = sig
+        thresholds = self.thresholds or load_threshold_config(self.config_path).default
+        future = self._pool.submit(process_workbook, path, self.arrow_dir, thresholds, self.variants,
+                                   history_root=self.history_root)
+        future.add_done_callback(lambda f: self._finished(path, sig, f))
+
+    def _finished(self, path: str, sig, future) -> None:
+        try:
+            entry = future.result()
+        except Exception as e:
+            print(f"{path}: 處理失敗 - {e}", file=sys.stderr, flush=True)
+            entry = None
+        with self._lock:
+            self._running.discard(path)
+            if sig is not None:
+                self._done[path] = sig
+            if entry is not None:
+                self._manifest.setdefault("workbooks", {})[path] = entry
+                self._manifest["updated_at"] = entry["processed_at"]
+                _write_manifest(self.arrow_dir, self._manifest)
+            if path in self._dirty:
+                self._dirty.discard(path)
+                self._pending[path] = (time.monotonic(), _signature(path))
+        if entry is not None:
+            print(f"{os.path.basename(path)}: {len(entry['sheets'])} 個鍍槽，{entry['seconds']:.2f}s", flush=True)
+
+    # 4.3 主迴圈：watchdog 模式只做去抖動；定期掃描模式每 poll_interval 另外掃一次資料夾
+    def run(self) -> None:
+        os.makedirs(self.arrow_dir, exist_ok=True)
+        using_events = self._start_observer()
+        print(f"監看 {self.drop_dir}（{'檔案系統事件' if using_events else '定期掃描'}），快照寫入 {self.arrow_dir}", flush=True)
+        self._scan()
+        last_scan = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                if not using_events and time.monotonic() - last_scan >= self.poll_interval:
+                    self._scan()
+                    last_scan = time.monotonic()
+                for path in self._ready():
+                    self._submit(path)
+                self._stop.wait(0.25)
+        finally:
+            self.close()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def close(self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        self._pool.shutdown(wait=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="投遞資料夾監看與背景處理")
+    parser.add_argument("drop_dir", help="放入 .xlsx 的資料夾")
+    parser.add_argument("--arrow-dir", default=os.getenv("DATASET_STORE_ARROW_DIR"),
+                        help="快照資料夾，需與儀表板的 DATASET_STORE_ARROW_DIR 相同（預設讀同名環境變數）")
+    parser.add_argument("--quiet-seconds", type=float, default=2.0, help="檔案靜止多久才視為寫入完成")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--poll", action="store_true", help="不用檔案系統事件，改為定期掃描（網路磁碟建議開啟）")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--history-dir", default=None, help="同時匯入歷史資料庫（Parquet 分區）的資料夾")
+    parser.add_argument("--config", default=THRESHOLD_CONFIG_PATH, help="規格上下限設定檔，需與儀表板相同（預設讀 THRESHOLD_CONFIG 環境變數）")
+    args = parser.parse_args()
+
+    if not args.arrow_dir:
+        print("請以 --arrow-dir 或環境變數 DATASET_STORE_ARROW_DIR 指定快照資料夾", file=sys.stderr)
+        return 2
+    watcher = FolderWatcher(args.drop_dir, args.arrow_dir, quiet_seconds=args.quiet_seconds,
+                            workers=args.workers, poll_interval=args.poll_interval, force_polling=args.poll,
+                            history_root=args.history_dir, config_path=args.config)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())